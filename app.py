@@ -3,23 +3,43 @@
 Запуск:  python app.py
 """
 
+import asyncio
+import atexit
+import bisect
+import contextlib
+import functools
+import gzip
+import hashlib
+import json
 import logging
 import os
+import sqlite3
+import sys
 import threading
 import time
-from datetime import datetime, timedelta
-from typing import Any, List, Dict, Optional, cast
+import zlib
+from collections import deque
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Deque, Iterable, Iterator, List, Dict, Optional, Set, Tuple, TypeVar, cast
+from urllib.parse import urlparse
 
 from dotenv import load_dotenv
-from flask import Flask, jsonify
+from flask import Flask, Response, g, jsonify, request
+from werkzeug.serving import make_server
+
+from feed_snapshot import write_snapshot
+from feed_url import split_unix_feed_url
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, Counter, Gauge, Histogram, Registry
 
 try:
     # Импортируем Telethon для работы с Telegram API
-    from telethon import TelegramClient  # type: ignore
+    from telethon import TelegramClient, events  # type: ignore
     from telethon.errors import (  # type: ignore
         ChannelInvalidError,
         ChannelPrivateError,
         ChannelPublicGroupNaError,
+        FloodWaitError,
         RPCError,
     )
 except ModuleNotFoundError as exc:
@@ -29,6 +49,22 @@ except ModuleNotFoundError as exc:
         "pip install -r requirements.txt"
     ) from exc
 
+# Необязательные кодеки для сжатия фида: если библиотек нет, отдаём только gzip
+try:
+    import brotli  # type: ignore
+except ModuleNotFoundError:
+    brotli = None
+try:
+    import zstandard  # type: ignore
+except ModuleNotFoundError:
+    zstandard = None
+
+# Необязательный многопоточный WSGI-сервер для режима FEED_SERVER=waitress
+try:
+    import waitress  # type: ignore
+except ModuleNotFoundError:
+    waitress = None
+
 # Загружаем переменные окружения из .env
 load_dotenv()
 
@@ -63,296 +99,1701 @@ except ValueError as exc:
 API_HASH_VALUE: str = API_HASH_RAW
 PHONE_VALUE: str = PHONE_RAW
 CHANNEL_USERNAME_VALUE: str = CHANNEL_USERNAME_RAW
+DEFAULT_HASHTAG = "#showtitrvibe"
+
+
+@dataclass(frozen=True)
+class ChannelSource:
+    """Канал, из которого собираются посты, и хештеги, по которым они отбираются."""
+
+    # username канала без @, в нижнем регистре
+    name: str
+    hashtags: Tuple[str, ...]
+
+    def matches(self, text: str) -> bool:
+        lowered = text.lower()
+        return any(hashtag in lowered for hashtag in self.hashtags)
+
+
+def _parse_sources(raw: str, default_channel: str) -> Tuple[ChannelSource, ...]:
+    """Пары канал:#хештег через запятую; хештеги одного канала объединяются.
+
+    Пустая строка — один канал CHANNEL_USERNAME с #showtitrvibe, как раньше.
+    """
+    hashtags: Dict[str, List[str]] = {}
+    for item in raw.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        channel, _, hashtag = item.partition(":")
+        name = channel.strip().lstrip("@").lower()
+        if not name:
+            raise SystemExit(f"Проверь .env — в CHANNEL_SOURCES не указан канал: {item!r}")
+        hashtag = hashtag.strip().lower() or DEFAULT_HASHTAG
+        if not hashtag.startswith("#"):
+            hashtag = f"#{hashtag}"
+        channel_hashtags = hashtags.setdefault(sys.intern(name), [])
+        if hashtag not in channel_hashtags:
+            channel_hashtags.append(hashtag)
+    if not hashtags:
+        hashtags[sys.intern(default_channel.lstrip("@").lower())] = [DEFAULT_HASHTAG]
+    return tuple(ChannelSource(name, tuple(channel_hashtags)) for name, channel_hashtags in hashtags.items())
+
+
+# Каналы-источники по порядку: при кросспостах остаётся копия из канала, указанного раньше
+CHANNEL_SOURCES = _parse_sources(os.getenv("CHANNEL_SOURCES", ""), CHANNEL_USERNAME_VALUE)
+SOURCES_BY_NAME: Dict[str, ChannelSource] = {source.name: source for source in CHANNEL_SOURCES}
+# Канал, к которому относятся посты, сохранённые до появления нескольких источников
+LEGACY_CHANNEL = CHANNEL_USERNAME_VALUE.lstrip("@").lower()
+
+# Общий бюджет запросов истории к Telegram на все каналы сразу (запросов в секунду, 0 — без ограничения)
+TELEGRAM_REQUESTS_PER_SECOND = float(os.getenv("TELEGRAM_REQUESTS_PER_SECOND", "2"))
+# Сколько сообщений Telethon получает одним запросом GetHistory / Search
+TELEGRAM_HISTORY_BATCH = 100
+
+# Чтение всей истории канала идёт кусками примерно по столько сообщений: после
+# каждого куска посты попадают в кэш, а место остановки — в хранилище
+BACKFILL_CHUNK = int(os.getenv("BACKFILL_CHUNK", "10000"))
+
+# Как собирать посты: scan — читать историю канала целиком и искать хештег у себя,
+# search — поиск Telegram по хештегу: приходят только сообщения с ним
+COLLECT_MODES = ("scan", "search")
+COLLECT_MODE = os.getenv("COLLECT_MODE", "scan").strip().lower()
+if COLLECT_MODE not in COLLECT_MODES:
+    raise SystemExit(f"Проверь .env — COLLECT_MODE должен быть одним из: {', '.join(COLLECT_MODES)}.")
 
 # Flask-приложение
 app = Flask(__name__)
 
+# Файл SQLite, где между перезапусками хранятся посты и отметки синхронизации
+POSTS_DB_PATH = os.getenv("POSTS_DB_PATH", "kinotip_posts.sqlite3")
+
+# Сервер фида: dev — встроенный сервер Flask, waitress — пул потоков waitress.
+# Процесс один: кэш, Telethon-клиент и обновление общие для всех потоков
+FEED_SERVER = os.getenv("FEED_SERVER", "dev").strip().lower()
+FEED_SERVER_THREADS = int(os.getenv("FEED_SERVER_THREADS", "8"))
+
+# Права на Unix-сокет фида (восьмерично): доступ к фиду — через права файловой системы
+FEED_SOCKET_MODE = int(os.getenv("FEED_SOCKET_MODE", "660"), 8)
+
+# Двоичный снимок кэша для бота на той же машине (читается через mmap); пусто — не пишем
+FEED_SNAPSHOT_PATH = os.getenv("FEED_SNAPSHOT_PATH", "").strip()
+# Изменения кэша копятся столько секунд и пишутся в SQLite и снимок одной пачкой
+CACHE_WRITE_DELAY = float(os.getenv("CACHE_WRITE_DELAY", "0.5"))
+
+# Схемы фида: 1 — исходная (текст в text/caption/content, id дублирует message_id),
+# 2 — компактная, каждое поле по одному разу
+FEED_SCHEMAS = (1, 2)
+COMPACT_FIELDS = ("message_id", "type", "text", "link", "channel", "date")
+# Размер страницы компактного фида (?after=&limit=)
+FEED_PAGE_DEFAULT = 100
+FEED_PAGE_MAX = 1000
+# Сколько постов кодировать за один кусок потокового ответа (?stream=1)
+FEED_STREAM_BATCH = 500
+
+
+# Пост однозначно задаётся каналом и message_id: номера сообщений в разных каналах совпадают
+PostKey = Tuple[str, int]
+
+
+@dataclass(frozen=True, slots=True)
+class ChannelPost:
+    """Пост канала в кэше.
+
+    Без __dict__ (slots), текст хранится один раз, тип и канал —
+    интернированные строки. Дубли исходной схемы фида собираются только
+    при сериализации.
+    """
+
+    message_id: int
+    type: str
+    text: str
+    link: Optional[str] = None
+    # Канал-источник (username без @) и дата сообщения (unix-время)
+    channel: str = ""
+    date: int = 0
+
+    @property
+    def key(self) -> PostKey:
+        return (self.channel, self.message_id)
+
+    def to_feed(self) -> Dict[str, Any]:
+        """Пост в исходной схеме фида (1)."""
+        payload: Dict[str, Any] = {
+            "id": str(self.message_id),
+            "message_id": self.message_id,
+            "text": self.text,
+            "caption": self.text,
+            "type": self.type,
+            "content": self.text,
+            "channel": self.channel,
+            "date": self.date,
+        }
+        if self.link:
+            payload["link"] = self.link
+        return payload
+
+    def to_compact(self, fields: Tuple[str, ...] = COMPACT_FIELDS) -> Dict[str, Any]:
+        """Пост в компактной схеме 2: только выбранные поля, без дублей."""
+        payload: Dict[str, Any] = {}
+        for name in fields:
+            value = getattr(self, name)
+            if value is not None:
+                payload[name] = value
+        return payload
+
+    def serialize(self, schema: int) -> Dict[str, Any]:
+        """Пост в нужной схеме фида."""
+        return self.to_compact() if schema == 2 else self.to_feed()
+
+
+def _feed_order(post: ChannelPost) -> Tuple[int, int, str]:
+    """Порядок кэша: от новых к старым по дате, при равной дате — по message_id, затем по каналу."""
+    return (-post.date, -post.message_id, post.channel)
+
+
 # Небольшой кэш, который наполняем при старте
-cached_posts: List[Dict[str, Any]] = []
-
-def create_client() -> Optional[TelegramClient]:
-    """Создаёт и авторизует Telethon-клиент. Возвращает None при ошибке авторизации."""
-    import os
-    import asyncio
-    session_name = "kinotip_parser"
-    session_file = f"{session_name}.session"
-    
-    # ПРОВЕРЯЕМ: есть ли файл сессии?
-    has_session = os.path.exists(session_file)
-    
-    # Создаём event loop для текущего потока
-    # В новом потоке может не быть event loop, поэтому создаём новый
-    # В Python 3.10+ get_event_loop() устарел, используем get_running_loop() или new_event_loop()
-    try:
-        loop = asyncio.get_running_loop()
-    except RuntimeError:
-        # Нет запущенного loop, создаём новый
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-    
-    # Создаём клиент с явным указанием loop
-    client = TelegramClient(session_name, API_ID_INT, API_HASH_VALUE, loop=loop)
-    
-    try:
-        # Подключаемся
-        loop.run_until_complete(client.connect())
-        
-        # Если файл сессии ЕСТЬ - проверяем авторизацию
-        if has_session:
-            logger.info("Файл сессии найден: %s", session_file)
-            is_authorized = loop.run_until_complete(client.is_user_authorized())
-            if is_authorized:
-                logger.info("✅ Сессия авторизована")
+cached_posts: List[ChannelPost] = []
+# Кэш меняют плановое обновление и обработчики событий Telethon из разных потоков
+cache_lock = threading.Lock()
+
+
+@dataclass(frozen=True)
+class FeedSnapshot:
+    """Версия кэша, сериализованная один раз: тело ответа /feed и валидаторы для условных GET.
+
+    Сжатые варианты тела (gzip, br, zstd) складываются в encoded при первом запросе.
+    """
+
+    version: int
+    body: bytes
+    etag: str
+    last_modified: float
+    encoded: Dict[str, bytes] = field(default_factory=dict)
+
+
+def _compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "gzip":
+        # mtime=0 — одинаковое тело даёт одинаковые байты
+        return gzip.compress(body, compresslevel=6, mtime=0)
+    if encoding == "br" and brotli is not None:
+        return brotli.compress(body, quality=9)
+    if encoding == "zstd" and zstandard is not None:
+        return zstandard.ZstdCompressor(level=9).compress(body)
+    raise ValueError(f"Неподдерживаемое сжатие: {encoding}")
+
+
+# Кодировки, которые умеем отдавать, в порядке предпочтения сервера
+FEED_ENCODINGS: Tuple[str, ...] = tuple(
+    encoding
+    for encoding, available in (("zstd", zstandard is not None), ("br", brotli is not None), ("gzip", True))
+    if available
+)
+
+
+@dataclass(frozen=True)
+class FeedChange:
+    """Изменение кэша, получившее свой номер версии (для /feed/changes)."""
+
+    version: int
+    added: Tuple[ChannelPost, ...]
+    edited: Tuple[ChannelPost, ...]
+    removed: Tuple[PostKey, ...]
+
+
+def _serialize_feed(posts: List[ChannelPost], version: int, schema: int) -> bytes:
+    payload = {"version": version, "posts": [post.serialize(schema) for post in posts]}
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+# Версия кэша монотонно растёт при каждом изменении и переживает перезапуски
+cache_version: int = 0
+cache_updated_at: float = time.time()
+# Журнал последних изменений: по нему /feed/changes отдаёт дельту с нужной версии
+CHANGELOG_SIZE = 1000
+changelog: Deque[FeedChange] = deque(maxlen=CHANGELOG_SIZE)
+# Сериализованные снимки текущей версии по схемам; сбрасываются при каждом изменении кэша
+_feed_snapshots: Dict[int, FeedSnapshot] = {}
+
+
+
+@dataclass
+class Backfill:
+    """Чекпоинт чтения истории канала от новых сообщений к старым.
+
+    Хранится в sync_state после каждого куска, поэтому после падения или
+    долгого FloodWait чтение продолжается с offset_id, а не с начала.
+    """
+
+    # id самого нового сообщения на момент старта (0 — ещё не узнали); после
+    # окончания он становится отметкой канала
+    top_id: int = 0
+    # Следующий кусок — сообщения с id меньше offset_id
+    offset_id: int = 0
+    # Ширина следующего куска в id сообщений
+    span: int = BACKFILL_CHUNK
+    # Читать поиском Telegram по хештегам; verify — сверка поиска полным чтением
+    search: bool = False
+    verify: bool = False
+    posts: int = 0
+
+    @property
+    def progress(self) -> float:
+        if not self.top_id:
+            return 0.0
+        return 1.0 - max(self.offset_id - 1, 0) / self.top_id
+
+
+@dataclass
+class SourceState:
+    """Состояние синхронизации одного канала-источника."""
+
+    # Наибольший message_id, который мы уже видели в канале (high-water mark).
+    # Инкрементальное обновление запрашивает только сообщения новее него.
+    last_seen_message_id: int = 0
+    last_sync: Optional[float] = None
+    last_error: Optional[str] = None
+    # Сколько секунд просил подождать последний FloodWait (0 — последняя ошибка не FloodWait)
+    flood_wait: int = 0
+    # Незаконченное чтение истории канала
+    backfill: Optional[Backfill] = None
+
+    def health(self) -> Dict[str, Any]:
+        return {
+            "last_seen_message_id": self.last_seen_message_id,
+            "last_sync": datetime.fromtimestamp(self.last_sync).isoformat(timespec="seconds") if self.last_sync else None,
+            "last_error": self.last_error,
+            "backfill": (
+                {
+                    "offset_id": self.backfill.offset_id,
+                    "progress": round(self.backfill.progress, 3),
+                    "posts": self.backfill.posts,
+                }
+                if self.backfill
+                else None
+            ),
+        }
+
+
+source_states: Dict[str, SourceState] = {source.name: SourceState() for source in CHANNEL_SOURCES}
+# Канал по peer id (chat_id из Telethon): события удаления приходят без username
+source_chat_ids: Dict[int, str] = {}
+
+# Полный пересбор кэша (всей истории канала) делаем редко — раз в N дней,
+# чтобы подхватить правки и удаления старых постов
+FULL_RESCAN_INTERVAL = timedelta(days=float(os.getenv("FULL_RESCAN_INTERVAL_DAYS", "7")))
+last_full_rescan: Optional[datetime] = None
+# В режиме search плановый полный пересбор раз в N дней читает историю целиком
+# и сверяет её с тем, что нашёл поиск Telegram
+SEARCH_VERIFY_INTERVAL = timedelta(days=float(os.getenv("SEARCH_VERIFY_INTERVAL_DAYS", "30")))
+last_search_verify: Optional[datetime] = None
+
+# Режим реального времени: новые, изменённые и удалённые посты приходят
+# событиями Telethon, а плановое обновление превращается в редкую сверку
+REALTIME_UPDATES = os.getenv("REALTIME_UPDATES", "1").strip().lower() not in {"0", "false", "no", ""}
+SCHEDULE_HOURS: Tuple[int, ...] = (0,) if REALTIME_UPDATES else (0, 12)
+
+# Метрики парсера для /metrics (формат Prometheus)
+metrics_registry = Registry()
+REFRESH_SECONDS = Histogram(
+    "kinotip_refresh_duration_seconds", "Длительность обновления кэша из канала", ["kind"], registry=metrics_registry
+)
+MESSAGES_SCANNED = Counter(
+    "kinotip_messages_scanned_total",
+    "Сообщений канала просмотрено при обновлениях",
+    ["channel"],
+    registry=metrics_registry,
+)
+MESSAGES_KEPT = Counter(
+    "kinotip_messages_kept_total", "Просмотренных сообщений с нужным хештегом", ["channel"], registry=metrics_registry
+)
+SEARCH_REJECTED = Counter(
+    "kinotip_search_rejected_total",
+    "Сообщения из поиска Telegram без хештега (отброшены проверкой)",
+    ["channel"],
+    registry=metrics_registry,
+)
+SEARCH_MISSED = Counter(
+    "kinotip_search_missed_total",
+    "Посты с хештегом, которых не нашёл поиск Telegram (по сверке полным чтением)",
+    ["channel"],
+    registry=metrics_registry,
+)
+REFRESH_RETRIES = Counter(
+    "kinotip_refresh_retries_total", "Повторные попытки получить посты при обновлении", registry=metrics_registry
+)
+REFRESH_FAILURES = Counter(
+    "kinotip_refresh_failures_total", "Обновления, не получившие постов после всех попыток", registry=metrics_registry
+)
+TELEGRAM_RECONNECTS = Counter(
+    "kinotip_telegram_reconnects_total", "Переподключения Telethon-клиента", registry=metrics_registry
+)
+TELEGRAM_CONNECT_ERRORS = Counter(
+    "kinotip_telegram_connect_errors_total", "Неудачные попытки подключения к Telegram", registry=metrics_registry
+)
+FLOOD_WAITS = Counter(
+    "kinotip_telegram_flood_waits_total", "FloodWait от Telegram при чтении канала", registry=metrics_registry
+)
+FLOOD_WAIT_SECONDS = Counter(
+    "kinotip_telegram_flood_wait_seconds_total", "Суммарное ожидание, запрошенное FloodWait", registry=metrics_registry
+)
+HTTP_REQUEST_SECONDS = Histogram(
+    "kinotip_http_request_duration_seconds",
+    "Время обработки HTTP-запросов фида (до первого байта тела)",
+    ["endpoint", "status"],
+    registry=metrics_registry,
+)
+Gauge("kinotip_cache_posts", "Постов в кэше", registry=metrics_registry).set_function(lambda: len(cached_posts))
+Gauge("kinotip_cache_version", "Версия кэша", registry=metrics_registry).set_function(lambda: cache_version)
+Gauge("kinotip_cache_age_seconds", "Секунд с последнего изменения кэша", registry=metrics_registry).set_function(
+    lambda: time.time() - cache_updated_at
+)
+
+# Параметры переподключения Telethon-клиента: экспоненциальная задержка между попытками
+RECONNECT_ATTEMPTS = 5
+RECONNECT_BASE_DELAY = 2.0
+RECONNECT_MAX_DELAY = 60.0
+
+T = TypeVar("T")
+
+
+class ClientUnavailableError(RuntimeError):
+    """Telethon-клиент не удалось подключить или авторизовать."""
+
+
+class TelegramClientManager:
+    """Держит один долгоживущий Telethon-клиент на выделенном потоке с event loop.
+
+    Все обращения к Telegram выполняются через run(): корутина планируется
+    на loop клиента, а вызывающий поток ждёт результат. Если соединение
+    потеряно, клиент переподключается с экспоненциальной задержкой.
+    """
+
+    def __init__(self, session_name: str = "kinotip_parser") -> None:
+        self.session_name = session_name
+        self.session_file = f"{session_name}.session"
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._client: Optional[TelegramClient] = None
+        self._connect_lock: Optional[asyncio.Lock] = None
+        self._start_lock = threading.Lock()
+        self.state = "disconnected"
+        self.state_since = time.time()
+        self.last_error: Optional[str] = None
+        self.reconnects = 0
+        self._ever_connected = False
+        self._event_handlers: List[Tuple[Callable[..., Any], Any]] = []
+
+    def start(self) -> None:
+        """Запускает поток с event loop клиента (если ещё не запущен)."""
+        with self._start_lock:
+            if self._thread and self._thread.is_alive():
+                return
+            loop = asyncio.new_event_loop()
+            ready = threading.Event()
+
+            def worker() -> None:
+                asyncio.set_event_loop(loop)
+                self._connect_lock = asyncio.Lock()
+                loop.call_soon(ready.set)
+                loop.run_forever()
+
+            self._loop = loop
+            self._thread = threading.Thread(target=worker, name="telethon-loop", daemon=True)
+            self._thread.start()
+            ready.wait()
+
+    def stop(self) -> None:
+        """Отключает клиент и останавливает loop."""
+        loop = self._loop
+        if loop is None or not loop.is_running():
+            return
+        client = self._client
+        if client is not None and client.is_connected():
+            try:
+                asyncio.run_coroutine_threadsafe(client.disconnect(), loop).result(timeout=10)  # type: ignore[arg-type]
+            except Exception:
+                pass  # Игнорируем ошибки отключения
+        loop.call_soon_threadsafe(loop.stop)
+        self._set_state("disconnected")
+
+    def connect(self, timeout: Optional[float] = None) -> bool:
+        """Подключает и авторизует клиент. Возвращает True, если клиент готов к работе."""
+        self.start()
+        assert self._loop is not None
+        future = asyncio.run_coroutine_threadsafe(self._ensure_connected(), self._loop)
+        return future.result(timeout) is not None
+
+    def run(
+        self,
+        func: Callable[[TelegramClient], Awaitable[T]],
+        timeout: Optional[float] = None,
+    ) -> T:
+        """Выполняет func(client) на loop клиента и возвращает результат."""
+        self.start()
+        assert self._loop is not None
+        future = asyncio.run_coroutine_threadsafe(self._call(func), self._loop)
+        return future.result(timeout)
+
+    def add_event_handler(self, callback: Callable[..., Any], event: Any) -> None:
+        """Регистрирует обработчик событий; он переживает переподключения клиента."""
+        self._event_handlers.append((callback, event))
+        client = self._client
+        if client is not None and self._loop is not None:
+            self._loop.call_soon_threadsafe(client.add_event_handler, callback, event)
+
+    def health(self) -> Dict[str, Any]:
+        """Текущее состояние клиента для диагностики."""
+        return {
+            "state": self.state,
+            "since": datetime.fromtimestamp(self.state_since).isoformat(timespec="seconds"),
+            "last_error": self.last_error,
+            "reconnects": self.reconnects,
+        }
+
+    def _set_state(self, state: str, error: Optional[str] = None) -> None:
+        if state != self.state:
+            logger.info("Telethon-клиент: %s -> %s", self.state, state)
+            self.state = state
+            self.state_since = time.time()
+        if error is not None:
+            self.last_error = error
+
+    async def _call(self, func: Callable[[TelegramClient], Awaitable[T]]) -> T:
+        client = await self._ensure_connected()
+        if client is None:
+            raise ClientUnavailableError(f"Telethon-клиент недоступен ({self.state})")
+        try:
+            return await func(client)
+        except (ConnectionError, OSError) as error:
+            # Соединение оборвалось — следующий вызов переподключится
+            self._set_state("disconnected", str(error))
+            raise
+
+    async def _ensure_connected(self) -> Optional[TelegramClient]:
+        assert self._connect_lock is not None
+        async with self._connect_lock:
+            client = self._client
+            if client is not None and self.state == "connected" and client.is_connected():
                 return client
-            else:
-                logger.warning("⚠️ Файл сессии есть, но авторизация не прошла!")
-                logger.warning("Возможно, сессия истекла или повреждена.")
-                # Отключаемся и возвращаем None
-                try:
-                    loop.run_until_complete(client.disconnect())
-                except Exception:
-                    pass  # Игнорируем ошибки отключения
-                logger.error("❌ Требуется переавторизация. Удалите файл %s и создайте новую сессию", session_file)
+            if self.state == "unauthorized":
+                # Без рабочей сессии переподключение не поможет
                 return None
-        
+            if self.state == "connected":
+                self._set_state("disconnected", "соединение потеряно")
+
+            delay = RECONNECT_BASE_DELAY
+            for attempt in range(1, RECONNECT_ATTEMPTS + 1):
+                self._set_state("connecting")
+                try:
+                    client = await self._connect()
+                except Exception as error:
+                    error_str = str(error).lower()
+                    # "database is locked" — файл сессии занят другим процессом
+                    if "locked" in error_str:
+                        logger.warning("Файл сессии временно заблокирован другим процессом.")
+                    else:
+                        logger.error("Ошибка при подключении клиента: %s", error)
+                    TELEGRAM_CONNECT_ERRORS.inc()
+                    self._set_state("disconnected", str(error))
+                else:
+                    if client is None:
+                        return None
+                    if self._ever_connected:
+                        self.reconnects += 1
+                        TELEGRAM_RECONNECTS.inc()
+                        logger.info("Telethon-клиент переподключён (попытка %d)", attempt)
+                    self._ever_connected = True
+                    self._set_state("connected")
+                    return client
+
+                if attempt < RECONNECT_ATTEMPTS:
+                    logger.warning(
+                        "Попытка подключения %d/%d не удалась. Ждём %.0f сек...",
+                        attempt,
+                        RECONNECT_ATTEMPTS,
+                        delay,
+                    )
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, RECONNECT_MAX_DELAY)
+            return None
+
+    async def _connect(self) -> Optional[TelegramClient]:
+        """Подключает клиент и проверяет авторизацию. Возвращает None, если сессия не годится."""
+        # ПРОВЕРЯЕМ: есть ли файл сессии?
+        has_session = os.path.exists(self.session_file)
+
+        if self._client is None:
+            # Клиент создаём внутри loop, чтобы Telethon привязался к нему
+            self._client = TelegramClient(self.session_name, API_ID_INT, API_HASH_VALUE)
+            for callback, event in self._event_handlers:
+                self._client.add_event_handler(callback, event)
+        client = self._client
+        if client.is_connected():
+            await client.disconnect()  # type: ignore[misc]
+        await client.connect()
+
+        if await client.is_user_authorized():
+            logger.info("✅ Сессия авторизована (%s)", self.session_file)
+            return client
+
+        # Если файл сессии ЕСТЬ, но авторизация не прошла — нужна переавторизация
+        if has_session:
+            logger.warning("⚠️ Файл сессии есть, но авторизация не прошла!")
+            logger.warning("Возможно, сессия истекла или повреждена.")
+            logger.error("❌ Требуется переавторизация. Удалите файл %s и создайте новую сессию", self.session_file)
+            await client.disconnect()  # type: ignore[misc]
+            self._set_state("unauthorized", "сессия не авторизована")
+            return None
+
         # Если файла НЕТ - пытаемся авторизоваться
         logger.info("Файл сессии НЕ найден, требуется авторизация")
         try:
-            client.start(phone=PHONE_VALUE)
+            await client.start(phone=PHONE_VALUE)  # type: ignore[misc]
             logger.info("✅ Авторизация успешна, файл сессии создан")
             return client
         except EOFError:
             logger.error("❌ Нет интерактивного ввода и нет файла сессии!")
             logger.error("Запустите 'python app.py' локально один раз для создания файла сессии")
-            try:
-                loop.run_until_complete(client.disconnect())
-            except:
-                pass
+            await client.disconnect()  # type: ignore[misc]
+            self._set_state("unauthorized", "нет файла сессии")
             return None
-    except Exception as e:
-        error_str = str(e).lower()
-        # Игнорируем ошибки "database is locked" - это нормально при параллельном доступе
-        if "database is locked" in error_str or "locked" in error_str:
-            logger.warning("Файл сессии временно заблокирован другим процессом. Пропускаем обновление.")
-        else:
-            logger.error("Ошибка при создании клиента: %s", e)
-        try:
-            if client and client.is_connected():
-                loop.run_until_complete(client.disconnect())
-        except:
-            pass
-        return None
+
+
+class RateBudget:
+    """Общий бюджет запросов к Telegram на все каналы: не чаще rate запросов в секунду.
+
+    Живёт на loop Telethon-клиента; каждый запрос занимает следующий свободный
+    слот, поэтому параллельные выборки каналов делят бюджет, а не умножают его.
+    После FloodWait бюджет закрывается на запрошенное время для всех каналов.
+    """
+
+    def __init__(self, rate: float) -> None:
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next_slot = 0.0
+        self._blocked_until = 0.0
+
+    async def acquire(self) -> None:
+        now = time.monotonic()
+        slot = max(now, self._next_slot, self._blocked_until)
+        self._next_slot = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    def block_for(self, seconds: float) -> None:
+        self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+
+
+rate_budget = RateBudget(TELEGRAM_REQUESTS_PER_SECOND)
+
+
+class PostStore:
+    """Хранит посты и отметки синхронизации в SQLite (WAL), чтобы сервер стартовал «тёплым»."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS sync_state (key TEXT PRIMARY KEY, value TEXT NOT NULL)"
+            )
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(posts)")}
+            if columns and "channel" not in columns:
+                self._migrate_single_channel()
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS posts ("
+                " channel TEXT NOT NULL,"
+                " message_id INTEGER NOT NULL,"
+                " type TEXT NOT NULL,"
+                " text TEXT NOT NULL,"
+                " link TEXT,"
+                " date INTEGER NOT NULL DEFAULT 0,"
+                " PRIMARY KEY (channel, message_id)"
+                ")"
+            )
+            # Случайный id экземпляра хранилища: версии кэша нового хранилища снова
+            # начинаются с 1, и без него клиент мог бы получить 304 по чужой версии
+            row = self._conn.execute("SELECT value FROM sync_state WHERE key = 'store_id'").fetchone()
+            if row:
+                self.store_id: str = json.loads(row[0])
+            else:
+                self.store_id = os.urandom(6).hex()
+                self._conn.execute(
+                    "INSERT INTO sync_state (key, value) VALUES ('store_id', ?)", (json.dumps(self.store_id),)
+                )
+
+    def _migrate_single_channel(self) -> None:
+        """Хранилище одного канала: посты получают канал LEGACY_CHANNEL, ключ — (канал, message_id).
+
+        Даты у старых постов нет, поэтому отметки синхронизации сбрасываются:
+        первое обновление перечитает каналы целиком и проставит даты.
+        """
+        self._conn.execute("ALTER TABLE posts RENAME TO posts_single_channel")
+        self._conn.execute(
+            "CREATE TABLE posts ("
+            " channel TEXT NOT NULL,"
+            " message_id INTEGER NOT NULL,"
+            " type TEXT NOT NULL,"
+            " text TEXT NOT NULL,"
+            " link TEXT,"
+            " date INTEGER NOT NULL DEFAULT 0,"
+            " PRIMARY KEY (channel, message_id)"
+            ")"
+        )
+        self._conn.execute(
+            "INSERT INTO posts (channel, message_id, type, text, link)"
+            " SELECT ?, message_id, type, text, link FROM posts_single_channel",
+            (LEGACY_CHANNEL,),
+        )
+        self._conn.execute("DROP TABLE posts_single_channel")
+        self._conn.execute("DELETE FROM sync_state WHERE key IN ('last_seen_message_id', 'last_full_rescan')")
+        logger.info("Хранилище %s переведено на несколько каналов (посты отнесены к %s)", self.path, LEGACY_CHANNEL)
+
+    def load_posts(self) -> List[ChannelPost]:
+        """Возвращает сохранённые посты от новых к старым."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT message_id, type, text, link, channel, date FROM posts"
+                " ORDER BY date DESC, message_id DESC, channel"
+            ).fetchall()
+        return [
+            _make_post(message_id, text, post_type, link, channel, date)
+            for message_id, post_type, text, link, channel, date in rows
+        ]
+
+    def apply_changes(
+        self,
+        upserts: List[ChannelPost],
+        removed_keys: Iterable[PostKey] = (),
+        version: Optional[int] = None,
+    ) -> None:
+        """Сохраняет добавленные/изменённые посты, удаляет убранные и (если передана) версию кэша."""
+        with self._lock, self._conn:
+            self._conn.executemany("DELETE FROM posts WHERE channel = ? AND message_id = ?", list(removed_keys))
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO posts (message_id, type, text, link, channel, date) VALUES (?, ?, ?, ?, ?, ?)",
+                [self._row(post) for post in upserts],
+            )
+            if version is not None:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO sync_state (key, value) VALUES ('cache_version', ?)",
+                    (json.dumps(version),),
+                )
+
+    def get_state(self, key: str) -> Optional[Any]:
+        """Читает отметку синхронизации (значение хранится как JSON)."""
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM sync_state WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set_state(self, key: str, value: Any) -> None:
+        """Сохраняет отметку синхронизации."""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sync_state (key, value) VALUES (?, ?)", (key, json.dumps(value))
+            )
+
+    def delete_state(self, key: str) -> None:
+        """Удаляет отметку синхронизации."""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM sync_state WHERE key = ?", (key,))
+
+    @staticmethod
+    def _row(post: ChannelPost) -> Tuple[int, str, str, Optional[str], str, int]:
+        return (post.message_id, post.type, post.text, post.link, post.channel, post.date)
+
+
+# Хранилище открываем при первом обращении, чтобы импорт модуля не создавал файлов
+_post_store: Optional[PostStore] = None
+
+
+def get_post_store() -> PostStore:
+    """Возвращает хранилище постов, открывая его при первом вызове."""
+    global _post_store
+    if _post_store is None:
+        _post_store = PostStore(POSTS_DB_PATH)
+    return _post_store
+
+
+class CacheWriter:
+    """Пишет изменения кэша в хранилище и снимок для бота в отдельном потоке.
+
+    Изменения копятся delay секунд и уходят в SQLite одной транзакцией, а
+    снимок переписывается один раз за пачку — уже по последней версии. Так
+    событие канала не ждёт диска на loop Telethon и не держит cache_lock на
+    время записи. flush() дожидается записи всего, что передано до него.
+    """
+
+    def __init__(self, delay: float) -> None:
+        self.delay = delay
+        self._cond = threading.Condition()
+        self._upserts: Dict[PostKey, ChannelPost] = {}
+        self._removed: Set[PostKey] = set()
+        self._version: Optional[int] = None
+        self._snapshot = False
+        # Сколько пачек передано и сколько из них уже записано
+        self._submitted = 0
+        self._written = 0
+        # Кто-то ждёт во flush(): пишем без задержки
+        self._urgent = False
+        self._thread: Optional[threading.Thread] = None
+
+    def submit(
+        self,
+        upserts: Iterable[ChannelPost] = (),
+        removed: Iterable[PostKey] = (),
+        version: Optional[int] = None,
+        snapshot: bool = False,
+    ) -> None:
+        """Передаёт изменения на запись; более позднее изменение поста заменяет раннее."""
+        with self._cond:
+            for key in removed:
+                self._upserts.pop(key, None)
+                self._removed.add(key)
+            for post in upserts:
+                self._removed.discard(post.key)
+                self._upserts[post.key] = post
+            if version is not None:
+                self._version = version
+            self._snapshot = self._snapshot or snapshot
+            self._submitted += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="cache-writer", daemon=True)
+                self._thread.start()
+            self._cond.notify_all()
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Ждёт записи всего переданного. Нельзя вызывать под cache_lock."""
+        with self._cond:
+            target = self._submitted
+            self._urgent = True
+            self._cond.notify_all()
+            return self._cond.wait_for(lambda: self._written >= target, timeout)
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._submitted > self._written)
+                # Даём накопиться соседним изменениям, если записи никто не ждёт
+                self._cond.wait_for(lambda: self._urgent, timeout=self.delay)
+                upserts, removed = list(self._upserts.values()), list(self._removed)
+                version, snapshot = self._version, self._snapshot
+                self._upserts, self._removed, self._version, self._snapshot = {}, set(), None, False
+                target, self._urgent = self._submitted, False
+            try:
+                if upserts or removed or version is not None:
+                    get_post_store().apply_changes(upserts, removed, version=version)
+                if snapshot:
+                    _write_snapshot_file()
+            except Exception as error:
+                logger.error("Не удалось записать изменения кэша: %s", error)
+            with self._cond:
+                self._written = target
+                self._cond.notify_all()
+
+
+cache_writer = CacheWriter(CACHE_WRITE_DELAY)
+# Изменения последних CACHE_WRITE_DELAY секунд не должны теряться при остановке
+atexit.register(cache_writer.flush, 10.0)
+
+
+def _write_snapshot_file() -> None:
+    """Переписывает файл снимка для бота текущей версией кэша (в потоке cache_writer)."""
+    with cache_lock:
+        # Список кэша не меняется на месте, поэтому писать его можно уже без блокировки
+        posts, version, updated_at = cached_posts, cache_version, cache_updated_at
+    try:
+        write_snapshot(
+            FEED_SNAPSHOT_PATH,
+            ((post.message_id, post.type, post.text, post.link, post.channel, post.date) for post in posts),
+            version,
+            updated_at,
+        )
+    except (OSError, ValueError) as error:
+        logger.warning("Не удалось записать снимок кэша в %s: %s", FEED_SNAPSHOT_PATH, error)
+
+
+def _publish_snapshot() -> None:
+    """Публикует новую версию кэша: прежние снимки /feed больше не годятся. Вызывается под cache_lock.
+
+    Файл снимка для бота перепишет cache_writer — вне cache_lock и не чаще раза в CACHE_WRITE_DELAY.
+    """
+    global cache_updated_at
+    cache_updated_at = time.time()
+    _feed_snapshots.clear()
+    if FEED_SNAPSHOT_PATH:
+        cache_writer.submit(snapshot=True)
+
+
+def get_feed_snapshot(schema: int = 1) -> FeedSnapshot:
+    """Снимок /feed текущей версии: сериализуется при первом запросе и дальше переиспользуется."""
+    with cache_lock:
+        snapshot = _feed_snapshots.get(schema)
+        if snapshot is None:
+            body = _serialize_feed(cached_posts, cache_version, schema)
+            snapshot = FeedSnapshot(
+                version=cache_version,
+                body=body,
+                etag=hashlib.sha256(body).hexdigest(),
+                last_modified=cache_updated_at,
+            )
+            _feed_snapshots[schema] = snapshot
+        return snapshot
+
+
+def load_cache_from_store() -> None:
+    """Поднимает кэш и отметки синхронизации из локального хранилища."""
+    global cached_posts, cache_version, last_full_rescan, last_search_verify, _posts_index, _owners_index
+    store = get_post_store()
+    posts = store.load_posts()
+    with cache_lock:
+        cached_posts = posts
+        _posts_index = _owners_index = None
+        cache_version = int(store.get_state("cache_version") or 0)
+        changelog.clear()
+        _publish_snapshot()
+    for source in CHANNEL_SOURCES:
+        state = source_states[source.name]
+        state.last_seen_message_id = int(store.get_state(f"last_seen_message_id:{source.name}") or 0)
+        # Чтение истории, прерванное падением процесса, продолжится при первом обновлении
+        backfill_raw = store.get_state(f"backfill:{source.name}")
+        state.backfill = Backfill(**backfill_raw) if backfill_raw else None
+    last_full_rescan_raw = store.get_state("last_full_rescan")
+    last_full_rescan = datetime.fromisoformat(last_full_rescan_raw) if last_full_rescan_raw else None
+    last_search_verify_raw = store.get_state("last_search_verify")
+    last_search_verify = datetime.fromisoformat(last_search_verify_raw) if last_search_verify_raw else None
+    logger.info(
+        "Из хранилища %s загружено %d постов (последние просмотренные message_id: %s)",
+        POSTS_DB_PATH,
+        len(posts),
+        ", ".join(f"{name}={state.last_seen_message_id}" for name, state in source_states.items()),
+    )
+
+
+# Единственный клиент Telegram на весь процесс
+telegram_client = TelegramClientManager()
+atexit.register(telegram_client.stop)
 
 
 def ensure_session() -> None:
-    """Проверяет, что сессия авторизована (при необходимости запросит код)."""
-    client: Optional[TelegramClient] = None
+    """Подключает долгоживущий клиент и проверяет, что сессия авторизована."""
     try:
-        client = create_client()
-        if client is None:
-            logger.error("Не удалось создать клиент. Проверьте сессию.")
-            return
-        # Проверяем, авторизован ли клиент
-        if client.loop.run_until_complete(client.is_user_authorized()):
+        if telegram_client.connect():
             logger.info("Telethon сессия авторизована успешно")
         else:
-            logger.warning("Telethon сессия не авторизована")
+            logger.error("Не удалось подключить клиент. Проверьте сессию.")
     except Exception as error:
         logger.warning("Ошибка при проверке сессии: %s", error)
-    finally:
-        if client:
-            try:
-                # Просто отключаем клиент
-                if client.is_connected():
-                    client.loop.run_until_complete(client.disconnect())
-            except Exception:
-                pass
-
-
-async def _collect_posts(client: TelegramClient, limit: Optional[int]) -> List[Dict[str, Any]]:
-    """Асинхронно собирает посты из канала."""
-    results: List[Dict[str, Any]] = []
-    async for message in client.iter_messages(  # type: ignore[arg-type]
-        CHANNEL_USERNAME_VALUE,
-        limit=limit,  # type: ignore[arg-type]
-        reverse=False,
-    ):
-        msg = cast(Any, message)
-        if not msg:
-            continue
 
-        # Получаем текст сообщения
-        text_raw: Any = getattr(msg, "message", None) or getattr(msg, "raw_text", "")
-        text = str(text_raw or "").strip()
-        
-        # Если текста нет, проверяем подпись к медиа
-        if not text:
-            try:
-                text = str(getattr(msg, "raw_text", "") or "")
-            except:
-                pass
-        
-        # Пропускаем, если вообще нет текста
-        if not text:
-            continue
-        
-        # Проверяем хештег
-        if "#showtitrvibe" not in text.lower():
-            continue
 
-        link = ""
+def _make_post(
+    message_id: int, text: str, post_type: str, link: Optional[str], channel: str = "", date: int = 0
+) -> ChannelPost:
+    """Собирает пост для кэша."""
+    return ChannelPost(message_id, sys.intern(post_type), text, link or None, sys.intern(channel), date)
+
+
+def _message_to_post(message: Any, source: ChannelSource) -> Optional[ChannelPost]:
+    """Превращает сообщение Telethon в пост фида. None — если в нём нет хештегов источника."""
+    msg = cast(Any, message)
+    if not msg:
+        return None
+
+    # Получаем текст сообщения
+    text_raw: Any = getattr(msg, "message", None) or getattr(msg, "raw_text", "")
+    text = str(text_raw or "").strip()
+    
+    # Если текста нет, проверяем подпись к медиа
+    if not text:
         try:
-            link = str(getattr(msg, "link", "") or "")
-        except AttributeError:
-            link = ""
-        channel_slug = CHANNEL_USERNAME_VALUE.lstrip("@")
-        if not link and channel_slug and getattr(msg, "id", None):
-            link = f"https://t.me/{channel_slug}/{getattr(msg, 'id')}"
-
-        # Определяем тип медиа
-        post_type = "text"
-        
-        # Проверяем фото
-        if hasattr(msg, "photo") and msg.photo:
-            post_type = "photo"
-        # Проверяем документ
-        elif hasattr(msg, "document") and msg.document:
-            post_type = "document"
-        # Проверяем видео
-        elif hasattr(msg, "video") and msg.video:
-            post_type = "video"
-        # Проверяем стикер
-        elif hasattr(msg, "sticker") and msg.sticker:
-            post_type = "sticker"
-
-        # Используем текст (уже получен выше)
-        display_text = text
+            text = str(getattr(msg, "raw_text", "") or "")
+        except:
+            pass
+    
+    # Пропускаем, если вообще нет текста
+    if not text:
+        return None
+    
+    # Проверяем хештег
+    if not source.matches(text):
+        return None
 
-        payload: Dict[str, Any] = {
-            "id": str(getattr(msg, "id", "")),
-            "message_id": int(getattr(msg, "id", 0)),
-            "text": display_text,
-            "caption": display_text,
-            "type": post_type,
-            "content": display_text,
-        }
-        if link:
-            payload["link"] = link
+    link = ""
+    try:
+        link = str(getattr(msg, "link", "") or "")
+    except AttributeError:
+        link = ""
+    if not link and getattr(msg, "id", None):
+        link = f"https://t.me/{source.name}/{getattr(msg, 'id')}"
 
-        results.append(payload)
+    # Определяем тип медиа
+    post_type = "text"
     
-    logger.info("Собрано %d постов с #showtitrvibe из канала", len(results))
-    return results
+    # Проверяем фото
+    if hasattr(msg, "photo") and msg.photo:
+        post_type = "photo"
+    # Проверяем документ
+    elif hasattr(msg, "document") and msg.document:
+        post_type = "document"
+    # Проверяем видео
+    elif hasattr(msg, "video") and msg.video:
+        post_type = "video"
+    # Проверяем стикер
+    elif hasattr(msg, "sticker") and msg.sticker:
+        post_type = "sticker"
 
+    date = getattr(msg, "date", None)
+    timestamp = int(date.timestamp()) if isinstance(date, datetime) else 0
+    return _make_post(int(getattr(msg, "id", 0)), text, post_type, link, source.name, timestamp)
 
-def fetch_posts(limit: Optional[int] = None) -> Optional[List[Dict[str, Any]]]:
-    """Забирает посты из канала и оставляет только те, что с хештегом #showtitrvibe."""
-    client: Optional[TelegramClient] = None
-    posts: List[Dict[str, Any]] = []
-    try:
-        client = create_client()
-        
-        # Если клиент не создан (ошибка авторизации), возвращаем None
-        if client is None:
-            logger.error("Не удалось создать клиент. Невозможно получить посты.")
-            return None
-        
-        # Проверяем авторизацию ещё раз (на всякий случай)
-        if not client.loop.run_until_complete(client.is_user_authorized()):
-            logger.error("Telethon сессия не авторизована. Невозможно получить посты.")
-            return None
-    except RPCError as error:
-        logger.error("Ошибка при подключении к Telegram: %s", error)
-        return None
-    except Exception as error:
-        logger.error("Непредвиденная ошибка при подключении к Telegram: %s", error)
-        return None
 
-    if client is None:
-        return None
+async def _collect_posts(
+    client: TelegramClient,
+    source: ChannelSource,
+    limit: Optional[int],
+    min_id: int = 0,
+    search: bool = False,
+    offset_id: int = 0,
+) -> Tuple[List[ChannelPost], int]:
+    """Асинхронно собирает посты из канала source.
+
+    Если указан min_id, забираются только сообщения с id больше него,
+    если offset_id — только с id меньше него.
+    С search=True история не читается целиком: для каждого хештега
+    источника Telegram сам ищет сообщения (messages.search), а пришедшие
+    ещё раз проверяются на хештег у нас — поиск Telegram нечёткий.
+    Каждый запрос (пачка из TELEGRAM_HISTORY_BATCH сообщений) занимает слот
+    общего rate_budget. Возвращает посты и наибольший просмотренный
+    message_id (в том числе среди сообщений без хештега).
+    """
+    results: List[ChannelPost] = []
+    highest_id = 0
+    scanned = 0
+    rejected = 0
+    # Сообщение с несколькими хештегами находится несколькими поисками
+    seen_ids: Set[int] = set()
+    for query in source.hashtags if search else (None,):
+        await rate_budget.acquire()
+        query_scanned = 0
+        # wait_time=0: паузы между запросами задаёт общий бюджет, а не Telethon
+        async for message in client.iter_messages(  # type: ignore[arg-type]
+            source.name,
+            limit=limit,  # type: ignore[arg-type]
+            min_id=min_id,
+            offset_id=offset_id,
+            reverse=False,
+            wait_time=0,
+            search=query,
+        ):
+            if not message:
+                continue
 
+            if not scanned:
+                chat_id = getattr(message, "chat_id", None)
+                if chat_id is not None:
+                    source_chat_ids[chat_id] = source.name
+            scanned += 1
+            query_scanned += 1
+            if query_scanned % TELEGRAM_HISTORY_BATCH == 0:
+                # Следующее сообщение придёт уже следующим запросом
+                await rate_budget.acquire()
+            message_id = int(getattr(message, "id", 0) or 0)
+            highest_id = max(highest_id, message_id)
+            if search:
+                if message_id in seen_ids:
+                    continue
+                seen_ids.add(message_id)
+
+            payload = _message_to_post(message, source)
+            if payload is not None:
+                results.append(payload)
+            elif search:
+                rejected += 1
+
+    MESSAGES_SCANNED.inc(scanned, channel=source.name)
+    MESSAGES_KEPT.inc(len(results), channel=source.name)
+    if rejected:
+        SEARCH_REJECTED.inc(rejected, channel=source.name)
+    hashtags = ", ".join(source.hashtags)
+    how = "поиском Telegram" if search else "чтением истории"
+    if min_id:
+        logger.info(
+            "Собрано %d новых постов с %s из %s %s (id > %d)", len(results), hashtags, source.name, how, min_id
+        )
+    else:
+        logger.info("Собрано %d постов с %s из канала %s %s", len(results), hashtags, source.name, how)
+    if rejected:
+        logger.info("Поиск Telegram вернул %d сообщений %s без хештега — отброшены", rejected, source.name)
+    return results, highest_id
+
+
+async def _latest_message_id(client: TelegramClient, source: ChannelSource) -> int:
+    """id самого нового сообщения канала (0 — канал пуст)."""
+    await rate_budget.acquire()
+    messages = await client.get_messages(source.name, limit=1)  # type: ignore[arg-type]
+    return int(getattr(messages[0], "id", 0) or 0) if messages else 0
+
+
+async def _backfill_step(
+    client: TelegramClient, source: ChannelSource, backfill: Backfill
+) -> Tuple[List[ChannelPost], int]:
+    """Читает следующий кусок истории канала: сообщения с id в (low, backfill.offset_id).
+
+    Возвращает посты и low; low == 0 — история прочитана до конца.
+    """
+    if not backfill.top_id:
+        backfill.top_id = await _latest_message_id(client, source)
+        backfill.offset_id = backfill.top_id + 1
+    if backfill.offset_id <= 1:
+        return [], 0
+    low = max(backfill.offset_id - backfill.span, 0)
+    posts, _ = await _collect_posts(
+        client, source, None, min_id=low, search=backfill.search, offset_id=backfill.offset_id
+    )
+    return posts, low
+
+
+async def _source_step(source: ChannelSource, step: Awaitable[T]) -> Optional[T]:
+    """Шаг синхронизации одного канала; ошибка канала не мешает остальным. None — не вышло."""
+    state = source_states[source.name]
     try:
-        posts = client.loop.run_until_complete(_collect_posts(client, limit))
+        result = await step
+    except (ConnectionError, OSError):
+        # Соединение общее для всех каналов — пусть его обработает клиент
+        raise
     except (
         ChannelInvalidError,
         ChannelPrivateError,
         ChannelPublicGroupNaError,
         ValueError,
     ) as error:
-        logger.warning("Канал недоступен (%s): %s", CHANNEL_USERNAME_VALUE, error)
+        logger.warning("Канал недоступен (%s): %s", source.name, error)
+        state.last_error, state.flood_wait = str(error), 0
+        return None
+    except FloodWaitError as error:
+        FLOOD_WAITS.inc()
+        FLOOD_WAIT_SECONDS.inc(error.seconds)
+        # Ограничение действует на весь аккаунт: придерживаем запросы всех каналов
+        rate_budget.block_for(error.seconds)
+        logger.warning("Telegram просит подождать %d сек (FloodWait, канал %s)", error.seconds, source.name)
+        state.last_error, state.flood_wait = f"FloodWait {error.seconds} сек", error.seconds
         return None
     except RPCError as error:
-        logger.error("Ошибка Telethon при чтении сообщений: %s", error)
+        logger.error("Ошибка Telethon при чтении сообщений %s: %s", source.name, error)
+        state.last_error, state.flood_wait = str(error), 0
+        return None
+    except Exception as error:
+        logger.error("Непредвиденная ошибка при чтении сообщений %s: %s", source.name, error)
+        state.last_error, state.flood_wait = str(error), 0
         return None
+    state.last_error, state.flood_wait = None, 0
+    return result
+
+
+def _run_source_steps(steps: Dict[str, Callable[[TelegramClient], Awaitable[T]]]) -> Dict[str, Optional[T]]:
+    """Выполняет шаги нескольких каналов одновременно на loop клиента.
+
+    Каналы делят общий rate_budget. Для каждого канала — результат шага
+    либо None при ошибке.
+    """
+
+    async def run_all(client: TelegramClient) -> Dict[str, Optional[T]]:
+        results = await asyncio.gather(*(_source_step(SOURCES_BY_NAME[name], step(client)) for name, step in steps.items()))
+        return dict(zip(steps, results))
+
+    try:
+        return telegram_client.run(run_all)
+    except ClientUnavailableError as error:
+        logger.error("Невозможно получить посты: %s", error)
+        reason = str(error)
     except Exception as error:
         logger.error("Непредвиденная ошибка при чтении сообщений: %s", error)
+        reason = str(error)
+    for name in steps:
+        source_states[name].last_error, source_states[name].flood_wait = reason, 0
+    return {name: None for name in steps}
+
+
+def _text_fingerprint(text: str) -> int:
+    """Хеш текста без учёта регистра и пробелов: так сравниваются кросспосты."""
+    return hash(" ".join(text.lower().split()))
+
+
+# Владелец текста среди кросспостов: (ранг канала, дата, канал, message_id) — меньше побеждает
+TextOwner = Tuple[int, int, str, int]
+
+
+def _text_owner(post: ChannelPost) -> TextOwner:
+    rank = next(
+        (index for index, source in enumerate(CHANNEL_SOURCES) if source.name == post.channel), len(CHANNEL_SOURCES)
+    )
+    return (rank, post.date, post.channel, post.message_id)
+
+
+def _text_owners(posts: Iterable[ChannelPost]) -> Tuple[List[int], Dict[int, TextOwner]]:
+    """Хеши текстов постов и лучшая копия для каждого хеша."""
+    rank = {source.name: index for index, source in enumerate(CHANNEL_SOURCES)}
+    # Храним только хеш текста, не его копию
+    fingerprints: List[int] = []
+    owners: Dict[int, TextOwner] = {}
+    for post in posts:
+        fingerprint = _text_fingerprint(post.text)
+        fingerprints.append(fingerprint)
+        candidate = (rank.get(post.channel, len(rank)), post.date, post.channel, post.message_id)
+        owner = owners.get(fingerprint)
+        if owner is None or candidate < owner:
+            owners[fingerprint] = candidate
+    return fingerprints, owners
+
+
+def _deduplicate(posts: Dict[PostKey, ChannelPost]) -> Dict[PostKey, ChannelPost]:
+    """Убирает кросспосты: один и тот же текст в разных каналах остаётся один раз.
+
+    Побеждает копия из канала, указанного в CHANNEL_SOURCES раньше, среди
+    равных — более ранняя. Повторы внутри одного канала не трогаем.
+    """
+    global _owners_index
+    fingerprints, owners = _text_owners(posts.values())
+    _owners_index = owners
+    return {
+        key: post
+        for fingerprint, (key, post) in zip(fingerprints, posts.items())
+        if owners[fingerprint][2] == post.channel
+    }
+
+
+# Индексы для точечных изменений кэша (событий канала): посты по каналу и
+# message_id и владельцы текстов кросспостов. Полная пересборка кэша их
+# сбрасывает (None), а перестраиваются они при первом событии после неё.
+# Меняются только под cache_lock.
+_posts_index: Optional[Dict[str, Dict[int, ChannelPost]]] = None
+_owners_index: Optional[Dict[int, TextOwner]] = None
+
+
+def _cache_posts_index() -> Dict[str, Dict[int, ChannelPost]]:
+    global _posts_index
+    if _posts_index is None:
+        _posts_index = {}
+        for post in cached_posts:
+            _posts_index.setdefault(post.channel, {})[post.message_id] = post
+    return _posts_index
+
+
+def _cache_owners_index() -> Dict[int, TextOwner]:
+    global _owners_index
+    if _owners_index is None:
+        _owners_index = _text_owners(cached_posts)[1]
+    return _owners_index
+
+
+def _publish_version(
+    posts: List[ChannelPost], added: List[ChannelPost], edited: List[ChannelPost], removed: List[PostKey]
+) -> None:
+    """Ставит новый список кэша следующей версией: журнал, запись и снимок. Вызывается под cache_lock."""
+    global cached_posts, cache_version
+    cached_posts = posts
+    cache_version += 1
+    changelog.append(FeedChange(cache_version, tuple(added), tuple(edited), tuple(removed)))
+    cache_writer.submit([*added, *edited], removed, version=cache_version)
+    _publish_snapshot()
+    logger.info(
+        "Кэш обновлён до версии %d: +%d, ~%d, -%d",
+        cache_version,
+        len(added),
+        len(edited),
+        len(removed),
+    )
+
+
+def _commit_cache(merged: Dict[PostKey, ChannelPost], previous: Dict[PostKey, ChannelPost]) -> None:
+    """Ставит новое содержимое кэша, если оно отличается от прежнего. Вызывается под cache_lock.
+
+    Изменение получает следующий номер версии, попадает в журнал,
+    записывается в хранилище и публикуется как новый снимок /feed.
+    """
+    global _posts_index, _owners_index
+    if len(CHANNEL_SOURCES) > 1:
+        merged = _deduplicate(merged)
+    added = [post for key, post in merged.items() if key not in previous]
+    edited = [post for key, post in merged.items() if key in previous and previous[key] != post]
+    removed = [key for key in previous if key not in merged]
+    if not (added or edited or removed):
+        return
+
+    _posts_index = None
+    if len(CHANNEL_SOURCES) == 1:
+        # Без дедупликации владельцы текстов не пересчитывались
+        _owners_index = None
+    _publish_version(sorted(merged.values(), key=_feed_order), added, edited, removed)
+
+
+def _replace_cache(posts: List[ChannelPost]) -> None:
+    """Полностью заменяет содержимое кэша (после полного пересбора)."""
+    with cache_lock:
+        previous = {post.key: post for post in cached_posts}
+        _commit_cache({post.key: post for post in posts}, previous)
+
+
+def _merge_changes(upserts: List[ChannelPost], removed_keys: List[PostKey]) -> None:
+    """Применяет изменения пересборкой всего кэша. Вызывается под cache_lock."""
+    previous = {post.key: post for post in cached_posts}
+    merged = dict(previous)
+    for key in removed_keys:
+        merged.pop(key, None)
+    for post in upserts:
+        merged[post.key] = post
+    _commit_cache(merged, previous)
+
+
+def _keeps_text(post: ChannelPost, index: Dict[str, Dict[int, ChannelPost]]) -> Optional[bool]:
+    """Остаётся ли пост при дедупликации кросспостов: True/False, None — нужна полная пересборка.
+
+    Полная пересборка нужна, если пост вытесняет копию из другого канала или
+    записанный владелец текста устарел (его правили или удалили). Это редкость.
+    """
+    fingerprint = _text_fingerprint(post.text)
+    owner = _cache_owners_index().get(fingerprint)
+    if owner is None or owner[2] == post.channel:
+        return True
+    holder = index.get(owner[2], {}).get(owner[3])
+    if holder is None or _text_fingerprint(holder.text) != fingerprint or _text_owner(post) < owner:
         return None
-    finally:
+    return False
+
+
+def _apply_cache_changes(upserts: List[ChannelPost], removed_keys: Iterable[PostKey] = ()) -> None:
+    """Применяет к кэшу добавленные/изменённые посты и удаления (события канала).
+
+    Свежая версия поста побеждает, порядок — от новых к старым. Кэш не
+    пересобирается: место поста ищется двоичным поиском по _feed_order в
+    копии списка (читатели прежней версии дочитывают свой список), а запись
+    в SQLite и снимок уходят cache_writer'у.
+    """
+    global _posts_index, _owners_index
+    removed_keys = list(removed_keys)
+    dedup = len(CHANNEL_SOURCES) > 1
+    with cache_lock:
+        if (dedup and len(upserts) > 1) or (upserts and removed_keys):
+            # События приносят либо один пост, либо удаления. В остальных пачках кросспосты
+            # и повторы ключей решаются только по итоговому набору — пересобираем кэш
+            _merge_changes(upserts, removed_keys)
+            return
+        index = _cache_posts_index()
+        posts: Optional[List[ChannelPost]] = None
+        added: List[ChannelPost] = []
+        edited: List[ChannelPost] = []
+        removed: List[PostKey] = []
+
+        def unlink(post: ChannelPost) -> None:
+            nonlocal posts
+            if posts is None:
+                posts = list(cached_posts)
+            position = bisect.bisect_left(posts, _feed_order(post), key=_feed_order)
+            del posts[position]
+            del index[post.channel][post.message_id]
+
+        def link(post: ChannelPost) -> None:
+            nonlocal posts
+            if posts is None:
+                posts = list(cached_posts)
+            bisect.insort(posts, post, key=_feed_order)
+            index.setdefault(post.channel, {})[post.message_id] = post
+            if dedup:
+                owners = _cache_owners_index()
+                fingerprint = _text_fingerprint(post.text)
+                owner = owners.get(fingerprint)
+                if owner is None or _text_owner(post) < owner:
+                    owners[fingerprint] = _text_owner(post)
+
+        for key in removed_keys:
+            old = index.get(key[0], {}).get(key[1])
+            if old is not None:
+                unlink(old)
+                removed.append(key)
+        for post in upserts:
+            old = index.get(post.channel, {}).get(post.message_id)
+            if old == post:
+                continue
+            if old is not None:
+                unlink(old)
+            keep = _keeps_text(post, index) if dedup else True
+            if keep is None:
+                # Индексы уже тронуты, а список кэша — нет: сбрасываем их и пересобираем кэш
+                _posts_index = _owners_index = None
+                _merge_changes(upserts, removed_keys)
+                return
+            if keep:
+                link(post)
+                (edited if old is not None else added).append(post)
+            elif old is not None:
+                # После правки пост стал кросспостом из менее приоритетного канала
+                removed.append(post.key)
+        if posts is not None:
+            _publish_version(posts, added, edited, removed)
+
+
+def _is_cached(key: PostKey) -> bool:
+    """Есть ли пост в кэше (без прохода по всему кэшу)."""
+    with cache_lock:
+        return key[1] in _cache_posts_index().get(key[0], {})
+
+
+# Кусок для слияния с кэшем: канал, собранные посты и диапазон id (low, high),
+# прочитанный целиком (None — не целиком, как при инкрементальном обновлении)
+Chunk = Tuple[str, List[ChannelPost], Optional[Tuple[int, int]]]
+
+
+def _merge_chunks(chunks: List[Chunk], prune: bool = False) -> None:
+    """Сливает с кэшем посты, собранные из нескольких каналов, одной новой версией.
+
+    Посты канала с id внутри целиком прочитанного диапазона, которых нет
+    среди собранных, удалены из канала или потеряли хештег — они убираются.
+    prune — заодно убрать посты каналов, которых больше нет в CHANNEL_SOURCES.
+    """
+    ranges: Dict[str, List[Tuple[int, int]]] = {}
+    for channel, _, id_range in chunks:
+        if id_range is not None:
+            ranges.setdefault(channel, []).append(id_range)
+    with cache_lock:
+        previous = {post.key: post for post in cached_posts}
+        merged = {
+            key: post
+            for key, post in previous.items()
+            if not (prune and key[0] not in SOURCES_BY_NAME)
+            and not any(low < key[1] < high for low, high in ranges.get(key[0], ()))
+        }
+        for _, posts, _ in chunks:
+            for post in posts:
+                merged[post.key] = post
+        _commit_cache(merged, previous)
+
+
+def _collapse_changes(entries: List[FeedChange]) -> Dict[str, Any]:
+    """Сворачивает цепочку изменений в одну дельту: итоговые добавления, правки и удаления."""
+    existed_before: Dict[PostKey, bool] = {}
+    final: Dict[PostKey, Optional[ChannelPost]] = {}
+    for entry in entries:
+        for post in entry.added:
+            existed_before.setdefault(post.key, False)
+            final[post.key] = post
+        for post in entry.edited:
+            existed_before.setdefault(post.key, True)
+            final[post.key] = post
+        for key in entry.removed:
+            existed_before.setdefault(key, True)
+            final[key] = None
+
+    added: List[ChannelPost] = []
+    edited: List[ChannelPost] = []
+    removed: List[PostKey] = []
+    for key, post in final.items():
+        if post is None:
+            if existed_before[key]:
+                removed.append(key)
+        elif existed_before[key]:
+            edited.append(post)
+        else:
+            added.append(post)
+    return {"added": added, "edited": edited, "removed": removed}
+
+
+async def _event_source(event: Any) -> Optional[ChannelSource]:
+    """Канал-источник события: по chat_id, а если он ещё не известен — по username чата."""
+    if len(CHANNEL_SOURCES) == 1:
+        # Обработчики подписаны только на этот канал
+        return CHANNEL_SOURCES[0]
+    chat_id = getattr(event, "chat_id", None)
+    name = source_chat_ids.get(chat_id) if chat_id is not None else None
+    if name is None:
         try:
-            if client:
-                # Просто отключаем клиент
-                if client.is_connected():
-                    client.loop.run_until_complete(client.disconnect())
-        except Exception:
-            pass
+            chat = await event.get_chat()
+        except Exception as error:
+            logger.warning("Не удалось определить канал события (chat_id=%s): %s", chat_id, error)
+            return None
+        name = str(getattr(chat, "username", "") or "").lower()
+        if name in SOURCES_BY_NAME and chat_id is not None:
+            source_chat_ids[chat_id] = name
+    return SOURCES_BY_NAME.get(name)
+
+
+async def _on_message_event(event: Any) -> None:
+    """Новое или отредактированное сообщение канала: добавляем, обновляем или убираем пост."""
+    message = getattr(event, "message", None)
+    message_id = int(getattr(message, "id", 0) or 0)
+    if not message_id:
+        return
+    source = await _event_source(event)
+    if source is None:
+        return
+    key = (source.name, message_id)
+    post = _message_to_post(message, source)
+    if post is not None:
+        _apply_cache_changes([post])
+        logger.info("Событие канала %s: пост %d добавлен/обновлён", source.name, message_id)
+    elif _is_cached(key):
+        # После правки хештег пропал — пост больше не рекомендуем
+        _apply_cache_changes([], [key])
+        logger.info("Событие канала %s: пост %d потерял хештег и убран из кэша", source.name, message_id)
+
+
+async def _on_message_deleted(event: Any) -> None:
+    """Сообщения удалены из канала: убираем их из кэша."""
+    deleted_ids = [int(message_id) for message_id in getattr(event, "deleted_ids", None) or []]
+    if not deleted_ids:
+        return
+    source = await _event_source(event)
+    if source is None:
+        return
+    _apply_cache_changes([], [(source.name, message_id) for message_id in deleted_ids])
+    logger.info("Событие канала %s: удалены сообщения %s", source.name, deleted_ids)
+
 
-    return posts
+def subscribe_to_channel_updates() -> None:
+    """Подписывает долгоживущий клиент на события каналов (новые, правки, удаления)."""
+    chats = [source.name for source in CHANNEL_SOURCES]
+    telegram_client.add_event_handler(_on_message_event, events.NewMessage(chats=chats))
+    telegram_client.add_event_handler(_on_message_event, events.MessageEdited(chats=chats))
+    telegram_client.add_event_handler(_on_message_deleted, events.MessageDeleted(chats=chats))
+    logger.info("Подписались на события каналов %s", ", ".join(chats))
 
 
 def warm_up_cache() -> None:
-    """Наполняет кэш последними постами при старте приложения."""
+    """Догружает кэш при старте приложения (полностью, если хранилище было пустым)."""
     refresh_cache("старт сервера")
 
 
-def refresh_cache(reason: str) -> None:
-    """Обновляет кэш и логирует причину."""
-    global cached_posts
+def _report_search_misses(chunks: List[Chunk]) -> None:
+    """Сверка с полным чтением: посты с хештегом, которых нет в кэше, собранном поиском Telegram.
 
-    logger.info("Обновляем кэш (%s)", reason)
-    
-    # Делаем до 3 попыток получить посты
-    new_posts = None
-    for attempt in range(3):
-        new_posts = fetch_posts(limit=None)
-        if new_posts is not None:
-            break
-        if attempt < 2:
-            wait_time = (attempt + 1) * 2  # 2, 4 секунды
-            logger.warning("Попытка %d/3 не удалась. Ждём %d сек перед повторной попыткой...", attempt + 1, wait_time)
-            time.sleep(wait_time)
-    
-    if new_posts is None:
-        if len(cached_posts) > 0:
+    Учитываются только сообщения не новее отметки канала: более новые поиск
+    ещё не запрашивал. Кросспосты, убранные дедупликацией, узнаются по тексту.
+    """
+    with cache_lock:
+        posts = cached_posts
+    known_keys = {post.key for post in posts}
+    known_texts = {_text_fingerprint(post.text) for post in posts} if len(CHANNEL_SOURCES) > 1 else set()
+    for name, collected, _ in chunks:
+        watermark = source_states[name].last_seen_message_id
+        missed = [
+            post
+            for post in collected
+            if post.message_id <= watermark
+            and post.key not in known_keys
+            and _text_fingerprint(post.text) not in known_texts
+        ]
+        if missed:
+            SEARCH_MISSED.inc(len(missed), channel=name)
             logger.warning(
-                "Не удалось обновить кэш (%s) после 3 попыток. Сохраняем предыдущие данные (%d постов)",
-                reason,
-                len(cached_posts),
+                "Сверка: поиск Telegram пропустил %d постов %s (например, message_id %d)",
+                len(missed),
+                name,
+                missed[0].message_id,
             )
-        else:
-            logger.error(
-                "Не удалось обновить кэш (%s) после 3 попыток. Кэш пуст! Проверьте сессию и доступность канала.",
-                reason,
+
+
+# Обновления кэша идут по одному: чекпоинты чтения истории общие
+refresh_lock = threading.Lock()
+# FloodWait дольше этого (сек) не выжидаем внутри обновления: канал продолжит со
+# своего чекпоинта при следующем плановом обновлении
+FLOOD_WAIT_DEFER = 300
+# Пауза перед повтором после сбоя канала (не FloodWait), удваивается с каждым сбоем подряд
+RETRY_BASE_DELAY = 2.0
+
+
+async def _after_delay(delay: float, step: Callable[[TelegramClient], Awaitable[T]], client: TelegramClient) -> T:
+    """Шаг канала после паузы: пауза идёт на loop клиента и не задерживает запросы других каналов."""
+    await asyncio.sleep(delay)
+    return await step(client)
+
+
+def refresh_cache(reason: str, full: bool = False) -> None:
+    """Обновляет кэш из всех каналов-источников и логирует причину.
+
+    По умолчанию обновление инкрементальное: из каждого канала забираются
+    только сообщения новее его last_seen_message_id и сливаются с кэшем.
+    Канал без отметки (новый источник) читается целиком. Полный пересбор
+    истории всех каналов (full=True) выполняется явно и редко, а также
+    автоматически, если кэш ещё пуст. Каналы читаются одновременно.
+
+    Историю канала читаем кусками от новых сообщений к старым: каждый кусок
+    сразу попадает в кэш (новой версией фида), а чекпоинт — в хранилище.
+    Чтение, прерванное падением процесса или сбоями, следующее обновление
+    продолжает с чекпоинта. FloodWait — не сбой: общий rate_budget
+    выжидает запрошенное время, и чтение продолжается с того же места.
+    После других сбоев канал повторяется через 2 и 4 секунды, а после 3
+    сбоев подряд откладывается до следующего обновления.
+
+    В режиме COLLECT_MODE=search каналы читаются поиском Telegram по
+    хештегам; плановый полный пересбор раз в SEARCH_VERIFY_INTERVAL всё же
+    читает историю целиком и сверяет её с тем, что находил поиск.
+    """
+    global last_full_rescan, last_search_verify
+
+    with refresh_lock:
+        verify = (
+            COLLECT_MODE == "search"
+            and full
+            and (last_search_verify is None or datetime.now() - last_search_verify >= SEARCH_VERIFY_INTERVAL)
+        )
+        search = COLLECT_MODE == "search" and not verify
+        full_scan = full or not cached_posts
+        store = get_post_store()
+
+        incremental: Dict[str, int] = {}
+        plan: List[str] = []
+        for source in CHANNEL_SOURCES:
+            state = source_states[source.name]
+            if state.backfill is not None:
+                # Поиск мог быть выключен, пока чтение стояло
+                state.backfill.search = state.backfill.search and COLLECT_MODE == "search"
+                plan.append(f"{source.name} — продолжение чтения с id < {state.backfill.offset_id}")
+            elif full_scan or state.last_seen_message_id == 0:
+                state.backfill = Backfill(search=search, verify=verify)
+                plan.append(f"{source.name} — {'поиском' if search else 'вся история'}{' со сверкой' if verify else ''}")
+            else:
+                incremental[source.name] = state.last_seen_message_id
+                plan.append(f"{source.name} — id > {state.last_seen_message_id}")
+        logger.info("Обновляем кэш (%s): %s", reason, ", ".join(plan))
+
+        started = time.perf_counter()
+        kind = "full" if full_scan else "incremental"
+        backfilled = set(SOURCES_BY_NAME) - set(incremental)
+        pending = [source.name for source in CHANNEL_SOURCES]
+        failures: Dict[str, int] = {}
+        synced: Set[str] = set()
+        deferred: Set[str] = set()
+        while pending:
+            steps: Dict[str, Callable[[TelegramClient], Awaitable[Tuple[List[ChannelPost], int]]]] = {}
+            for name in pending:
+                source = SOURCES_BY_NAME[name]
+                backfill = source_states[name].backfill
+                if backfill is not None:
+                    steps[name] = functools.partial(_backfill_step, source=source, backfill=backfill)
+                else:
+                    steps[name] = functools.partial(
+                        _collect_posts, source=source, limit=None, min_id=incremental[name], search=search
+                    )
+                if failures.get(name):
+                    delay = RETRY_BASE_DELAY * 2 ** (failures[name] - 1)
+                    logger.info("Повторяем чтение %s через %.0f сек", name, delay)
+                    steps[name] = functools.partial(_after_delay, delay, steps[name])
+
+            chunks: List[Chunk] = []
+            verify_chunks: List[Chunk] = []
+            for name, result in _run_source_steps(steps).items():
+                state = source_states[name]
+                if result is None:
+                    if state.flood_wait > FLOOD_WAIT_DEFER:
+                        deferred.add(name)
+                    elif not state.flood_wait:
+                        failures[name] = failures.get(name, 0) + 1
+                        REFRESH_RETRIES.inc()
+                    continue
+                failures[name] = 0
+                posts, mark = result
+                backfill = state.backfill
+                if backfill is None:
+                    chunks.append((name, posts, None))
+                    state.last_seen_message_id = max(state.last_seen_message_id, mark)
+                    synced.add(name)
+                    continue
+                chunk: Chunk = (name, posts, (mark, backfill.offset_id))
+                chunks.append(chunk)
+                if backfill.verify:
+                    verify_chunks.append(chunk)
+                backfill.posts += len(posts)
+                backfill.offset_id = mark + 1
+                if backfill.search:
+                    # Поиск отдаёт только посты с хештегом: расширяем кусок, пока в него попадает мало постов
+                    backfill.span = min(backfill.span * 8, backfill.span * BACKFILL_CHUNK // max(len(posts), 1))
+                    backfill.span = max(backfill.span, BACKFILL_CHUNK)
+                if mark == 0:
+                    state.last_seen_message_id = max(state.last_seen_message_id, backfill.top_id)
+                    synced.add(name)
+
+            if verify_chunks:
+                _report_search_misses(verify_chunks)
+            # Посты — в кэш и хранилище, и только потом чекпоинт: повтор куска безвреден
+            _merge_chunks(chunks)
+            cache_writer.flush()
+            synced_at = time.time()
+            for name, _, _ in chunks:
+                state = source_states[name]
+                backfill = state.backfill
+                if name in synced:
+                    state.last_sync = synced_at
+                    store.set_state(f"last_seen_message_id:{name}", state.last_seen_message_id)
+                    if backfill is not None:
+                        logger.info("История %s прочитана: %d постов", name, backfill.posts)
+                        state.backfill = None
+                        store.delete_state(f"backfill:{name}")
+                elif backfill is not None:
+                    store.set_state(f"backfill:{name}", asdict(backfill))
+                    logger.info(
+                        "Чтение истории %s: %.0f%% (до id %d), постов %d",
+                        name,
+                        backfill.progress * 100,
+                        backfill.offset_id,
+                        backfill.posts,
+                    )
+            pending = [
+                name for name in pending if name not in synced | deferred and failures.get(name, 0) < 3
+            ]
+
+        failed = [name for name, count in failures.items() if count >= 3]
+        if deferred:
+            logger.warning(
+                "Каналы %s отложены до следующего обновления: Telegram просит ждать дольше %d сек",
+                ", ".join(sorted(deferred)),
+                FLOOD_WAIT_DEFER,
             )
-        return
+        if not synced and (failed or deferred):
+            REFRESH_FAILURES.inc()
+        REFRESH_SECONDS.observe(time.perf_counter() - started, kind=kind)
+        if failed:
+            if cached_posts:
+                logger.warning(
+                    "Каналы %s не удалось прочитать (%s) после 3 попыток. В кэше остаются прежние данные (%d постов)",
+                    ", ".join(failed),
+                    reason,
+                    len(cached_posts),
+                )
+            else:
+                logger.error(
+                    "Не удалось обновить кэш (%s) после 3 попыток. Кэш пуст! Проверьте сессию и доступность каналов.",
+                    reason,
+                )
 
-    cached_posts = new_posts
-    logger.info("В кэше сейчас %s постов", len(cached_posts))
+        if backfilled == set(SOURCES_BY_NAME) and not failed and not deferred:
+            # Все каналы перечитаны целиком: посты убранных из CHANNEL_SOURCES каналов больше не нужны
+            _merge_chunks([], prune=True)
+            last_full_rescan = datetime.now()
+            store.set_state("last_full_rescan", last_full_rescan.isoformat())
+            if verify:
+                last_search_verify = last_full_rescan
+                store.set_state("last_search_verify", last_search_verify.isoformat())
+        logger.info(
+            "В кэше сейчас %s постов (последние просмотренные message_id: %s)",
+            len(cached_posts),
+            ", ".join(f"{name}={state.last_seen_message_id}" for name, state in source_states.items()),
+        )
 
 
 def schedule_cache_updates() -> None:
-    """Запускает фоновой поток, обновляющий кэш дважды в сутки."""
+    """Запускает фоновой поток, обновляющий кэш по расписанию.
+
+    Без событий реального времени кэш обновляется дважды в сутки, с ними —
+    раз в сутки как сверка на случай пропущенных событий.
+    """
 
     def worker() -> None:
-        import asyncio
-        # Создаём event loop для этого потока
-        # Это необходимо, так как Telethon требует asyncio event loop
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        
         while True:
             now = datetime.now()
             next_runs: List[datetime] = []
-            for target_hour in (0, 12):
+            for target_hour in SCHEDULE_HOURS:
                 candidate = now.replace(hour=target_hour, minute=0, second=0, microsecond=0)
                 if candidate <= now:
                     candidate += timedelta(days=1)
@@ -369,8 +1810,10 @@ def schedule_cache_updates() -> None:
             if sleep_seconds:
                 time.sleep(sleep_seconds)
 
+            # Полный пересбор — только если с прошлого прошло FULL_RESCAN_INTERVAL
+            full = last_full_rescan is None or datetime.now() - last_full_rescan >= FULL_RESCAN_INTERVAL
             try:
-                refresh_cache(f"плановое обновление {next_run.isoformat()}")
+                refresh_cache(f"плановое обновление {next_run.isoformat()}", full=full)
             except Exception as error:
                 logger.exception("Не удалось обновить кэш по расписанию: %s", error)
 
@@ -378,10 +1821,263 @@ def schedule_cache_updates() -> None:
     thread.start()
 
 
+def _requested_schema() -> Optional[int]:
+    """Схема фида из ?schema= (по умолчанию 1 — для старых клиентов). None — неизвестная схема."""
+    schema = request.args.get("schema", default=1, type=int)
+    return schema if schema in FEED_SCHEMAS else None
+
+
+@app.before_request
+def _start_request_timer() -> None:
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def _observe_request(response: Response) -> Response:
+    started = g.get("request_started")
+    if started is not None:
+        endpoint = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint=endpoint, status=str(response.status_code))
+    return response
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """Метрики парсера в текстовом формате Prometheus."""
+    return Response(metrics_registry.render(), content_type=METRICS_CONTENT_TYPE)
+
+
 @app.route("/feed", methods=["GET"])
 def feed():
-    """Отдаём JSON с постами из кэша."""
-    return jsonify({"posts": cached_posts})
+    """Отдаём JSON с постами из кэша.
+
+    Тело берётся из заранее сериализованного снимка; если у клиента та же
+    версия (If-None-Match / If-Modified-Since), отвечаем 304 без тела.
+    В схеме 2 (?schema=2) доступны страницы (?after=<курсор>&limit=)
+    и выбор полей (?fields=type,text). С ?stream=1 тело кодируется на лету
+    по мере отправки (см. _feed_stream).
+    """
+    schema = _requested_schema()
+    if schema is None:
+        return jsonify({"error": f"Поддерживаемые схемы: {FEED_SCHEMAS}"}), 400
+    if any(arg in request.args for arg in ("after", "limit", "fields")):
+        if schema != 2:
+            return jsonify({"error": "after, limit и fields доступны только с ?schema=2"}), 400
+        return _feed_page()
+    if request.args.get("stream") in ("1", "true"):
+        return _feed_stream(schema)
+
+    snapshot = get_feed_snapshot(schema)
+    encoding = _negotiate_encoding()
+    if encoding is None:
+        response = Response(snapshot.body, mimetype="application/json")
+        response.set_etag(snapshot.etag)
+    else:
+        response = Response(get_encoded_body(snapshot, encoding), mimetype="application/json")
+        response.content_encoding = encoding
+        # У каждого сжатого представления свой ETag
+        response.set_etag(f"{snapshot.etag}-{encoding}")
+    response.vary.add("Accept-Encoding")
+    _set_version_headers(response, snapshot.version)
+    response.last_modified = datetime.fromtimestamp(snapshot.last_modified, tz=timezone.utc)
+    # Кэшировать можно, но каждый раз сверяясь с сервером
+    response.cache_control.no_cache = True
+    response.make_conditional(request)
+    # Состояние Telethon-клиента: по нему видно, насколько свежие данные в фиде
+    response.headers["X-Telegram-Client-State"] = telegram_client.state
+    return response
+
+
+def _set_version_headers(response: Response, version: int) -> None:
+    """Версия кэша и id хранилища, к которому она относится (его ждёт ?store_id= у /feed/changes)."""
+    response.headers["X-Feed-Version"] = str(version)
+    response.headers["X-Feed-Store"] = get_post_store().store_id
+
+
+def _negotiate_encoding() -> Optional[str]:
+    """Лучшая кодировка из Accept-Encoding клиента; None — отдаём без сжатия."""
+    if "Accept-Encoding" not in request.headers:
+        return None
+    accepted = request.accept_encodings
+    best = accepted.best_match(FEED_ENCODINGS)
+    if best is None or accepted[best] <= 0:
+        return None
+    return best
+
+
+def get_encoded_body(snapshot: FeedSnapshot, encoding: str) -> bytes:
+    """Сжатое тело снимка: сжимается один раз на версию и кодировку."""
+    body = snapshot.encoded.get(encoding)
+    if body is None:
+        body = _compress(snapshot.body, encoding)
+        with cache_lock:
+            snapshot.encoded.setdefault(encoding, body)
+    return body
+
+
+def _stream_feed_body(posts: List[ChannelPost], version: int, schema: int) -> Iterator[bytes]:
+    """Тело /feed?stream=1 по кускам: тот же JSON, что у /feed, но по посту на строке.
+
+    Первая строка — заголовок с версией, последняя — закрывающие скобки,
+    так что клиент может разбирать ответ построчно, не держа его целиком.
+    """
+    yield f'{{"version":{version},"posts":[\n'.encode("utf-8")
+    last = len(posts) - 1
+    lines: List[str] = []
+    for index, post in enumerate(posts):
+        line = json.dumps(post.serialize(schema), ensure_ascii=False, separators=(",", ":"))
+        lines.append(line + (",\n" if index < last else "\n"))
+        if len(lines) >= FEED_STREAM_BATCH:
+            yield "".join(lines).encode("utf-8")
+            lines.clear()
+    if lines:
+        yield "".join(lines).encode("utf-8")
+    yield b"]}\n"
+
+
+def _gzip_stream(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    """Сжимает поток кусков gzip'ом, не собирая тело целиком."""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def _feed_stream(schema: int):
+    """Потоковый /feed: посты кодируются (и сжимаются gzip'ом) по мере отправки."""
+    with cache_lock:
+        # Кэш не меняется на месте, а заменяется новым списком — ссылка остаётся согласованной
+        posts, version, updated_at = cached_posts, cache_version, cache_updated_at
+    body = _stream_feed_body(posts, version, schema)
+    etag = f"{get_post_store().store_id}-{version}-{schema}-stream"
+    gzip_accepted = "Accept-Encoding" in request.headers and request.accept_encodings["gzip"] > 0
+    response = Response(_gzip_stream(body) if gzip_accepted else body, mimetype="application/json")
+    if gzip_accepted:
+        response.content_encoding = "gzip"
+        etag += "-gzip"
+    # Тело не сериализуется заранее, поэтому ETag — по хранилищу и версии кэша, а не по содержимому
+    response.set_etag(etag, weak=True)
+    response.vary.add("Accept-Encoding")
+    _set_version_headers(response, version)
+    response.headers["X-Feed-Stream"] = "1"
+    response.last_modified = datetime.fromtimestamp(updated_at, tz=timezone.utc)
+    response.cache_control.no_cache = True
+    # Иначе make_conditional посчитает Content-Length и ради этого соберёт весь поток в памяти
+    response.automatically_set_content_length = False
+    response.make_conditional(request)
+    response.headers["X-Telegram-Client-State"] = telegram_client.state
+    return response
+
+
+def _page_cursor(post: ChannelPost) -> Any:
+    """Курсор страниц после post: message_id для одного канала, иначе «дата.message_id.канал»."""
+    if len(CHANNEL_SOURCES) == 1:
+        return post.message_id
+    return f"{post.date}.{post.message_id}.{post.channel}"
+
+
+def _page_start(posts: List[ChannelPost], after: str) -> Optional[int]:
+    """Позиция первого поста после курсора after; None — курсор не подходит."""
+    if after.lstrip("-").isdigit():
+        # Голый message_id однозначен только для одного канала
+        if len(CHANNEL_SOURCES) > 1:
+            return None
+        return bisect.bisect_right(posts, -int(after), key=lambda post: -post.message_id)
+    date, _, rest = after.partition(".")
+    message_id, _, channel = rest.partition(".")
+    try:
+        cursor = (-int(date), -int(message_id), channel)
+    except ValueError:
+        return None
+    return bisect.bisect_right(posts, cursor, key=_feed_order)
+
+
+def _feed_page():
+    """Страница компактного фида: посты старше ?after=<курсор>, не больше ?limit= штук."""
+    after = request.args.get("after")
+    limit = request.args.get("limit", default=FEED_PAGE_DEFAULT, type=int)
+    limit = max(1, min(limit, FEED_PAGE_MAX))
+    fields = COMPACT_FIELDS
+    if "fields" in request.args:
+        requested = {field.strip() for field in request.args["fields"].split(",") if field.strip()}
+        unknown = requested - set(COMPACT_FIELDS)
+        if unknown:
+            return jsonify({"error": f"Неизвестные поля: {sorted(unknown)}"}), 400
+        # message_id нужен всегда: это курсор страниц
+        fields = tuple(field for field in COMPACT_FIELDS if field == "message_id" or field in requested)
+
+    with cache_lock:
+        posts = cached_posts
+        version = cache_version
+    # Посты отсортированы от новых к старым, поэтому «после курсора» — это посты старше него
+    start = 0
+    if after is not None:
+        start = _page_start(posts, after)
+        if start is None:
+            return jsonify({"error": "after — курсор из next_after предыдущей страницы"}), 400
+    page = posts[start:start + limit]
+    has_more = start + limit < len(posts)
+    response = jsonify(
+        {
+            "version": version,
+            "posts": [post.to_compact(fields) for post in page],
+            "next_after": _page_cursor(page[-1]) if page and has_more else None,
+        }
+    )
+    _set_version_headers(response, version)
+    return response
+
+
+@app.route("/feed/changes", methods=["GET"])
+def feed_changes():
+    """Отдаём только изменения кэша с версии ?since=<version>.
+
+    Версии считаются заново после сброса хранилища, поэтому клиент передаёт
+    и ?store_id= (из X-Feed-Store или прошлой дельты): если хранилище другое
+    или журнал уже не покрывает запрошенную версию, отвечаем 410 — клиенту
+    нужно перечитать /feed целиком. С ?schema=2 посты отдаются в компактной схеме.
+    """
+    since = request.args.get("since", type=int)
+    if since is None:
+        return jsonify({"error": "Укажите ?since=<version>"}), 400
+    schema = _requested_schema()
+    if schema is None:
+        return jsonify({"error": f"Поддерживаемые схемы: {FEED_SCHEMAS}"}), 400
+    store_id = get_post_store().store_id
+    client_store_id = request.args.get("store_id")
+
+    with cache_lock:
+        version = cache_version
+        entries = [entry for entry in changelog if entry.version > since]
+        oldest_version = changelog[0].version if changelog else version + 1
+
+    stale = since > version or (since < version and oldest_version > since + 1)
+    if stale or (client_store_id is not None and client_store_id != store_id):
+        return jsonify({"version": version, "store_id": store_id, "reset": True}), 410
+
+    changes = _collapse_changes(entries)
+    changes["added"] = [post.serialize(schema) for post in changes["added"]]
+    changes["edited"] = [post.serialize(schema) for post in changes["edited"]]
+    # В схеме 1 удалённые — голые message_id, в схеме 2 — с каналом
+    changes["removed"] = [
+        {"channel": channel, "message_id": message_id} if schema == 2 else message_id
+        for channel, message_id in changes["removed"]
+    ]
+    return jsonify({"version": version, "store_id": store_id, **changes})
+
+
+@app.route("/feed/health", methods=["GET"])
+def feed_health():
+    """Состояние Telethon-клиента, кэша и синхронизации каналов."""
+    return jsonify(
+        {
+            "client": telegram_client.health(),
+            "posts": len(cached_posts),
+            "sources": {name: state.health() for name, state in source_states.items()},
+        }
+    )
 
 
 @app.route("/", methods=["GET"])
@@ -393,22 +2089,88 @@ def index():
     )
 
 
-def run_feed_server(host: str = "127.0.0.1", port: int = 5000) -> None:
-    """Запускает HTTP-сервер с фидом."""
-    # Проверяем сессию перед запуском
-    ensure_session()
-    # Наполняем кэш
-    warm_up_cache()
-    schedule_cache_updates()
-    
+@contextlib.contextmanager
+def _private_umask() -> Iterator[None]:
+    """Пока открыт блок, новые файлы создаются только с правами владельца.
+
+    Сокет создаётся при bind с правами по umask процесса, а chmod до FEED_SOCKET_MODE
+    идёт уже после: без этого между ними к сокету мог подключиться кто угодно.
+    """
+    previous = os.umask(0o177)
+    try:
+        yield
+    finally:
+        os.umask(previous)
+
+
+def serve_feed_on_unix_socket(path: str) -> None:
+    """Отдаёт фид через Unix-сокет path (прежний файл сокета удаляется)."""
+    with _private_umask():
+        server = make_server(f"unix://{path}", 0, app, threaded=True)
+    os.chmod(path, FEED_SOCKET_MODE)
+    logger.info("Фид слушает Unix-сокет %s (права %o)", path, FEED_SOCKET_MODE)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+
+def serve_feed(host: str = "127.0.0.1", port: int = 5000, unix_socket: Optional[str] = None) -> None:
+    """Обслуживает фид сервером FEED_SERVER (блокирует текущий поток)."""
+    if FEED_SERVER == "waitress":
+        if waitress is None:
+            logger.warning("FEED_SERVER=waitress, но waitress не установлен (pip install waitress) — используем встроенный сервер")
+        else:
+            options: Dict[str, Any] = {"threads": FEED_SERVER_THREADS, "ident": "kinotip-feed"}
+            if unix_socket:
+                options.update(unix_socket=unix_socket, unix_socket_perms=f"{FEED_SOCKET_MODE:o}")
+            else:
+                options.update(host=host, port=port)
+            logger.info("Фид обслуживает waitress (%d потоков)", FEED_SERVER_THREADS)
+            with _private_umask():
+                server = waitress.create_server(app, **options)
+            server.run()
+            return
+    elif FEED_SERVER != "dev":
+        logger.warning("Неизвестный FEED_SERVER=%s — используем встроенный сервер", FEED_SERVER)
+    if unix_socket:
+        serve_feed_on_unix_socket(unix_socket)
+    else:
+        app.run(host=host, port=port, debug=False, use_reloader=False)
+
+
+def run_feed_server(host: str = "127.0.0.1", port: int = 5000, unix_socket: Optional[str] = None) -> None:
+    """Запускает HTTP-сервер с фидом (на TCP host:port или на Unix-сокете unix_socket).
+
+    Фид сразу отдаёт последний снимок из локального хранилища, а подключение
+    к Telegram и догрузка новых постов идут в фоне.
+    """
+    load_cache_from_store()
+
     # Запускаем Flask в отдельном потоке
     import threading
     flask_thread = threading.Thread(
-        target=lambda: app.run(host=host, port=port, debug=False, use_reloader=False),
+        target=serve_feed,
+        args=(host, port, unix_socket),
         daemon=True
     )
     flask_thread.start()
     logger.info("Flask сервер запущен в фоновом потоке")
+
+    def catch_up() -> None:
+        # Подписываемся на события канала до подключения, чтобы не пропустить ни одного
+        if REALTIME_UPDATES:
+            subscribe_to_channel_updates()
+        # Проверяем сессию и догружаем кэш
+        ensure_session()
+        warm_up_cache()
+        schedule_cache_updates()
+
+    threading.Thread(target=catch_up, name="cache-catch-up", daemon=True).start()
     
     # Запускаем бота в отдельном процессе
     import subprocess
@@ -511,6 +2273,21 @@ def run_feed_server(host: str = "127.0.0.1", port: int = 5000) -> None:
             logger.info("Остановка сервера...")
 
 
+def feed_listen_options(url: str) -> Dict[str, Any]:
+    """Где слушать фид по POSTS_FEED_URL — там же, где его будет искать бот.
+
+    unix://… — Unix-сокет; http:// на локальном хосте — его адрес и порт;
+    без адреса или с внешним хостом — 127.0.0.1:5000 по умолчанию.
+    """
+    socket_path, http_url = split_unix_feed_url(url)
+    if socket_path:
+        return {"unix_socket": socket_path}
+    parsed = urlparse(http_url or "")
+    if parsed.scheme == "http" and parsed.hostname in {"127.0.0.1", "localhost"}:
+        return {"host": parsed.hostname, "port": parsed.port or 80}
+    return {}
+
+
 if __name__ == "__main__":
-    run_feed_server()
+    run_feed_server(**feed_listen_options(os.getenv("POSTS_FEED_URL", "")))
 
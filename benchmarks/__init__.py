@@ -0,0 +1 @@
+"""Офлайн-бенчмарки парсера (app.py) и бота (bot.py)."""
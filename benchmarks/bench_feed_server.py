@@ -0,0 +1,136 @@
+"""
+Нагрузочный тест фида: запросы в секунду и задержки /feed для разных FEED_SERVER.
+
+Для каждого режима сервер поднимается в отдельном процессе с синтетическим
+кэшем, а клиенты (asyncio + httpx, keep-alive) опрашивают его заданное время.
+
+Запуск:  python -m benchmarks.bench_feed_server [--modes dev,waitress] [--posts 5000]
+                                                [--clients 16] [--duration 10]
+"""
+
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import time
+from typing import Dict, List
+
+import httpx
+
+from benchmarks.fake_channel import ChannelSpec, SyntheticChannel
+from benchmarks.harness import configure_app_env, percentile
+
+PORT = 5097
+
+
+def serve(mode: str, port: int, posts: int) -> None:
+    """Дочерний процесс: фид с синтетическим кэшем на 127.0.0.1:port."""
+    configure_app_env()
+    os.environ["FEED_SNAPSHOT_PATH"] = ""
+    os.environ["FEED_SERVER"] = mode
+    import logging
+
+    import app
+
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    channel = SyntheticChannel(ChannelSpec(size=posts, hashtag_ratio=1.0, text_length=(20, 120)))
+    with app.cache_lock:
+        app.cached_posts = [
+            app._make_post(message_id, text, post_type, link, channel_name, date)
+            for message_id, post_type, text, link, channel_name, date in channel.posts()
+        ]
+        app.cache_version = 1
+        app._publish_snapshot()
+    app.serve_feed("127.0.0.1", port)
+
+
+async def load(url: str, clients: int, duration: float, headers: Dict[str, str]) -> Dict[str, float]:
+    """clients параллельных клиентов duration секунд подряд запрашивают url."""
+    latencies: List[float] = []
+    errors = 0
+    limits = httpx.Limits(max_connections=clients, max_keepalive_connections=clients)
+    async with httpx.AsyncClient(limits=limits, timeout=30) as client:
+        deadline = time.perf_counter() + duration
+
+        async def worker() -> None:
+            nonlocal errors
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                try:
+                    response = await client.get(url, headers=headers)
+                    await response.aread()
+                    if response.status_code >= 400:
+                        errors += 1
+                        continue
+                except httpx.HTTPError:
+                    errors += 1
+                    continue
+                latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(clients)))
+        elapsed = time.perf_counter() - started
+    return {
+        "rps": len(latencies) / elapsed,
+        "p50": percentile(latencies, 0.50) * 1000 if latencies else float("nan"),
+        "p99": percentile(latencies, 0.99) * 1000 if latencies else float("nan"),
+        "errors": errors,
+    }
+
+
+def wait_ready(url: str, timeout: float = 30.0) -> None:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if httpx.get(url, timeout=1).status_code == 200:
+                return
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    raise SystemExit(f"Сервер {url} не поднялся за {timeout:.0f} сек")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modes", default="dev,waitress", help="режимы FEED_SERVER через запятую")
+    parser.add_argument("--posts", type=int, default=5000, help="размер синтетического кэша")
+    parser.add_argument("--clients", type=int, default=16, help="параллельных клиентов")
+    parser.add_argument("--duration", type=float, default=10.0, help="секунд нагрузки на режим")
+    parser.add_argument("--serve", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve, PORT, args.posts)
+        return
+
+    base = f"http://127.0.0.1:{PORT}"
+    cases = {
+        "/feed?schema=2 (gzip)": (f"{base}/feed?schema=2", {"Accept-Encoding": "gzip"}),
+        "/feed?schema=2 (304)": (f"{base}/feed?schema=2", {"Accept-Encoding": "gzip"}),
+        "/": (f"{base}/", {}),
+    }
+    print(f"{'режим':<10}{'запрос':<26}{'req/s':>10}{'p50, мс':>10}{'p99, мс':>10}{'ошибок':>8}")
+    for mode in args.modes.split(","):
+        server = subprocess.Popen(
+            [sys.executable, "-m", "benchmarks.bench_feed_server", "--serve", mode, "--posts", str(args.posts)],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        try:
+            wait_ready(f"{base}/")
+            for name, (url, headers) in cases.items():
+                if name.endswith("(304)"):
+                    etag = httpx.get(url, headers=headers).headers["ETag"]
+                    headers = {**headers, "If-None-Match": etag}
+                result = asyncio.run(load(url, args.clients, args.duration, headers))
+                print(
+                    f"{mode:<10}{name:<26}{result['rps']:>10.0f}{result['p50']:>10.1f}"
+                    f"{result['p99']:>10.1f}{result['errors']:>8.0f}"
+                )
+        finally:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == "__main__":
+    main()
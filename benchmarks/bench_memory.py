@@ -0,0 +1,143 @@
+"""
+Сколько памяти занимает один пост в кэше парсера (cached_posts) и бота (posts_cache).
+
+Сравнивает прежнее представление (dict с текстом в text/caption/content,
+dataclass PostItem с __dict__ и отдельной копией content) с текущим
+(ChannelPost и PostItem на slots, текст хранится один раз). Текущие посты
+собираются с каналом и датой, как в многоканальном фиде.
+
+Запуск:  python -m benchmarks.bench_memory [--sizes 10000,100000,1000000] [--text-length 300]
+"""
+
+import argparse
+import sys
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Literal, Optional, Set
+
+from benchmarks.fake_channel import ChannelSpec, SyntheticChannel
+from benchmarks.harness import configure_app_env
+
+configure_app_env()
+
+import app  # noqa: E402
+import bot  # noqa: E402
+
+
+@dataclass
+class LegacyPostItem:
+    """PostItem до перехода на slots: с __dict__ и отдельной копией content."""
+
+    message_id: int
+    type: Literal['photo', 'document', 'video', 'sticker', 'text'] = 'text'
+    caption: str = ''
+    content: str = ''
+    file_id: Optional[str] = None
+    link: Optional[str] = None
+
+
+def copy_text(text: str) -> str:
+    """Новый объект строки с тем же текстом (как после разбора JSON)."""
+    return "".join([text[:1], text[1:]])
+
+
+def deep_sizeof(root: Any) -> int:
+    """Размер объекта со всем, на что он ссылается (каждый объект считается один раз)."""
+    seen: Set[int] = set()
+    stack = [root]
+    total = 0
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        total += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple)):
+            stack.extend(obj)
+        elif hasattr(obj, "__dict__"):
+            stack.append(obj.__dict__)
+        elif hasattr(type(obj), "__slots__"):
+            stack.extend(getattr(obj, name) for name in type(obj).__slots__ if hasattr(obj, name))
+    return total
+
+
+def legacy_app_post(message_id: int, text: str, post_type: str, channel: str, date: int) -> Dict[str, Any]:
+    # Так пост выглядел в cached_posts: один объект строки, три ссылки на него
+    return {
+        "id": str(message_id),
+        "message_id": message_id,
+        "text": text,
+        "caption": text,
+        "type": post_type,
+        "content": text,
+        "link": f"https://t.me/showtitrvibe/{message_id}",
+    }
+
+
+def compact_app_post(message_id: int, text: str, post_type: str, channel: str, date: int) -> Any:
+    return app._make_post(message_id, text, post_type, f"https://t.me/{channel}/{message_id}", channel, date)
+
+
+def legacy_bot_post(message_id: int, text: str, post_type: str, channel: str, date: int) -> Any:
+    # После разбора JSON caption и content — два разных объекта строки
+    return LegacyPostItem(
+        message_id=message_id,
+        type=copy_text(post_type),  # type: ignore[arg-type]
+        caption=text,
+        content=copy_text(text),
+        link=f"https://t.me/showtitrvibe/{message_id}",
+    )
+
+
+def compact_bot_post(message_id: int, text: str, post_type: str, channel: str, date: int) -> Any:
+    # Канал из JSON — новый объект строки у каждого поста (PostItem его интернирует)
+    item = {
+        "message_id": message_id,
+        "type": copy_text(post_type),
+        "text": text,
+        "link": f"https://t.me/{channel}/{message_id}",
+        "channel": copy_text(channel),
+        "date": date,
+    }
+    return bot._build_post_item(item, text, 0, 0.0)
+
+
+PostFactory = Callable[[int, str, str, str, int], Any]
+
+REPRESENTATIONS: Dict[str, PostFactory] = {
+    "cached_posts (dict, было)": legacy_app_post,
+    "cached_posts (ChannelPost)": compact_app_post,
+    "posts_cache (PostItem, было)": legacy_bot_post,
+    "posts_cache (PostItem slots)": compact_bot_post,
+}
+
+
+def measure(size: int, text_length: int, factory: PostFactory) -> float:
+    """Байт на пост для size синтетических постов."""
+    channel = SyntheticChannel(
+        ChannelSpec(size=size, hashtag_ratio=1.0, text_length=(text_length // 2, text_length * 3 // 2), seed=size)
+    )
+    posts = [
+        factory(message_id, text, post_type, channel_name, date)
+        for message_id, post_type, text, _, channel_name, date in channel.posts()
+    ]
+    return deep_sizeof(posts) / size
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="10000,100000,1000000", help="число постов через запятую")
+    parser.add_argument("--text-length", type=int, default=300, help="примерная длина текста поста")
+    args = parser.parse_args()
+    sizes = [int(size) for size in args.sizes.split(",")]
+
+    print(f"{'представление':<32}" + "".join(f"{size:>14,}" for size in sizes))
+    for name, factory in REPRESENTATIONS.items():
+        row = [measure(size, args.text_length, factory) for size in sizes]
+        print(f"{name:<32}" + "".join(f"{value:>12,.0f} B" for value in row))
+
+
+if __name__ == "__main__":
+    main()
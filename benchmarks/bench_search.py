@@ -0,0 +1,100 @@
+"""
+Сбор постов: полное чтение истории (scan) против поиска Telegram по хештегу (search).
+
+Для каждого размера канала и доли постов с хештегом оба режима собирают
+посты через app._collect_posts по FakeTelegramClient. Печатаются запросы
+к API, скачанные сообщения, время сбора в процессе, оценка времени при
+бюджете --rate запросов в секунду (столько сбор займёт с настоящим
+Telegram) и сверка: набор постов search, прошедших проверку хештега,
+должен совпасть с набором scan. Ложные находки поиска (слово хештега
+без «#») задаются --noise.
+
+Запуск:  python -m benchmarks.bench_search [--sizes 10000,100000,1000000]
+                                           [--ratios 0.01,0.05,0.3] [--noise 0.002] [--rate 2]
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import tempfile
+import time
+
+from benchmarks.fake_channel import ChannelSpec, FakeTelegramClient, SyntheticChannel
+from benchmarks.harness import configure_app_env
+
+MODES = ("scan", "search")
+
+
+def format_duration(seconds: float) -> str:
+    if seconds >= 3600:
+        return f"{seconds / 3600:.1f} ч"
+    if seconds >= 60:
+        return f"{seconds / 60:.1f} мин"
+    return f"{seconds:.1f} с"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="10000,100000,1000000", help="сообщений в канале через запятую")
+    parser.add_argument("--ratios", default="0.01,0.05,0.3", help="доли сообщений с хештегом через запятую")
+    parser.add_argument("--noise", type=float, default=0.002, help="доля сообщений со словом хештега без «#»")
+    parser.add_argument("--rate", type=float, default=2.0, help="бюджет запросов в секунду для оценки времени")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        configure_app_env()
+        os.environ["POSTS_DB_PATH"] = os.path.join(tmp, "posts.sqlite3")
+        os.environ["FEED_SNAPSHOT_PATH"] = ""
+        import app
+
+        logging.disable(logging.INFO)
+        source = app.CHANNEL_SOURCES[0]
+        loop = asyncio.new_event_loop()
+        print(
+            f"{'режим':<8}{'размер':>11}{'доля':>7}{'запросов':>10}{'скачано':>11}{'постов':>9}"
+            f"{'сбор, с':>9}{f'при {args.rate:g} зап/с':>15}  сверка"
+        )
+        try:
+            for size in (int(value) for value in args.sizes.split(",")):
+                for ratio in (float(value) for value in args.ratios.split(",")):
+                    channel = SyntheticChannel(
+                        ChannelSpec(
+                            size=size,
+                            hashtag_ratio=ratio,
+                            search_noise_ratio=args.noise,
+                            hashtag=source.hashtags[0],
+                            channel=source.name,
+                            seed=args.seed,
+                        )
+                    )
+                    reference = None
+                    for mode in MODES:
+                        client = FakeTelegramClient.for_channel(channel)
+                        started = time.perf_counter()
+                        posts, _ = loop.run_until_complete(
+                            app._collect_posts(client, source, None, search=mode == "search")
+                        )
+                        elapsed = time.perf_counter() - started
+                        keys = {post.key for post in posts}
+                        if reference is None:
+                            reference, verdict = keys, "эталон"
+                        elif keys == reference:
+                            verdict = "совпадает"
+                        else:
+                            verdict = f"расхождение: нет {len(reference - keys)}, лишних {len(keys - reference)}"
+                        print(
+                            f"{mode:<8}{size:>11,}{ratio:>7.0%}{client.requests:>10,}{client.messages_sent:>11,}"
+                            f"{len(posts):>9,}{elapsed:>9.2f}{format_duration(client.requests / args.rate):>15}"
+                            f"  {verdict}",
+                            flush=True,
+                        )
+                        del posts, keys
+                    reference = None
+        finally:
+            loop.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Случайный выбор поста для inline-ответа: random.choice по копии списка против SelectionEngine.
+
+Для каждого размера кэша печатает время построения движка, время одной
+выборки и долю повторов в 20 подряд ответах одному пользователю.
+
+Запуск:  python -m benchmarks.bench_selection [--sizes 1000,100000,1000000] [--draws 20000]
+"""
+
+import argparse
+import os
+import random
+import time
+
+os.environ.setdefault("POSTS_FEED_URL", "")
+
+import bot  # noqa: E402
+from benchmarks.fake_channel import ChannelSpec, SyntheticChannel  # noqa: E402
+
+
+def repeat_rate(draw, rounds: int = 200, streak: int = 20) -> float:
+    """Доля ответов, которые пользователь уже видел среди последних streak."""
+    repeats = 0
+    for user_id in range(rounds):
+        seen = set()
+        for _ in range(streak):
+            position = draw(user_id)
+            repeats += position in seen
+            seen.add(position)
+    return repeats / (rounds * streak)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1000,100000,1000000")
+    parser.add_argument("--draws", type=int, default=20000, help="выборок на замер")
+    args = parser.parse_args()
+
+    print(f"{'постов':>10}{'построение':>14}{'choice(copy)':>16}{'engine.draw':>14}{'повторы было':>15}{'повторы стало':>15}")
+    for size in (int(value) for value in args.sizes.split(",")):
+        channel = SyntheticChannel(ChannelSpec(size=size, hashtag_ratio=1.0, text_length=(1, 1)))
+        posts = list(range(size))
+        message_ids = list(range(size, 0, -1))
+        post_types = [channel.media_type(message_id) or "text" for message_id in message_ids]
+
+        started = time.perf_counter()
+        engine = bot.SelectionEngine(
+            message_ids,
+            post_types,
+            recency_half_life=bot.INLINE_RECENCY_HALF_LIFE,
+            type_weights={"video": 2.0},
+            max_users=bot.INLINE_BAG_USERS,
+        )
+        build = time.perf_counter() - started
+
+        # Прежний путь: список копировался на каждый запрос
+        draws = max(1, min(args.draws, 20_000_000 // max(size, 1)))
+        started = time.perf_counter()
+        for _ in range(draws):
+            random.choice(list(posts))
+        old = (time.perf_counter() - started) / draws
+
+        started = time.perf_counter()
+        for index in range(args.draws):
+            engine.draw(index % 1000)
+        new = (time.perf_counter() - started) / args.draws
+
+        old_repeats = repeat_rate(lambda user_id: random.choice(posts[: min(size, 50)]))
+        new_repeats = repeat_rate(bot.SelectionEngine(message_ids[:50], post_types[:50]).draw)
+        print(
+            f"{size:>10,}{build * 1000:>11.0f} мс{old * 1e6:>13.1f} мкс{new * 1e6:>11.2f} мкс"
+            f"{old_repeats:>14.1%}{new_repeats:>15.1%}"
+        )
+    print("(повторы — на пуле из 50 постов, 20 ответов подряд одному пользователю)")
+
+
+if __name__ == "__main__":
+    main()
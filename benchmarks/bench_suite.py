@@ -0,0 +1,209 @@
+"""
+Сквозной офлайн-бенчмарк: парсер, фид и inline-ответы бота на синтетическом канале.
+
+Для каждого размера канала (число сообщений) по очереди меряются:
+  collect          app._collect_posts по FakeTelegramClient (чтение и фильтр по хештегу)
+  commit           app._replace_cache: журнал, новая версия кэша и запись в SQLite (до конца)
+  serialize        сериализация снимка /feed?schema=2
+  feed (gzip)      GET /feed?schema=2 через Flask test client, снимок уже готов
+  feed (stream)    GET /feed?schema=2&stream=1 целиком
+  fetch            bot.fetch_posts_from_feed с локального HTTP-сервера фида
+  inline (ranked)  bot.inline_query с FakeRequest вместо Bot API
+  inline (random)  то же в режиме INLINE_MODE=random
+
+Для каждого этапа печатаются элементы в секунду, p50/p99 длительности вызова
+и пик памяти вызова (tracemalloc, отдельным прогоном). Логи INFO на время
+замеров отключены. Всё работает без сети и без аккаунта Telegram; сервер фида
+для fetch слушает 127.0.0.1 в том же процессе.
+
+Запуск:  python -m benchmarks.bench_suite [--sizes 1000,100000,1000000] [--hashtag-ratio 0.5]
+                                          [--stages collect,fetch,...] [--queries 300]
+"""
+
+import argparse
+import asyncio
+import gc
+import logging
+import os
+import random
+import tempfile
+import threading
+from typing import Callable, Dict, List
+
+from benchmarks.fake_bot_api import inline_update, make_bot
+from benchmarks.fake_channel import ChannelSpec, FakeTelegramClient, SyntheticChannel
+from benchmarks.harness import HEADER, StageResult, configure_app_env, format_row, measure
+
+QUERIES = ["", "", "драма", "комедия", "фил", "режиссёр сюжет", "netflix", "трил", "нолан", "кино 19"]
+STAGES = (
+    "collect", "commit", "serialize", "feed (gzip)", "feed (stream)", "fetch", "inline (ranked)", "inline (random)",
+)
+
+
+def bulk_samples(size: int, limit: int) -> int:
+    """Сколько раз повторять этап, который обрабатывает весь канал: на больших размерах — реже."""
+    return max(1, min(limit, 1_000_000 // max(size, 1)))
+
+
+def run_size(
+    app, bot, loop: asyncio.AbstractEventLoop, spec: ChannelSpec, stages: List[str], queries: int
+) -> List[StageResult]:
+    channel = SyntheticChannel(spec)
+    client = FakeTelegramClient.for_channel(channel)
+    source = app.CHANNEL_SOURCES[0]
+    size = spec.size
+    results: List[StageResult] = []
+    posts: List = []
+    repeats = bulk_samples(size, 5)
+
+    def release_app_cache() -> None:
+        nonlocal posts
+        posts = []
+        with app.cache_lock:
+            app.cached_posts = []
+            app._feed_snapshots.clear()
+            app.changelog.clear()
+        gc.collect()
+
+    def collect() -> int:
+        nonlocal posts
+        posts, _ = loop.run_until_complete(app._collect_posts(client, source, None))
+        return size
+
+    def commit() -> int:
+        with app.cache_lock:
+            app.cached_posts = []
+        app._replace_cache(posts)
+        # Запись в SQLite идёт в потоке cache_writer: меряем её целиком
+        app.cache_writer.flush()
+        return len(posts)
+
+    def serialize() -> int:
+        with app.cache_lock:
+            app._feed_snapshots.clear()
+        app.get_feed_snapshot(2)
+        return len(app.cached_posts)
+
+    http = app.app.test_client()
+
+    def feed_gzip() -> int:
+        response = http.get("/feed?schema=2", headers={"Accept-Encoding": "gzip"})
+        response.get_data()
+        return 1
+
+    def feed_stream() -> int:
+        # Без буферизации в test client: иначе пик памяти — это тело, собранное клиентом
+        response = http.get("/feed?schema=2&stream=1", buffered=False)
+        for _ in response.iter_encoded():
+            pass
+        response.close()
+        return len(app.cached_posts)
+
+    def fetch() -> int:
+        bot.remote_posts = []
+        bot.remote_posts_by_id = {}
+        loop.run_until_complete(bot.fetch_posts_from_feed(force=True))
+        return len(bot.remote_posts)
+
+    telegram_bot, _ = loop.run_until_complete(make_bot())
+    rng = random.Random(size)
+    update_ids = iter(range(1, 1 << 30))
+
+    def inline(mode: str) -> Callable[[], int]:
+        def call() -> int:
+            bot.INLINE_MODE = mode
+            update = inline_update(telegram_bot, next(update_ids), rng.choice(QUERIES), user_id=rng.randrange(1000))
+            loop.run_until_complete(bot.inline_query(update, None))
+            return 1
+        return call
+
+    cases: Dict[str, tuple] = {
+        "collect": (collect, repeats),
+        "commit": (commit, repeats),
+        "serialize": (serialize, repeats),
+        "feed (gzip)": (feed_gzip, queries),
+        "feed (stream)": (feed_stream, repeats),
+        "fetch": (fetch, repeats),
+        "inline (ranked)": (inline("ranked"), queries),
+        "inline (random)": (inline("random"), queries),
+    }
+    # Этапы зависят от предыдущих: без collect нечего класть в кэш, без fetch — не из чего отвечать
+    collect()
+    commit()
+    if any(stage.startswith("feed") for stage in stages):
+        feed_gzip()
+    if any(stage.startswith("inline") for stage in stages):
+        fetch()
+    for stage in STAGES:
+        if stage not in stages:
+            continue
+        if stage.startswith("inline") and posts:
+            # В проде бот — отдельный процесс: кэш парсера не должен раздувать его кучу и сборки мусора
+            release_app_cache()
+        call, samples = cases[stage]
+        results.append(measure(stage, size, call, samples))
+        print(format_row(results[-1]), flush=True)
+
+    loop.run_until_complete(telegram_bot.shutdown())
+    # Освобождаем кэши перед следующим размером
+    release_app_cache()
+    bot.remote_posts = []
+    bot.remote_posts_by_id = {}
+    loop.run_until_complete(bot.rebuild_posts_cache())
+    gc.collect()
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1000,100000,1000000", help="сообщений в канале через запятую")
+    parser.add_argument("--hashtag-ratio", type=float, default=0.5, help="доля сообщений с хештегом")
+    parser.add_argument("--text-length", default="40,600", help="диапазон длины текста, символов")
+    parser.add_argument("--cyrillic-ratio", type=float, default=0.9, help="доля кириллических слов")
+    parser.add_argument("--stages", default=",".join(STAGES), help="этапы через запятую")
+    parser.add_argument("--queries", type=int, default=300, help="запросов на этапы feed (gzip) и inline")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    stages = [stage.strip() for stage in args.stages.split(",")]
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        parser.error(f"неизвестные этапы: {', '.join(sorted(unknown))}")
+    low, high = (int(value) for value in args.text_length.split(","))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        configure_app_env()
+        os.environ["POSTS_DB_PATH"] = os.path.join(tmp, "posts.sqlite3")
+        os.environ["FEED_SNAPSHOT_PATH"] = ""
+        import app
+        import bot
+        from werkzeug.serving import make_server
+
+        logging.disable(logging.INFO)
+        server = make_server("127.0.0.1", 0, app.app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        feed_url = f"http://127.0.0.1:{server.port}/feed"
+        bot.POSTS_FEED_URL = bot.FEED_HTTP_URL = feed_url
+        bot.FEED_SOCKET_PATH = None
+        bot.FEED_SNAPSHOT_PATH = ""
+
+        loop = asyncio.new_event_loop()
+        print(HEADER)
+        try:
+            for size in (int(value) for value in args.sizes.split(",")):
+                spec = ChannelSpec(
+                    size=size,
+                    hashtag_ratio=args.hashtag_ratio,
+                    text_length=(low, high),
+                    cyrillic_ratio=args.cyrillic_ratio,
+                    channel=app.CHANNEL_SOURCES[0].name,
+                    seed=args.seed,
+                )
+                run_size(app, bot, loop, spec, stages, args.queries)
+        finally:
+            loop.run_until_complete(bot.close_feed_http())
+            loop.close()
+            server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,227 @@
+"""
+Задержка ответа на inline-запросы: webhook против long polling, полностью офлайн.
+
+Бот запускается отдельным процессом с BOT_API_BASE_URL на локальный фейковый
+Bot API (getMe, getUpdates, setWebhook, answerInlineQuery...). Одни и те же
+обновления воспроизводятся двумя способами: в polling — через очередь
+getUpdates, в webhook — POST'ом JSON на слушатель бота с секретным заголовком.
+Задержка — от отправки обновления до прихода answerInlineQuery.
+
+Посты бот берёт из снимка (FEED_SNAPSHOT_PATH), который пишет бенчмарк.
+
+Запуск:  python -m benchmarks.bench_webhook [--modes polling,webhook] [--updates 300]
+                                            [--rate 50] [--concurrency 4] [--replay updates.json]
+"""
+
+import argparse
+import json
+import logging
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+import httpx
+from flask import Flask, jsonify, request
+from werkzeug.serving import make_server
+
+from benchmarks.fake_bot_api import BOT_USER, TOKEN
+from benchmarks.fake_channel import ChannelSpec, SyntheticChannel
+from benchmarks.harness import percentile
+from feed_snapshot import write_snapshot
+
+API_PORT = 5096
+WEBHOOK_PORT = 5095
+SECRET = "bench-secret"
+QUERIES = ["", "драма", "комедия", "фильм", "трил", "нолан", "кино 19", "новинка"]
+
+
+class FakeBotApi:
+    """Минимальный Bot API: отдаёт обновления через getUpdates и засекает ответы бота."""
+
+    def __init__(self) -> None:
+        self.pending: List[Dict[str, Any]] = []
+        self.condition = threading.Condition()
+        self.sent_at: Dict[str, float] = {}
+        self.answered_at: Dict[str, float] = {}
+        self.app = Flask("fake_bot_api")
+        self.app.add_url_rule(f"/bot{TOKEN}/<method>", view_func=self.call, methods=["GET", "POST"])
+
+    def call(self, method: str):
+        params: Dict[str, Any] = dict(request.form) or (request.get_json(silent=True) or {})
+        if method == "getMe":
+            return self.ok(BOT_USER)
+        if method in ("setWebhook", "deleteWebhook", "setMyCommands", "close", "logOut"):
+            return self.ok(True)
+        if method == "getUpdates":
+            return self.ok(self.get_updates(int(params.get("offset") or 0), float(params.get("timeout") or 0)))
+        if method == "answerInlineQuery":
+            self.answered_at.setdefault(str(params.get("inline_query_id")), time.perf_counter())
+            return self.ok(True)
+        return self.ok(True)
+
+    @staticmethod
+    def ok(result: Any):
+        return jsonify({"ok": True, "result": result})
+
+    def get_updates(self, offset: int, timeout: float) -> List[Dict[str, Any]]:
+        deadline = time.monotonic() + timeout
+        with self.condition:
+            while True:
+                self.pending = [update for update in self.pending if update["update_id"] >= offset]
+                if self.pending or time.monotonic() >= deadline:
+                    return list(self.pending)
+                self.condition.wait(deadline - time.monotonic())
+
+    def push(self, update: Dict[str, Any]) -> None:
+        with self.condition:
+            self.pending.append(update)
+            self.condition.notify_all()
+
+
+def make_updates(count: int, seed: int = 1) -> List[Dict[str, Any]]:
+    """Синтетические inline-запросы в формате Telegram Update."""
+    rng = random.Random(seed)
+    return [
+        {
+            "update_id": index + 1,
+            "inline_query": {
+                "id": f"iq{index + 1}",
+                "from": {"id": 1000 + rng.randrange(50), "is_bot": False, "first_name": "Зритель"},
+                "query": rng.choice(QUERIES),
+                "offset": "",
+                "chat_type": "private",
+            },
+        }
+        for index in range(count)
+    ]
+
+
+def write_posts(path: str, count: int) -> None:
+    channel = SyntheticChannel(ChannelSpec(size=count, hashtag_ratio=1.0, media_ratio=0.0))
+    write_snapshot(path, channel.posts(), version=1, updated_at=time.time())
+
+
+def start_bot(mode: str, snapshot_path: str, concurrency: int) -> subprocess.Popen:
+    env = {
+        **os.environ,
+        "BOT_TOKEN": TOKEN,
+        "BOT_API_BASE_URL": f"http://127.0.0.1:{API_PORT}/bot",
+        "BOT_MODE": mode,
+        "BOT_CONCURRENT_UPDATES": str(concurrency),
+        "WEBHOOK_LISTEN": "127.0.0.1",
+        "WEBHOOK_PORT": str(WEBHOOK_PORT),
+        "WEBHOOK_PATH": "telegram",
+        "WEBHOOK_SECRET": SECRET,
+        "WEBHOOK_URL": "",
+        "POSTS_FEED_URL": "",
+        "FEED_SNAPSHOT_PATH": snapshot_path,
+    }
+    return subprocess.Popen(
+        [sys.executable, "bot.py"], env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+
+
+def replay(mode: str, api: FakeBotApi, updates: List[Dict[str, Any]], rate: float) -> Optional[Dict[str, float]]:
+    """Отправляет обновления с частотой rate и возвращает задержки ответов."""
+    webhook = f"http://127.0.0.1:{WEBHOOK_PORT}/telegram"
+    headers = {"X-Telegram-Bot-Api-Secret-Token": SECRET}
+    with httpx.Client() as client:
+        if mode == "webhook":
+            rejected = client.post(webhook, json=updates[0], headers={"X-Telegram-Bot-Api-Secret-Token": "wrong"})
+            assert rejected.status_code == 403, f"webhook принял неверный секрет: {rejected.status_code}"
+        started = time.perf_counter()
+        for index, update in enumerate(updates):
+            delay = started + index / rate - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            query_id = update.get("inline_query", {}).get("id")
+            if query_id:
+                api.sent_at[query_id] = time.perf_counter()
+            if mode == "webhook":
+                client.post(webhook, content=json.dumps(update), headers={**headers, "Content-Type": "application/json"})
+            else:
+                api.push(update)
+    deadline = time.perf_counter() + 10
+    while time.perf_counter() < deadline and not set(api.sent_at) <= set(api.answered_at):
+        time.sleep(0.05)
+    latencies = [api.answered_at[key] - sent for key, sent in api.sent_at.items() if key in api.answered_at]
+    if not latencies:
+        return None
+    return {
+        "answered": len(latencies),
+        "sent": len(api.sent_at),
+        "p50": percentile(latencies, 0.50) * 1000,
+        "p99": percentile(latencies, 0.99) * 1000,
+        "mean": sum(latencies) / len(latencies) * 1000,
+    }
+
+
+def wait_ready(mode: str, api: FakeBotApi, timeout: float = 30.0) -> None:
+    """Ждёт, пока бот начнёт принимать обновления (пробный запрос получил ответ)."""
+    probe = {"update_id": 0, "inline_query": {"id": "probe", "from": {"id": 1, "is_bot": False, "first_name": "p"}, "query": "", "offset": ""}}
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        if mode == "webhook":
+            try:
+                httpx.post(f"http://127.0.0.1:{WEBHOOK_PORT}/telegram", json=probe, headers={"X-Telegram-Bot-Api-Secret-Token": SECRET}, timeout=1)
+            except httpx.HTTPError:
+                time.sleep(0.2)
+                continue
+        elif "probe" not in api.answered_at and not api.pending:
+            api.push(probe)
+        time.sleep(0.2)
+        if "probe" in api.answered_at:
+            api.answered_at.clear()
+            return
+    raise SystemExit(f"Бот в режиме {mode} не ответил за {timeout:.0f} сек")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modes", default="polling,webhook")
+    parser.add_argument("--updates", type=int, default=300, help="сколько синтетических inline-запросов")
+    parser.add_argument("--rate", type=float, default=50.0, help="обновлений в секунду")
+    parser.add_argument("--concurrency", type=int, default=4, help="BOT_CONCURRENT_UPDATES")
+    parser.add_argument("--posts", type=int, default=5000, help="постов в снимке")
+    parser.add_argument("--replay", help="JSON-файл со списком записанных Update вместо синтетических")
+    args = parser.parse_args()
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+
+    if args.replay:
+        with open(args.replay, encoding="utf-8") as file:
+            updates = json.load(file)
+    else:
+        updates = make_updates(args.updates)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        snapshot_path = os.path.join(tmp, "feed.snapshot")
+        write_posts(snapshot_path, args.posts)
+        print(f"{'режим':<10}{'ответов':>12}{'p50, мс':>10}{'p99, мс':>10}{'среднее':>10}")
+        for mode in args.modes.split(","):
+            api = FakeBotApi()
+            server = make_server("127.0.0.1", API_PORT, api.app, threaded=True)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            bot_process = start_bot(mode, snapshot_path, args.concurrency)
+            try:
+                wait_ready(mode, api)
+                result = replay(mode, api, updates, args.rate)
+            finally:
+                bot_process.terminate()
+                bot_process.wait()
+                server.shutdown()
+            if result is None:
+                print(f"{mode:<10}{'нет ответов':>12}")
+                continue
+            print(
+                f"{mode:<10}{result['answered']:>6.0f}/{result['sent']:<5.0f}{result['p50']:>10.1f}"
+                f"{result['p99']:>10.1f}{result['mean']:>10.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
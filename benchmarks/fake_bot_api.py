@@ -0,0 +1,79 @@
+"""
+Поддельный Bot API для python-telegram-bot без сети.
+
+FakeRequest подменяет HTTP-слой telegram.Bot: все методы проходят обычный
+путь PTB (сборка параметров, сериализация результатов в JSON), но вместо
+запроса к api.telegram.org ответ формируется на месте. Так inline_query бота
+можно вызывать в цикле и мерить вместе с затратами на ответ.
+"""
+
+import json
+from typing import Any, Dict, List, Optional, Tuple
+
+from telegram import Bot, InlineQuery, Update, User
+from telegram.request import BaseRequest, RequestData
+
+TOKEN = "123456:benchmark"
+BOT_USER = {"id": 123456, "is_bot": True, "first_name": "Kinotip", "username": "kinotip_bench_bot"}
+
+
+class FakeRequest(BaseRequest):
+    """HTTP-слой PTB, который отвечает сам и запоминает вызовы."""
+
+    def __init__(self) -> None:
+        self.calls: Dict[str, int] = {}
+        # Параметры последних answerInlineQuery (id запроса и число результатов)
+        self.answers: List[Tuple[str, int]] = []
+        self.payload_bytes = 0
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    async def do_request(
+        self,
+        url: str,
+        method: str,
+        request_data: Optional[RequestData] = None,
+        read_timeout: Any = None,
+        write_timeout: Any = None,
+        connect_timeout: Any = None,
+        pool_timeout: Any = None,
+    ) -> Tuple[int, bytes]:
+        name = url.rsplit("/", 1)[-1]
+        self.calls[name] = self.calls.get(name, 0) + 1
+        params: Dict[str, Any] = {}
+        if request_data is not None:
+            # Те же байты, что PTB отправил бы в Telegram
+            self.payload_bytes += len(request_data.json_payload)
+            params = request_data.parameters
+        result: Any = True
+        if name == "getMe":
+            result = BOT_USER
+        elif name == "answerInlineQuery":
+            self.answers.append((str(params.get("inline_query_id")), len(params.get("results") or ())))
+        elif name == "getUpdates":
+            result = []
+        return 200, json.dumps({"ok": True, "result": result}).encode("utf-8")
+
+
+async def make_bot() -> Tuple[Bot, FakeRequest]:
+    """Инициализированный telegram.Bot поверх FakeRequest."""
+    request = FakeRequest()
+    bot = Bot(TOKEN, request=request, get_updates_request=FakeRequest())
+    await bot.initialize()
+    return bot, request
+
+
+def inline_update(bot: Bot, update_id: int, query: str, user_id: int = 1, offset: str = "") -> Update:
+    """Update с inline-запросом, привязанным к bot (inline.answer уходит в FakeRequest)."""
+    inline = InlineQuery(
+        id=f"iq{update_id}",
+        from_user=User(id=user_id, first_name="Зритель", is_bot=False),
+        query=query,
+        offset=offset,
+    )
+    inline.set_bot(bot)
+    return Update(update_id=update_id, inline_query=inline)
@@ -0,0 +1,282 @@
+"""
+Синтетический канал и поддельный клиент Telethon для офлайн-бенчмарков.
+
+SyntheticChannel детерминированно (по seed) описывает канал заданного размера:
+доля постов с хештегом, длины текстов, доля кириллицы, доля медиа. Сообщения
+не хранятся целиком: для каждого id в массивах лежат смещение и длина текста
+в общем корпусе и флаги, а объект сообщения собирается при обращении. Поэтому
+канал на миллион сообщений занимает десятки мегабайт, а у каждого текста —
+свой объект строки, как у настоящих сообщений.
+
+FakeTelegramClient отдаёт эти сообщения через iter_messages (и get_messages) с той же
+семантикой limit / offset_id / min_id / max_id / reverse, что у Telethon,
+пачками по 100 и считает «запросы» к API. С search= он, как поиск
+Telegram, отдаёт только сообщения с хештегом канала — и, как настоящий
+поиск, иногда сообщения, где то же слово стоит без «#».
+"""
+
+import asyncio
+import bisect
+import random
+import zlib
+from array import array
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Any, AsyncIterator, Dict, Iterator, List, Mapping, Optional, Sequence, Tuple
+
+CYRILLIC_WORDS = (
+    "фильм режиссёр сюжет финал герой драма комедия триллер сцена кадр актёр роль "
+    "премьера зритель история любовь война детектив саундтрек титры сериал сезон "
+    "оператор монтаж экранизация романа продолжение вселенная злодей погоня ужасы "
+    "мультфильм документальный советский классика новинка рейтинг трейлер посмотреть"
+).split()
+LATIN_WORDS = (
+    "film director plot ending hero drama comedy thriller scene frame actor role "
+    "premiere story love war detective soundtrack series season cinema netflix imdb"
+).split()
+MEDIA_TYPES = ("photo", "video", "document", "sticker")
+# Сколько сообщений Telethon получает за один запрос GetHistory / Search
+BATCH_SIZE = 100
+
+_FLAG_HASHTAG = 1
+_FLAG_UPPER = 2
+_FLAG_EMPTY = 4
+# Слово хештега без «#»: поиск Telegram такое сообщение тоже находит
+_FLAG_SEARCH_NOISE = 8
+
+
+@dataclass(frozen=True)
+class ChannelSpec:
+    """Параметры синтетического канала."""
+
+    size: int = 1000
+    # Доля сообщений с хештегом
+    hashtag_ratio: float = 0.3
+    # Длина текста сообщения, символов (равномерно в диапазоне)
+    text_length: Tuple[int, int] = (40, 600)
+    # Доля кириллических слов (остальные — латиница)
+    cyrillic_ratio: float = 0.9
+    # Доля сообщений с медиа и доля медиа без подписи
+    media_ratio: float = 0.5
+    empty_caption_ratio: float = 0.1
+    # Доля сообщений без хештега, где есть его слово без «#» (ложные находки поиска)
+    search_noise_ratio: float = 0.0
+    hashtag: str = "#showtitrvibe"
+    channel: str = "showtitrvibe"
+    seed: int = 1
+
+
+class FakeMedia:
+    """Медиа сообщения: достаточно того, что объект истинный и у него есть id."""
+
+    __slots__ = ("kind", "id")
+
+    def __init__(self, kind: str, media_id: int):
+        self.kind = kind
+        self.id = media_id
+
+
+class FakeMessage:
+    """Сообщение канала с теми атрибутами telethon Message, которые читает парсер."""
+
+    __slots__ = ("id", "chat_id", "message", "date", "media", "photo", "document", "video", "sticker")
+
+    def __init__(self, message_id: int, text: str, date: datetime, media_type: Optional[str], chat_id: int = 0):
+        self.id = message_id
+        self.chat_id = chat_id
+        self.message = text
+        self.date = date
+        self.media = FakeMedia(media_type, message_id) if media_type else None
+        self.photo = self.media if media_type == "photo" else None
+        # Как в Telethon: видео и стикеры — это документы с атрибутами
+        self.document = self.media if media_type in ("document", "video", "sticker") else None
+        self.video = self.media if media_type == "video" else None
+        self.sticker = self.media if media_type == "sticker" else None
+
+    @property
+    def raw_text(self) -> str:
+        return self.message
+
+    text = raw_text
+
+
+class SyntheticChannel:
+    """Детерминированный синтетический канал: сообщения с id от 1 до spec.size."""
+
+    def __init__(self, spec: ChannelSpec = ChannelSpec()):
+        self.spec = spec
+        rng = random.Random(spec.seed)
+        self.corpus = self._make_corpus(rng, spec.cyrillic_ratio, max(1 << 16, spec.text_length[1] * 64))
+        self._offsets = array("I")
+        self._lengths = array("H")
+        self._flags = array("B")
+        self._media = array("b")
+        low, high = spec.text_length
+        corpus_limit = len(self.corpus) - high
+        for _ in range(spec.size):
+            flags = 0
+            if rng.random() < spec.hashtag_ratio:
+                flags |= _FLAG_HASHTAG
+                if rng.random() < 0.1:
+                    flags |= _FLAG_UPPER
+            media = rng.randrange(len(MEDIA_TYPES)) if rng.random() < spec.media_ratio else -1
+            if media >= 0 and not flags & _FLAG_HASHTAG and rng.random() < spec.empty_caption_ratio:
+                flags |= _FLAG_EMPTY
+            elif not flags & _FLAG_HASHTAG and rng.random() < spec.search_noise_ratio:
+                flags |= _FLAG_SEARCH_NOISE
+            # Текст начинается с начала слова
+            self._offsets.append(self.corpus.find(" ", rng.randrange(corpus_limit)) + 1)
+            self._lengths.append(rng.randint(low, high))
+            self._flags.append(flags)
+            self._media.append(media)
+        self.started_at = datetime(2020, 1, 1, tzinfo=timezone.utc)
+        # Что находит поиск по хештегу, по возрастанию id: индекс на стороне «сервера»
+        self.search_hits = array(
+            "I", (index + 1 for index, flags in enumerate(self._flags) if flags & (_FLAG_HASHTAG | _FLAG_SEARCH_NOISE))
+        )
+        # Peer id канала, как у Telethon (-100…), — стабилен для одного имени
+        self.chat_id = -1_000_000_000_000 - zlib.crc32(spec.channel.encode("utf-8"))
+
+    @staticmethod
+    def _make_corpus(rng: random.Random, cyrillic_ratio: float, length: int) -> str:
+        words = []
+        size = 0
+        while size < length:
+            word = rng.choice(CYRILLIC_WORDS if rng.random() < cyrillic_ratio else LATIN_WORDS)
+            words.append(word)
+            size += len(word) + 1
+        return " ".join(words)
+
+    def __len__(self) -> int:
+        return self.spec.size
+
+    @property
+    def last_id(self) -> int:
+        return self.spec.size
+
+    def has_hashtag(self, message_id: int) -> bool:
+        return bool(self._flags[message_id - 1] & _FLAG_HASHTAG)
+
+    @property
+    def tagged_count(self) -> int:
+        return sum(flags & _FLAG_HASHTAG for flags in self._flags)
+
+    def media_type(self, message_id: int) -> Optional[str]:
+        media = self._media[message_id - 1]
+        return MEDIA_TYPES[media] if media >= 0 else None
+
+    def text(self, message_id: int) -> str:
+        """Текст сообщения; каждый вызов собирает новый объект строки."""
+        index = message_id - 1
+        flags = self._flags[index]
+        if flags & _FLAG_EMPTY:
+            return ""
+        offset = self._offsets[index]
+        body = self.corpus[offset:offset + self._lengths[index]].strip()
+        if flags & _FLAG_HASHTAG:
+            hashtag = self.spec.hashtag.upper() if flags & _FLAG_UPPER else self.spec.hashtag
+            # Хештег то в начале, то в конце поста
+            return f"{hashtag} {body}" if message_id % 3 == 0 else f"Кино №{message_id}: {body} {hashtag}"
+        if flags & _FLAG_SEARCH_NOISE:
+            return f"Кино №{message_id}: {body} {self.spec.hashtag.lstrip('#')}"
+        return f"Кино №{message_id}: {body}"
+
+    def date(self, message_id: int) -> datetime:
+        return self.started_at + timedelta(minutes=message_id)
+
+    def message(self, message_id: int) -> FakeMessage:
+        return FakeMessage(
+            message_id,
+            self.text(message_id),
+            self.date(message_id),
+            self.media_type(message_id),
+            self.chat_id,
+        )
+
+    def link(self, message_id: int) -> str:
+        return f"https://t.me/{self.spec.channel}/{message_id}"
+
+    def posts(self) -> Iterator[Tuple[int, str, str, str, str, int]]:
+        """Посты с хештегом от новых к старым: (message_id, type, text, link, channel, date) — как в кэше парсера."""
+        channel = self.spec.channel.lower()
+        for message_id in range(self.last_id, 0, -1):
+            if self.has_hashtag(message_id):
+                yield (
+                    message_id,
+                    self.media_type(message_id) or "text",
+                    self.text(message_id),
+                    self.link(message_id),
+                    channel,
+                    int(self.date(message_id).timestamp()),
+                )
+
+
+class FakeTelegramClient:
+    """Поддельный TelegramClient: iter_messages по синтетическим каналам.
+
+    request_latency — задержка на каждый запрос пачки (имитация сети).
+    """
+
+    def __init__(self, channels: Mapping[str, SyntheticChannel], request_latency: float = 0.0):
+        self.channels: Dict[str, SyntheticChannel] = {
+            name.lstrip("@").lower(): channel for name, channel in channels.items()
+        }
+        self.request_latency = request_latency
+        self.requests = 0
+        self.messages_sent = 0
+
+    @classmethod
+    def for_channel(cls, channel: SyntheticChannel, **kwargs: Any) -> "FakeTelegramClient":
+        return cls({channel.spec.channel: channel}, **kwargs)
+
+    def _channel(self, entity: Any) -> SyntheticChannel:
+        channel = self.channels.get(str(entity).lstrip("@").lower())
+        if channel is None:
+            # Так же ведёт себя Telethon для неизвестного username
+            raise ValueError(f'No user has "{entity}" as username')
+        return channel
+
+    async def iter_messages(
+        self,
+        entity: Any,
+        limit: Optional[int] = None,
+        *,
+        offset_id: int = 0,
+        min_id: int = 0,
+        max_id: int = 0,
+        reverse: bool = False,
+        search: Optional[str] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[FakeMessage]:
+        channel = self._channel(entity)
+        low = min_id + 1
+        high = channel.last_id
+        if max_id:
+            high = min(high, max_id - 1)
+        if reverse:
+            low = max(low, offset_id + 1)
+        elif offset_id:
+            high = min(high, offset_id - 1)
+        ids: Sequence[int]
+        if search:
+            hits = channel.search_hits
+            # Поиск Telegram не различает регистр; «#» в запросе не обязателен
+            if search.lstrip("#").lower() != channel.spec.hashtag.lstrip("#").lower() or high < low:
+                hits = hits[:0]
+            else:
+                hits = hits[bisect.bisect_left(hits, low):bisect.bisect_right(hits, high)]
+            ids = hits if reverse else hits[::-1]
+        else:
+            ids = range(low, high + 1) if reverse else range(high, low - 1, -1)
+        if limit is not None:
+            ids = ids[:limit]
+        for start in range(0, len(ids), BATCH_SIZE):
+            self.requests += 1
+            if self.request_latency:
+                await asyncio.sleep(self.request_latency)
+            for message_id in ids[start:start + BATCH_SIZE]:
+                self.messages_sent += 1
+                yield channel.message(message_id)
+
+    async def get_messages(self, entity: Any, limit: Optional[int] = None, **kwargs: Any) -> List[FakeMessage]:
+        return [message async for message in self.iter_messages(entity, limit, **kwargs)]
@@ -0,0 +1,82 @@
+"""
+Общие части бенчмарков: окружение для импорта app.py, замеры времени и памяти, таблица.
+"""
+
+import gc
+import os
+import time
+import tracemalloc
+from dataclasses import dataclass
+from typing import Callable, List, Sequence
+
+
+def configure_app_env() -> None:
+    """Заглушки настроек Telegram: app.py требует их при импорте, но в сеть бенчмарки не ходят."""
+    os.environ.setdefault("API_ID", "1")
+    os.environ.setdefault("API_HASH", "benchmark")
+    os.environ.setdefault("PHONE", "+70000000000")
+    os.environ.setdefault("CHANNEL_USERNAME", "showtitrvibe")
+    # У поддельного клиента нет лимитов Telegram: бюджет запросов не должен попадать в замеры
+    os.environ.setdefault("TELEGRAM_REQUESTS_PER_SECOND", "0")
+
+
+def percentile(values: Sequence[float], fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+@dataclass
+class StageResult:
+    """Итог одного этапа: длительности вызовов, сколько элементов обработал вызов, пик памяти."""
+
+    stage: str
+    size: int
+    items: int
+    durations: List[float]
+    peak_bytes: int
+
+    @property
+    def throughput(self) -> float:
+        total = sum(self.durations)
+        return self.items * len(self.durations) / total if total else float("inf")
+
+    @property
+    def p50(self) -> float:
+        return percentile(self.durations, 0.50)
+
+    @property
+    def p99(self) -> float:
+        return percentile(self.durations, 0.99)
+
+
+def measure(stage: str, size: int, call: Callable[[], int], samples: int) -> StageResult:
+    """Вызывает call samples раз и один раз под tracemalloc.
+
+    call возвращает число обработанных элементов. Время меряется без
+    tracemalloc (он замедляет аллокации в разы), пик памяти — отдельным
+    прогоном: сколько байт сверх уже занятого понадобилось вызову.
+    """
+    durations: List[float] = []
+    items = 0
+    for _ in range(samples):
+        started = time.perf_counter()
+        items = call()
+        durations.append(time.perf_counter() - started)
+    gc.collect()
+    tracemalloc.start()
+    try:
+        call()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return StageResult(stage, size, items, durations, peak)
+
+
+HEADER = f"{'этап':<26}{'размер':>10}{'элементов':>11}{'элем/с':>12}{'p50, мс':>11}{'p99, мс':>11}{'пик, МБ':>10}"
+
+
+def format_row(result: StageResult) -> str:
+    return (
+        f"{result.stage:<26}{result.size:>10,}{result.items:>11,}{result.throughput:>12,.0f}"
+        f"{result.p50 * 1000:>11.2f}{result.p99 * 1000:>11.2f}{result.peak_bytes / 2**20:>10.1f}"
+    )
@@ -1,14 +1,24 @@
 import os
+import re
+import json
+import sys
+import math
 import random
 import logging
+from bisect import bisect_left, bisect_right, insort
+from collections import OrderedDict
 import time
 import asyncio
 import atexit
-import requests
+import secrets
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import httpx
+from importlib.util import find_spec
 from multiprocessing import Process
 from urllib.parse import urlparse
 from dataclasses import dataclass
-from typing import List, Literal, Optional, Any, Dict
+from typing import AsyncIterator, Callable, Iterable, List, Literal, Optional, Any, Dict, Sequence, Set
 from dotenv import load_dotenv
 from telegram import (
     Update,
@@ -22,6 +32,11 @@ from telegram import (
 )
 from telegram.ext import Application, CommandHandler, InlineQueryHandler, ContextTypes
 
+from feed_snapshot import MappedSnapshot, SnapshotFormatError, snapshot_file_key
+from feed_url import split_unix_feed_url
+from media_cache import MediaFileStore, MediaPipeline, PTBBotApiClient, message_media
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, Counter, Gauge, Histogram, Registry
+
 # Загружаем переменные окружения
 load_dotenv()
 
@@ -35,29 +50,660 @@ logger = logging.getLogger(__name__)
 # Получаем токен бота из переменных окружения
 BOT_TOKEN = os.getenv('BOT_TOKEN')
 POSTS_FEED_URL = os.getenv('POSTS_FEED_URL')
+# Путь Unix-сокета фида (None — фид по TCP) и адрес, по которому к фиду обращается HTTP-клиент
+FEED_SOCKET_PATH, FEED_HTTP_URL = split_unix_feed_url(POSTS_FEED_URL or '')
+# Снимок кэша, который пишет парсер на этой же машине; если задан, посты читаются из него через mmap
+FEED_SNAPSHOT_PATH = os.getenv('FEED_SNAPSHOT_PATH', '').strip()
 
-@dataclass
+@dataclass(slots=True)
 class PostItem:
+    """Пост в кэше бота.
+
+    Без __dict__ (slots); content заполняется, только если отличается от
+    caption, — читатели берут `content or caption`.
+    """
+
     message_id: int
     type: Literal['photo', 'document', 'video', 'sticker', 'text'] = 'text'
     caption: str = ''
     content: str = ''
     file_id: Optional[str] = None
     link: Optional[str] = None
+    # Канал-источник (пусто — пост из фида без каналов или ручной) и дата (unix-время)
+    channel: str = ''
+    date: int = 0
+
+    @property
+    def key(self) -> tuple[str, int]:
+        """Пост фида однозначно задаётся каналом и message_id."""
+        return (self.channel, self.message_id)
+
+
+class MappedPosts(Sequence[PostItem]):
+    """Посты фида прямо из отображённого в память снимка парсера.
+
+    PostItem собирается при обращении к элементу и в кэше не хранится;
+    ручные посты (extra) идут после постов снимка.
+    """
+
+    def __init__(self, snapshot: MappedSnapshot, extra: Sequence[PostItem] = ()):
+        self.snapshot = snapshot
+        self.extra = list(extra)
+
+    def with_extra(self, extra: Sequence[PostItem]) -> "MappedPosts":
+        """Тот же снимок с другим набором ручных постов."""
+        return MappedPosts(self.snapshot, extra)
+
+    def __len__(self) -> int:
+        return len(self.snapshot) + len(self.extra)
+
+    def _item(self, index: int) -> PostItem:
+        if index >= len(self.snapshot):
+            return self.extra[index - len(self.snapshot)]
+        message_id, post_type, text, link, channel, date = self.snapshot.record(index)
+        return PostItem(  # type: ignore[arg-type]
+            message_id=message_id, type=post_type, caption=text, link=link, channel=channel, date=date
+        )
+
+    def __getitem__(self, index):  # type: ignore[override]
+        if isinstance(index, slice):
+            return [self._item(position) for position in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return self._item(index)
 
 
 DEFAULT_TITLE = "Рекомендация фильма"
 
+_TOKEN_RE = re.compile(r"\w+")
+
+
+def _tokenize(text: str) -> List[str]:
+    """Нормализует текст для поиска: нижний регистр, ё -> е, только слова."""
+    return _TOKEN_RE.findall(text.lower().replace('ё', 'е'))
+
+
+class SearchIndex:
+    """Инвертированный индекс постов для inline-поиска.
+
+    Токены хранятся в отсортированном списке, поэтому все токены с нужным
+    префиксом находятся двоичным поиском, а стоимость запроса зависит от
+    размера результата, а не от объёма текста в кэше.
+
+    Позиции — ячейки индекса. При сборке они идут в порядке кэша; пост из
+    дельты фида (add) занимает новую ячейку в конце, ячейка удалённого поста
+    (remove) пустеет, а ячейки остальных постов не меняются. Место ячейки в
+    порядке кэша возвращает rank.
+    """
+
+    def __init__(self, posts: Sequence[PostItem]):
+        # Посты снимка остаются в mmap (дельт к ним не бывает); список копируем — его меняют add и remove
+        self.posts: Sequence[Optional[PostItem]] = posts if isinstance(posts, MappedPosts) else list(posts)
+        postings: Dict[str, Set[int]] = {}
+        message_ids: List[int] = []
+        post_types: List[str] = []
+        channels: List[str] = []
+        for position, post in enumerate(posts):
+            message_ids.append(post.message_id)
+            post_types.append(post.type)
+            channels.append(post.channel)
+            for token in _tokenize(post.caption or post.content or ''):
+                postings.setdefault(token, set()).add(position)
+        # message_id, тип и канал по позиции: для весов выборки и медиа без обращения к постам
+        self.message_ids = message_ids
+        self.post_types = post_types
+        self.channels = channels
+        self._postings = postings
+        self._tokens = sorted(postings)
+        # Место в порядке кэша для ячеек из дельт (у ячеек сборки оно равно номеру ячейки)
+        self._ranks: Dict[int, float] = {}
+        self._positions: Optional[Dict[tuple[str, int], int]] = None
+        self.removed = 0
+        # Ячеек, добавленных или опустевших после сборки
+        self.changes = 0
+
+    def __len__(self) -> int:
+        """Постов в индексе (без опустевших ячеек)."""
+        return len(self.posts) - self.removed
+
+    def key(self, position: int) -> tuple[str, int]:
+        """Ключ поста (канал, message_id) по позиции."""
+        return (self.channels[position], self.message_ids[position])
+
+    def rank(self, position: int) -> float:
+        """Место позиции в порядке кэша: меньше — новее."""
+        return self._ranks.get(position, position)
+
+    def index_keys(self) -> None:
+        """Строит словарь ключ -> позиция для position (иначе он строится при первом обращении)."""
+        if self._positions is not None:
+            return
+        positions: Dict[tuple[str, int], int] = {}
+        # С конца: при совпадении ключей остаётся пост раньше в кэше — пост фида, а не ручной
+        for position in range(len(self.posts) - 1, -1, -1):
+            if not self.removed or self.posts[position] is not None:
+                positions[(self.channels[position], self.message_ids[position])] = position
+        self._positions = positions
+
+    def position(self, key: tuple[str, int]) -> Optional[int]:
+        """Позиция поста по ключу (канал, message_id)."""
+        if self._positions is None:
+            self.index_keys()
+            assert self._positions is not None
+        return self._positions.get(key)
+
+    def add(self, post: PostItem, rank: float) -> int:
+        """Добавляет пост в новую ячейку; rank — его место в порядке кэша (см. rank)."""
+        position = len(self.posts)
+        self.posts.append(post)  # type: ignore[attr-defined]
+        self.message_ids.append(post.message_id)
+        self.post_types.append(post.type)
+        self.channels.append(post.channel)
+        self._ranks[position] = rank
+        for token in set(_tokenize(post.caption or post.content or '')):
+            positions = self._postings.get(token)
+            if positions is None:
+                positions = self._postings[token] = set()
+                insort(self._tokens, token)
+            positions.add(position)
+        if self._positions is not None:
+            self._positions[post.key] = position
+        self.changes += 1
+        return position
+
+    def remove(self, position: int) -> None:
+        """Убирает пост из индекса: его ячейка пустеет, остальные позиции не меняются."""
+        post = self.posts[position]
+        if post is None:
+            return
+        for token in set(_tokenize(post.caption or post.content or '')):
+            positions = self._postings[token]
+            positions.discard(position)
+            if not positions:
+                del self._postings[token]
+                del self._tokens[bisect_left(self._tokens, token)]
+        self.posts[position] = None  # type: ignore[index]
+        if self._positions is not None and self._positions.get(post.key) == position:
+            del self._positions[post.key]
+        self.removed += 1
+        self.changes += 1
+
+    def _prefix_tokens(self, prefix: str) -> List[str]:
+        """Слова словаря, начинающиеся с prefix."""
+        tokens = self._tokens
+        start = bisect_left(tokens, prefix)
+        end = bisect_left(tokens, prefix + '\uffff', lo=start)
+        return tokens[start:end]
+
+    def _prefix_positions(self, prefix: str) -> Set[int]:
+        """Позиции постов, где есть слово, начинающееся с prefix."""
+        tokens = self._prefix_tokens(prefix)
+        if len(tokens) == 1:
+            return self._postings[tokens[0]]
+        positions: Set[int] = set()
+        for token in tokens:
+            positions |= self._postings[token]
+        return positions
+
+    def search_positions(self, query: str) -> List[int]:
+        """Позиции постов, где каждое слово запроса — начало какого-то слова (в порядке кэша)."""
+        query_tokens = _tokenize(query)
+        if not query_tokens:
+            return []
+        matches: Optional[Set[int]] = None
+        for token in sorted(set(query_tokens), key=len, reverse=True):
+            positions = self._prefix_positions(token)
+            matches = set(positions) if matches is None else matches & positions
+            if not matches:
+                return []
+        return sorted(matches or (), key=self.rank) if self._ranks else sorted(matches or ())
+
+    def rank_positions(self, query: str) -> List[int]:
+        """Те же совпадения, что у search_positions, но от самых релевантных к менее.
+
+        Точное совпадение слова весит вдвое больше префиксного, редкие слова —
+        больше частых (idf); при равном счёте выше более новые посты (раньше в кэше).
+        """
+        query_tokens = set(_tokenize(query))
+        if not query_tokens:
+            return []
+        total = len(self)
+        scores: Optional[Dict[int, float]] = None
+        for query_token in query_tokens:
+            token_scores: Dict[int, float] = {}
+            for token in self._prefix_tokens(query_token):
+                positions = self._postings[token]
+                weight = (2.0 if token == query_token else 1.0) * math.log(1 + total / len(positions))
+                for position in positions:
+                    if weight > token_scores.get(position, 0.0):
+                        token_scores[position] = weight
+            if scores is None:
+                scores = token_scores
+            else:
+                scores = {
+                    position: score + token_scores[position]
+                    for position, score in scores.items()
+                    if position in token_scores
+                }
+            if not scores:
+                return []
+        assert scores is not None
+        # message_id разных каналов несравнимы, поэтому свежесть — по месту в кэше (он идёт от новых к старым)
+        ranks = self._ranks
+        return sorted(scores, key=lambda position: (-scores[position], ranks.get(position, position)))
+
+
+class ShuffleBag:
+    """Перестановка позиций 0..size-1, выдаваемая по одной без повторов.
+
+    Ленивый Фишер–Йетс: хранятся только переставленные ячейки, поэтому и
+    выдача, и изъятие конкретной позиции — O(1), а память растёт с числом
+    выданных элементов, а не с размером кэша. Когда всё выдано, начинается новый круг.
+    """
+
+    __slots__ = ('size', 'remaining', '_slots', '_where')
+
+    def __init__(self, size: int):
+        self.size = size
+        self.remaining = size
+        self._slots: Dict[int, int] = {}  # ячейка -> позиция, если не совпадают
+        self._where: Dict[int, int] = {}  # позиция -> ячейка, если не совпадают
+
+    def __contains__(self, position: int) -> bool:
+        """Позиция ещё не выдана в текущем круге."""
+        return self._where.get(position, position) < self.remaining
+
+    def _take(self, cell: int) -> int:
+        last = self.remaining - 1
+        position = self._slots.get(cell, cell)
+        last_position = self._slots.get(last, last)
+        self._slots[cell] = last_position
+        self._where[last_position] = cell
+        self._slots[last] = position
+        self._where[position] = last
+        self.remaining = last
+        return position
+
+    def _refill_if_empty(self) -> None:
+        if self.remaining == 0:
+            self.remaining = self.size
+            self._slots.clear()
+            self._where.clear()
+
+    def draw(self, rng: random.Random) -> int:
+        """Случайная ещё не выданная позиция."""
+        self._refill_if_empty()
+        return self._take(rng.randrange(self.remaining))
+
+    def grow(self, size: int) -> None:
+        """Добавляет в текущий круг позиции self.size..size-1 как ещё не выданные."""
+        for position in range(self.size, size):
+            if self.remaining < self.size:
+                # Первая выданная ячейка переезжает в конец, на её место встаёт новая позиция
+                moved = self._slots.get(self.remaining, self.remaining)
+                self._slots[self.size] = moved
+                self._where[moved] = self.size
+                self._slots[self.remaining] = position
+                self._where[position] = self.remaining
+            self.remaining += 1
+            self.size += 1
+
+    def drawn(self) -> List[int]:
+        """Позиции, уже выданные в текущем круге."""
+        return [self._slots.get(cell, cell) for cell in range(self.remaining, self.size)] if self.remaining else []
+
+    def take(self, position: int) -> bool:
+        """Отмечает позицию выданной; False — она уже выдана в этом круге."""
+        self._refill_if_empty()
+        if position not in self:
+            return False
+        self._take(self._where.get(position, position))
+        return True
+
+
+class SelectionEngine:
+    """Случайный выбор постов: веса через alias-таблицу и мешки без повторов для каждого пользователя.
+
+    Строится один раз на версию кэша. Выборка по весу (свежесть, тип медиа) —
+    метод Уолкера/Воуза, O(1); если выпала позиция, которую пользователь уже
+    видел в этом круге, берётся следующая из его мешка — тоже O(1).
+    Мешков не больше max_users, давно неактивные вытесняются (LRU).
+
+    Дельты фида меняют движок на месте: add заводит позицию с её весом,
+    remove исключает позицию из выдачи. Alias-таблица при этом не
+    пересобирается: добавленные позиции выбираются отдельно, пропорционально
+    их суммарному весу, а выпавшая удалённая позиция выбирается заново.
+    Мешки дорастают до новых позиций при следующем запросе пользователя.
+
+    При полной пересборке позиции меняются, поэтому мешки переносятся в
+    движок новой версии по ключам постов (channel, message_id): seen_keys
+    прежнего движка отдаёт ключи выданных постов, carry_bags нового их
+    запоминает, а мешок пользователя пересобирается при его следующем запросе.
+    """
+
+    def __init__(
+        self,
+        message_ids: Sequence[int],
+        post_types: Sequence[str],
+        recency_half_life: float = 0.0,
+        type_weights: Optional[Dict[str, float]] = None,
+        max_users: int = 10000,
+        key: Optional[Callable[[int], tuple[str, int]]] = None,
+        position: Optional[Callable[[tuple[str, int]], Optional[int]]] = None,
+    ):
+        self.size = len(message_ids)
+        self.max_users = max_users
+        # Ключ поста по позиции и позиция по ключу; без них мешки в новую версию не переносятся
+        self._key = key
+        self._position = position
+        self._bags: "OrderedDict[int, ShuffleBag]" = OrderedDict()
+        # Мешки из движка прошлой версии кэша: ключи выданных постов, ещё не пересобранные
+        self._carried: "OrderedDict[int, List[tuple[str, int]]]" = OrderedDict()
+        self._rng = random.Random()
+        self._type_weights = type_weights or {}
+        self._decay = 0.5 ** (1.0 / recency_half_life) if recency_half_life > 0 else 1.0
+        # Вес новых позиций не больше 2**500 от самой новой при сборке: без этого степень переполнится
+        self._min_rank = -500 * recency_half_life
+        weights = self._weights(message_ids, post_types, recency_half_life, self._type_weights)
+        self._prob, self._alias = self._build_alias(weights)
+        self._base_size = self.size
+        self._base_total = sum(weights)
+        # Позиции из add и нарастающая сумма их весов; позиции из remove
+        self._added: List[int] = []
+        self._added_totals: List[float] = []
+        self._removed: Set[int] = set()
+
+    def __len__(self) -> int:
+        """Позиций в выдаче (без удалённых)."""
+        return self.size - len(self._removed)
+
+    @staticmethod
+    def _weights(
+        message_ids: Sequence[int],
+        post_types: Sequence[str],
+        recency_half_life: float,
+        type_weights: Dict[str, float],
+    ) -> List[float]:
+        """Вес позиции: половинится каждые recency_half_life постов от самого нового, умножается на вес типа."""
+        weights = [type_weights.get(post_type, 1.0) for post_type in post_types]
+        if recency_half_life > 0:
+            decay = 0.5 ** (1.0 / recency_half_life)
+            newest_first = sorted(range(len(message_ids)), key=message_ids.__getitem__, reverse=True)
+            for rank, position in enumerate(newest_first):
+                weights[position] *= decay ** rank
+        return weights
+
+    @staticmethod
+    def _build_alias(weights: List[float]) -> tuple[List[float], List[int]]:
+        """Alias-таблица Воуза: prob[i] — шанс оставить i, иначе берётся alias[i]."""
+        size = len(weights)
+        total = sum(weights)
+        if size == 0 or total <= 0:
+            return [1.0] * size, list(range(size))
+        scaled = [weight * size / total for weight in weights]
+        prob = [1.0] * size
+        alias = list(range(size))
+        small = [position for position, value in enumerate(scaled) if value < 1.0]
+        large = [position for position, value in enumerate(scaled) if value >= 1.0]
+        while small and large:
+            low, high = small.pop(), large.pop()
+            prob[low] = scaled[low]
+            alias[low] = high
+            scaled[high] -= 1.0 - scaled[low]
+            (small if scaled[high] < 1.0 else large).append(high)
+        # Остатки — погрешность округления: их вероятность 1
+        return prob, alias
+
+    def sample(self) -> int:
+        """Позиция по весам (с повторами); удалённую позицию отсеивает draw."""
+        rng = self._rng
+        if self._added and rng.random() * (self._base_total + self._added_totals[-1]) >= self._base_total:
+            index = bisect_right(self._added_totals, rng.random() * self._added_totals[-1])
+            return self._added[min(index, len(self._added) - 1)]
+        position = rng.randrange(self._base_size)
+        return position if rng.random() < self._prob[position] else self._alias[position]
+
+    def add(self, post_type: str, rank: float) -> int:
+        """Новая позиция (в конце) с весом по типу и месту rank в порядке свежести (0 — самый новый при сборке)."""
+        position = self.size
+        self.size += 1
+        weight = self._type_weights.get(post_type, 1.0) * self._decay ** max(rank, self._min_rank)
+        self._added.append(position)
+        self._added_totals.append((self._added_totals[-1] if self._added_totals else 0.0) + weight)
+        return position
+
+    def remove(self, position: int) -> None:
+        """Исключает позицию из выдачи; её вес остаётся в таблицах до полной пересборки."""
+        self._removed.add(position)
+
+    def seen_keys(self) -> "OrderedDict[int, List[tuple[str, int]]]":
+        """Ключи постов, выданных каждому пользователю в текущем круге (от давно неактивных к недавним).
+
+        Только читает движок: когда он уже заменён новым, это можно делать вне event loop.
+        """
+        seen: "OrderedDict[int, List[tuple[str, int]]]" = OrderedDict(self._carried)
+        if self._key is None:
+            return seen
+        key = self._key
+        for user_id, bag in self._bags.items():
+            seen.pop(user_id, None)
+            seen[user_id] = [key(position) for position in bag.drawn()]
+        return seen
+
+    def carry_bags(self, seen: "OrderedDict[int, List[tuple[str, int]]]") -> None:
+        """Переносит мешки из прошлой версии кэша по её seen_keys; уже заведённые здесь мешки не трогает."""
+        if self._position is None:
+            return
+        for user_id in self._bags:
+            seen.pop(user_id, None)
+        while seen and len(seen) + len(self._bags) > self.max_users:
+            seen.popitem(last=False)
+        self._carried = seen
+
+    def _bag(self, user_id: int) -> ShuffleBag:
+        bag = self._bags.get(user_id)
+        if bag is None:
+            bag = self._bags[user_id] = ShuffleBag(self.size)
+            seen = self._carried.pop(user_id, None)
+            if seen and self._position is not None:
+                for key in seen:
+                    position = self._position(key)
+                    if position is not None:
+                        bag.take(position)
+            if len(self._bags) + len(self._carried) > self.max_users:
+                (self._carried if self._carried else self._bags).popitem(last=False)
+        else:
+            self._bags.move_to_end(user_id)
+            if bag.size < self.size:
+                bag.grow(self.size)
+        return bag
+
+    def draw(self, user_id: int) -> int:
+        """Позиция для пользователя: по весам, без повторов до конца круга."""
+        if not len(self):
+            raise IndexError('пустой кэш')
+        bag = self._bag(user_id)
+        position = self.sample()
+        if position in self._removed:
+            # Вес удалённой позиции остаётся в alias-таблице до пересборки: выбираем ещё раз
+            position = self.sample()
+        if position not in self._removed and bag.take(position):
+            return position
+        # Уже выдана в этом круге (или снова удалённая): следующая не выданная из мешка
+        position = bag.draw(self._rng)
+        while position in self._removed:
+            position = bag.draw(self._rng)
+        return position
+
+    def draw_from(self, user_id: int, positions: Sequence[int], attempts: int = 8) -> int:
+        """Позиция из подмножества (например, результатов поиска), по возможности ещё не виденная."""
+        bag = self._bag(user_id)
+        position = positions[0]
+        for _ in range(attempts):
+            position = positions[self._rng.randrange(len(positions))]
+            if bag.take(position):
+                break
+        return position
+
 
 # Кэш для хранения постов с хештегом #showtitrvibe
-remote_posts: List[PostItem] = []
+remote_posts: Sequence[PostItem] = []
+# Те же посты фида по (канал, message_id): к ним применяются дельты из /feed/changes
+remote_posts_by_id: Dict[tuple[str, int], PostItem] = {}
+# Версия кэша фида, до которой мы синхронизированы (None — полная загрузка ещё не было)
+feed_version: Optional[int] = None
+# Хранилище парсера, к которому относится feed_version (X-Feed-Store): после его сброса версии начинаются заново
+feed_store_id: Optional[str] = None
+# Хештеги постов фида — те же, что в CHANNEL_SOURCES парсера (канал:#хештег через запятую)
+FEED_HASHTAGS = tuple(
+    dict.fromkeys(
+        '#' + (hashtag.strip().lower() or 'showtitrvibe').lstrip('#')
+        for channel, _, hashtag in (item.partition(':') for item in os.getenv('CHANNEL_SOURCES', '').split(','))
+        if channel.strip()
+    )
+) or ('#showtitrvibe',)
+
+
+def _has_feed_hashtag(text: str) -> bool:
+    """Есть ли в тексте хотя бы один хештег фида."""
+    lowered = text.lower()
+    return any(hashtag in lowered for hashtag in FEED_HASHTAGS)
+
+
+# Компактная схема фида (без дублей текста); старые фиды параметр игнорируют
+FEED_SCHEMA = 2
+# Полный фид запрашивается потоком (?stream=1) и разбирается по мере чтения
+FEED_STREAM = os.getenv('FEED_STREAM', '1').strip().lower() not in {'0', 'false', 'no', ''}
+# Просим сжатый фид в тех кодировках, которые отдаёт парсер и умеем распаковать мы
+# (gzip, а с brotli/zstandard — и br/zstd; zstd httpx распаковывает с 0.27.1)
+FEED_ACCEPT_ENCODING = ', '.join(
+    ['gzip']
+    + (['br'] if find_spec('brotli') or find_spec('brotlicffi') else [])
+    + (['zstd'] if find_spec('zstandard') else [])
+)
+# Общий асинхронный HTTP-клиент для фида: пул keep-alive соединений на event loop бота
+FEED_TIMEOUT = httpx.Timeout(10.0, connect=3.0)
+FEED_LIMITS = httpx.Limits(max_connections=10, max_keepalive_connections=5, keepalive_expiry=60.0)
+feed_http: Optional[httpx.AsyncClient] = None
 manual_posts: List[PostItem] = []
-posts_cache: List[PostItem] = []
+posts_cache: Sequence[PostItem] = []
+search_index = SearchIndex([])
+selection_engine = SelectionEngine([], [])
 cache_timestamp: float = 0.0
+# Фоновое обновление кэша: одна задача за раз, плюс состояние для диагностики
+feed_refresh_task: Optional["asyncio.Task[None]"] = None
+feed_last_attempt: float = 0.0
+feed_last_error: Optional[str] = None
+feed_failures: int = 0
+FEED_RETRY_SECONDS = 30  # Пауза перед повтором после неудачной загрузки
+# Валидаторы последнего полученного ответа фида для условных запросов
+feed_etag: Optional[str] = None
+feed_last_modified: Optional[str] = None
 CACHE_TTL_SECONDS = 60 * 5  # 5 минут
+# Отображённый снимок парсера и как часто проверять, не подменён ли файл новой версией
+mapped_snapshot: Optional[MappedSnapshot] = None
+snapshot_checked_at: float = 0.0
+SNAPSHOT_CHECK_SECONDS = 1.0
+# Пересборка кэша, применение дельты и добавление поста не должны перекрываться
+cache_update_lock = asyncio.Lock()
+
+# Режим inline-ответов: ranked — до 50 результатов на страницу (по релевантности
+# или вперемешку для пустого запроса) с подгрузкой следующих; random — один случайный пост
+INLINE_MODE = os.getenv('INLINE_MODE', 'ranked').strip().lower()
+INLINE_PAGE_SIZE = 50  # Максимум, который принимает Telegram
+# Сколько секунд Telegram может кэшировать ответ у себя (в режиме ranked)
+INLINE_CACHE_TIME = int(os.getenv('INLINE_CACHE_TIME', '300'))
+# Результаты поиска тоже не делятся между пользователями (случайная выдача личная всегда)
+INLINE_PERSONAL = os.getenv('INLINE_PERSONAL', '0').strip().lower() in {'1', 'true', 'yes'}
+# Случайная выдача: вес поста половинится каждые N постов от самого нового (0 — без учёта свежести)
+INLINE_RECENCY_HALF_LIFE = float(os.getenv('INLINE_RECENCY_HALF_LIFE', '300'))
+# Веса типов медиа, например "video=2,photo=1.5" (не указанные — 1)
+INLINE_TYPE_WEIGHTS = {
+    name.strip(): float(weight)
+    for name, _, weight in (
+        pair.partition('=') for pair in os.getenv('INLINE_TYPE_WEIGHTS', '').split(',') if '=' in pair
+    )
+}
+# Для скольких пользователей помнить уже показанные посты (остальные вытесняются)
+INLINE_BAG_USERS = int(os.getenv('INLINE_BAG_USERS', '10000'))
+
+POST_TYPE_EMOJI = {
+    'photo': '📷',
+    'document': '📄',
+    'video': '🎥',
+    'sticker': '😊',
+    'text': '📝'
+}
 feed_process: Optional[Process] = None
 FEED_STARTUP_TIMEOUT = 60  # Увеличено до 60 секунд для сервера
 
+# Получение обновлений: polling — long polling (по умолчанию), webhook — Telegram
+# сам присылает обновления на локальный HTTP-слушатель (нужен python-telegram-bot[webhooks])
+BOT_MODE = os.getenv('BOT_MODE', 'polling').strip().lower()
+# Публичный https-адрес, который регистрируется в Telegram; пусто — собирается из слушателя
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '').strip()
+WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '127.0.0.1')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8443'))
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', 'telegram').strip('/')
+# Секрет из заголовка X-Telegram-Bot-Api-Secret-Token; если не задан, генерируется при запуске
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '').strip()
+# Сколько обновлений обрабатывать одновременно (1 — строго по очереди)
+BOT_CONCURRENT_UPDATES = max(1, int(os.getenv('BOT_CONCURRENT_UPDATES', '1')))
+# Адрес Bot API (например, свой telegram-bot-api сервер); пусто — api.telegram.org
+BOT_API_BASE_URL = os.getenv('BOT_API_BASE_URL', '').strip()
+
+
+def _chat_id(value: str) -> Any:
+    """Числовой id чата или @username как есть."""
+    return int(value) if value.lstrip('-').isdigit() else value
+
+
+# Служебный чат, куда бот один раз пересылает посты с медиа, чтобы получить их file_id
+# (пусто — медиа в inline-ответах заменяется текстом со ссылкой)
+MEDIA_STORAGE_CHAT_ID = _chat_id(os.getenv('MEDIA_STORAGE_CHAT_ID', '').strip())
+# Откуда пересылать: канал с постами (по умолчанию @CHANNEL_USERNAME)
+MEDIA_SOURCE_CHAT = _chat_id(
+    os.getenv('MEDIA_SOURCE_CHAT', '').strip()
+    or ('@' + os.getenv('CHANNEL_USERNAME', '').strip().lstrip('@') if os.getenv('CHANNEL_USERNAME') else '')
+)
+# Каналы фида, чьи message_id относятся к MEDIA_SOURCE_CHAT: основной канал (и посты без канала)
+MEDIA_CHANNELS = ('', os.getenv('CHANNEL_USERNAME', '').strip().lstrip('@').lower())
+MEDIA_DB_PATH = os.getenv('MEDIA_DB_PATH', 'kinotip_media.sqlite3')
+MEDIA_FORWARD_INTERVAL = float(os.getenv('MEDIA_FORWARD_INTERVAL', '3'))
+media_store: Optional[MediaFileStore] = None
+media_pipeline: Optional[MediaPipeline] = None
+
+# Метрики бота (формат Prometheus); порт HTTP-сервера /metrics, пусто — не поднимаем
+BOT_METRICS_PORT = os.getenv('BOT_METRICS_PORT', '').strip()
+BOT_METRICS_HOST = os.getenv('BOT_METRICS_HOST', '127.0.0.1')
+metrics_registry = Registry()
+INLINE_QUERIES = Counter(
+    'kinotip_bot_inline_queries_total', 'Inline-запросы по режиму выдачи', ['mode'], registry=metrics_registry
+)
+INLINE_STAGE_SECONDS = Histogram(
+    'kinotip_bot_inline_stage_seconds', 'Длительность этапов обработки inline-запроса', ['stage'],
+    registry=metrics_registry,
+)
+# Серии этапов с уже выбранными метками: запись на inline-пути без разбора меток
+INLINE_ENSURE_SECONDS = INLINE_STAGE_SECONDS.labels(stage='ensure_posts_loaded')
+INLINE_FILTER_SECONDS = INLINE_STAGE_SECONDS.labels(stage='filter')
+INLINE_ANSWER_SECONDS = INLINE_STAGE_SECONDS.labels(stage='answer')
+FEED_FETCH_SECONDS = Histogram(
+    'kinotip_bot_feed_fetch_seconds', 'Длительность обновления кэша бота из фида', registry=metrics_registry
+)
+Gauge('kinotip_bot_cache_posts', 'Постов в кэше бота', registry=metrics_registry).set_function(lambda: len(posts_cache))
+Gauge('kinotip_bot_cache_age_seconds', 'Секунд с последнего обновления кэша из фида', registry=metrics_registry).set_function(
+    lambda: time.time() - cache_timestamp if cache_timestamp else None
+)
+Gauge('kinotip_bot_feed_failures', 'Неудачных обновлений из фида подряд', registry=metrics_registry).set_function(
+    lambda: feed_failures
+)
+Gauge('kinotip_bot_media_pending', 'Постов в очереди пересылки медиа', registry=metrics_registry).set_function(
+    lambda: media_pipeline.pending if media_pipeline is not None else None
+)
+
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик команды /start"""
@@ -118,7 +764,7 @@ async def test_feed_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     try:
         logger.info("Проверяем фид: %s", POSTS_FEED_URL)
-        response = requests.get(POSTS_FEED_URL, timeout=5)
+        response = await get_feed_http().get(FEED_HTTP_URL, params={'schema': FEED_SCHEMA}, timeout=5)
         response.raise_for_status()
         payload = response.json()
         
@@ -131,7 +777,7 @@ async def test_feed_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         result_text = (
             f"✅ Фид доступен\n"
             f"📊 Всего элементов: {len(items)}\n"
-            f"📝 С #showtitrvibe: {sum(1 for item in items if '#showtitrvibe' in str(item.get('text', '') + ' ' + str(item.get('caption', ''))).lower())}\n"
+            f"📝 С хештегами фида: {sum(1 for item in items if _has_feed_hashtag(str(item.get('text', '') + ' ' + str(item.get('caption', '')))))}\n"
             f"💾 В кэше бота: {len(posts_cache)}"
         )
         logger.info("Отправляем результат: %s", result_text)
@@ -174,6 +820,19 @@ async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     else:
         stats_message += "Нет постов в коллекции\n"
         stats_message += "Используйте /add_post для добавления"
+
+    if mapped_snapshot is not None and isinstance(remote_posts, MappedPosts):
+        stats_message += f"\n🗺 Снимок кэша: версия {mapped_snapshot.version} из {FEED_SNAPSHOT_PATH}"
+    if POSTS_FEED_URL:
+        status = feed_refresh_status()
+        if status['cache_age'] is None:
+            stats_message += "\n🔄 Фид: ещё не загружался"
+        else:
+            stats_message += f"\n🔄 Фид: обновлён {status['cache_age']:.0f} сек назад"
+        if status['refreshing']:
+            stats_message += " (сейчас обновляется)"
+        if status['last_error']:
+            stats_message += f"\n⚠️ Последняя ошибка фида: {status['last_error']} (неудач подряд: {status['failures']})"
     
     await message.reply_text(stats_message)
 
@@ -190,11 +849,11 @@ async def add_post(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     msg = message.reply_to_message
     
-    # Проверяем наличие хештега #showtitrvibe
+    # Проверяем наличие хештега фида
     text = (msg.text or msg.caption or '').strip()
-    if '#showtitrvibe' not in text.lower():
+    if not _has_feed_hashtag(text):
         await message.reply_text(
-            "Этот пост не содержит хештег #showtitrvibe. "
+            f"Этот пост не содержит хештег {' или '.join(FEED_HASHTAGS)}. "
             "Добавьте хештег в пост, чтобы он попал в рекомендации."
         )
         return
@@ -206,44 +865,141 @@ async def add_post(update: Update, context: ContextTypes.DEFAULT_TYPE):
         type='text'
     )
     
-    if msg.photo:
-        post.type = 'photo'
-        post.file_id = msg.photo[-1].file_id
-    elif msg.document:
-        post.type = 'document'
-        post.file_id = msg.document.file_id
-    elif msg.video:
-        post.type = 'video'
-        post.file_id = msg.video.file_id
-    elif msg.sticker:
-        post.type = 'sticker'
-        post.file_id = msg.sticker.file_id
+    media = message_media(msg)
+    if media:
+        post.type, post.file_id = media  # type: ignore[assignment]
     else:
         post.type = 'text'
         post.content = msg.text or caption
     
     manual_posts.append(post)
-    rebuild_posts_cache()
+    await rebuild_posts_cache()
     await message.reply_text(f"✅ Пост добавлен! Всего постов в кэше: {len(posts_cache)}")
 
 
-def rebuild_posts_cache() -> None:
-    """Обновляет объединенный кэш постов из удаленного источника и ручных добавлений."""
-    global posts_cache
-    posts_cache = [*remote_posts, *manual_posts]
+def _build_posts_cache(
+    remote: Iterable[PostItem], manual: List[PostItem]
+) -> tuple[Sequence[PostItem], Sequence[PostItem], SearchIndex, SelectionEngine]:
+    """Строит кэш, индекс и движок выборки; глобальные переменные не трогает, поэтому идёт в пуле потоков."""
+    if isinstance(remote, MappedPosts):
+        # Посты снимка остаются в mmap, в куче — только индекс
+        cache: Sequence[PostItem] = remote.with_extra(manual)
+    else:
+        remote = sorted(remote, key=_post_order)
+        cache = [*remote, *manual]
+    index = SearchIndex(cache)
+    engine = SelectionEngine(
+        # Свежесть — по позиции в кэше: message_id разных каналов несравнимы
+        range(len(cache), 0, -1),
+        index.post_types,
+        recency_half_life=INLINE_RECENCY_HALF_LIFE,
+        type_weights=INLINE_TYPE_WEIGHTS,
+        max_users=INLINE_BAG_USERS,
+        key=index.key,
+        position=index.position,
+    )
+    if not isinstance(cache, MappedPosts):
+        # Кэш фида дальше меняется дельтами, которым нужны позиции по ключу
+        index.index_keys()
+    return remote, cache, index, engine  # type: ignore[return-value]
+
+
+async def rebuild_posts_cache(remote: Optional[Iterable[PostItem]] = None) -> None:
+    """Обновляет объединенный кэш постов из удаленного источника и ручных добавлений.
+
+    remote — новые посты фида (по умолчанию прежние remote_posts).
+    """
+    async with cache_update_lock:
+        await _rebuild_posts_cache(remote)
+
+
+async def _rebuild_posts_cache(remote: Optional[Iterable[PostItem]] = None) -> None:
+    """rebuild_posts_cache без блокировки — для тех, кто уже держит cache_update_lock."""
+    global remote_posts, posts_cache, search_index, selection_engine
+    loop = asyncio.get_running_loop()
+    previous_engine = selection_engine
+    # Сборка индекса — долгая работа для CPU: event loop тем временем отвечает по прежнему кэшу
+    state = await loop.run_in_executor(
+        None, _build_posts_cache, remote_posts if remote is None else remote, list(manual_posts)
+    )
+    remote_posts, posts_cache, search_index, selection_engine = state
+    # Новые посты не сбрасывают мешки: уже показанные не повторятся до конца круга
+    seen = await loop.run_in_executor(None, previous_engine.seen_keys)
+    if seen:
+        await loop.run_in_executor(None, search_index.index_keys)
+    selection_engine.carry_bags(seen)
+    schedule_media_uploads()
+
+
+def schedule_media_uploads() -> None:
+    """Ставит в очередь пересылки посты канала с медиа, для которых ещё нет file_id."""
+    if media_pipeline is None:
+        return
+    # Ручные посты идут после постов фида и уже содержат file_id от Bot API
+    remote_count = len(remote_posts)
+    queued = 0
+    for message_id, post_type, channel in zip(
+        search_index.message_ids[:remote_count], search_index.post_types, search_index.channels
+    ):
+        # Пересылать умеем только из MEDIA_SOURCE_CHAT — это посты основного канала
+        if post_type != 'text' and channel in MEDIA_CHANNELS and media_pipeline.enqueue(message_id):
+            queued += 1
+    if queued:
+        logger.info("В очередь пересылки медиа добавлено %d постов (всего в очереди %d)", queued, media_pipeline.pending)
+
+
+def start_media_pipeline(application: Application) -> None:
+    """Открывает хранилище file_id и запускает фоновую пересылку медиа в служебный чат."""
+    global media_store, media_pipeline
+    media_store = MediaFileStore(MEDIA_DB_PATH)
+    media_pipeline = MediaPipeline(
+        PTBBotApiClient(application.bot),
+        media_store,
+        storage_chat_id=MEDIA_STORAGE_CHAT_ID,
+        source_chat_id=MEDIA_SOURCE_CHAT,
+        interval=MEDIA_FORWARD_INTERVAL,
+    )
+    application.bot_data['media_pipeline'] = asyncio.create_task(media_pipeline.run())
+    logger.info(
+        "Кэш медиа: %d file_id в %s, пересылка из %s в %s",
+        len(media_store.files), MEDIA_DB_PATH, MEDIA_SOURCE_CHAT, MEDIA_STORAGE_CHAT_ID
+    )
+    schedule_media_uploads()
+
+
+def get_feed_http() -> httpx.AsyncClient:
+    """Общий HTTP-клиент фида (создаётся на event loop бота при первом обращении)."""
+    global feed_http
+    if feed_http is None or feed_http.is_closed:
+        if FEED_SOCKET_PATH:
+            # Локальный фид на Unix-сокете: тот же пул соединений, но без TCP
+            transport = httpx.AsyncHTTPTransport(uds=FEED_SOCKET_PATH, limits=FEED_LIMITS)
+            feed_http = httpx.AsyncClient(timeout=FEED_TIMEOUT, transport=transport)
+        else:
+            feed_http = httpx.AsyncClient(timeout=FEED_TIMEOUT, limits=FEED_LIMITS)
+    return feed_http
+
+
+async def close_feed_http() -> None:
+    """Закрывает HTTP-клиент фида и его соединения."""
+    global feed_http
+    if feed_http is not None:
+        await feed_http.aclose()
+        feed_http = None
 
 
-def wait_for_feed_ready(url: str) -> bool:
+async def wait_for_feed_ready(url: str) -> bool:
     """Ожидает, когда фид станет доступен."""
+    client = get_feed_http()
     deadline = time.time() + FEED_STARTUP_TIMEOUT
     while time.time() < deadline:
         try:
-            response = requests.get(url, timeout=2)
+            response = await client.get(url, timeout=2)
             if response.status_code < 500:
                 return True
-        except requests.RequestException:
+        except httpx.HTTPError:
             pass
-        time.sleep(0.5)
+        await asyncio.sleep(0.5)
     return False
 
 
@@ -256,7 +1012,7 @@ def stop_feed_process() -> None:
     feed_process = None
 
 
-def start_feed_process_if_needed() -> None:
+async def start_feed_process_if_needed() -> None:
     """Запускает фид в отдельном процессе, если он указан и локальный."""
     global feed_process
     if not POSTS_FEED_URL:
@@ -267,7 +1023,7 @@ def start_feed_process_if_needed() -> None:
         logger.info("Парсер уже запущен")
         return
 
-    parsed = urlparse(POSTS_FEED_URL)
+    parsed = urlparse(FEED_HTTP_URL)
     if parsed.scheme != "http":
         logger.info("POSTS_FEED_URL не http, парсер не запускается: %s", parsed.scheme)
         return
@@ -275,8 +1031,12 @@ def start_feed_process_if_needed() -> None:
     host = parsed.hostname or "127.0.0.1"
     port = parsed.port or 80
     path = parsed.path or ""
+    server_kwargs: Dict[str, Any] = {"host": host, "port": port}
 
-    if host not in {"127.0.0.1", "localhost"}:
+    if FEED_SOCKET_PATH:
+        # Unix-сокет всегда локальный
+        server_kwargs = {"unix_socket": FEED_SOCKET_PATH}
+    elif host not in {"127.0.0.1", "localhost"}:
         logger.info("POSTS_FEED_URL указывает на внешний хост %s, парсер не запускается", host)
         return
     
@@ -286,11 +1046,11 @@ def start_feed_process_if_needed() -> None:
 
     # Проверяем, не запущен ли уже парсер (доступен ли /feed)
     try:
-        response = requests.get(POSTS_FEED_URL, timeout=2)
+        response = await get_feed_http().get(FEED_HTTP_URL, timeout=2)
         if response.status_code == 200:
             logger.info("Парсер уже доступен на %s, не запускаем новый процесс", POSTS_FEED_URL)
             return
-    except requests.RequestException:
+    except httpx.HTTPError:
         # Парсер не доступен, продолжаем запуск
         pass
 
@@ -301,11 +1061,11 @@ def start_feed_process_if_needed() -> None:
         logger.warning("Не удалось импортировать встроенный парсер: %s", error)
         return
 
-    logger.info("Запускаем локальный парсер по адресу %s (host=%s, port=%d)", POSTS_FEED_URL, host, port)
+    logger.info("Запускаем локальный парсер по адресу %s (%s)", POSTS_FEED_URL, server_kwargs)
     try:
         feed_process = Process(
             target=run_feed_server,
-            kwargs={"host": host, "port": port},
+            kwargs=server_kwargs,
             daemon=True,
         )
         feed_process.start()
@@ -314,9 +1074,8 @@ def start_feed_process_if_needed() -> None:
         logger.error("Ошибка при запуске процесса парсера: %s", error)
         return
 
-    # Даём процессу немного времени на старт
-    import time as time_module
-    time_module.sleep(2)
+    # Даём процессу немного времени на старт (фид поднимается из локального хранилища)
+    await asyncio.sleep(0.5)
     
     # Проверяем, что процесс жив
     if not feed_process.is_alive():
@@ -325,7 +1084,7 @@ def start_feed_process_if_needed() -> None:
         return
     
     logger.info("Ожидаем готовности парсера (таймаут %d сек)...", FEED_STARTUP_TIMEOUT)
-    if not wait_for_feed_ready(POSTS_FEED_URL):
+    if not await wait_for_feed_ready(FEED_HTTP_URL):
         logger.warning(
             "Парсер по адресу %s не отвечает в течение %d секунд. Бот продолжит работу без автозагрузки.",
             POSTS_FEED_URL, FEED_STARTUP_TIMEOUT
@@ -340,30 +1099,280 @@ def start_feed_process_if_needed() -> None:
 atexit.register(stop_feed_process)
 
 
-def fetch_posts_from_feed(force: bool = False) -> None:
-    """Загружает посты из внешнего сервиса и обновляет кэш."""
-    global remote_posts, cache_timestamp
+def _feed_changes_url() -> str:
+    """Адрес эндпоинта дельт рядом с POSTS_FEED_URL (/feed -> /feed/changes)."""
+    assert FEED_HTTP_URL
+    parsed = urlparse(FEED_HTTP_URL)
+    return parsed._replace(path=parsed.path.rstrip('/') + '/changes', query='').geturl()
 
-    if not POSTS_FEED_URL:
+
+def _feed_item_text(item: Dict[str, Any]) -> str:
+    """Текст поста из элемента фида."""
+    try:
+        return str(item.get('caption') or item.get('text') or '').strip()
+    except AttributeError:
+        return ''
+
+
+def _build_post_item(item: Dict[str, Any], text: str, idx: int, now: float) -> PostItem:
+    """Собирает PostItem из элемента фида с уже извлечённым текстом."""
+    message_id_raw = item.get('message_id') or item.get('id') or f"{int(now)}{idx}"
+    try:
+        message_id = int(message_id_raw)
+    except (TypeError, ValueError):
+        message_id = int(now) * 1000 + idx
+
+    media_type: Literal['photo', 'document', 'video', 'sticker', 'text'] = 'text'
+    media_type_raw = item.get('type') or item.get('media_type')
+    if isinstance(media_type_raw, str):
+        candidate = media_type_raw.lower()
+        if candidate in ('photo', 'document', 'video', 'sticker', 'text'):
+            media_type = sys.intern(candidate)  # type: ignore
+
+    file_id_raw = item.get('file_id') or item.get('media_file_id')
+    file_id = str(file_id_raw) if file_id_raw else None
+
+    content_raw = item.get('content') or item.get('text') or text
+    content = str(content_raw or '')
+    if content == text:
+        # Не храним второй экземпляр того же текста
+        content = ''
+
+    try:
+        date = int(item.get('date') or 0)
+    except (TypeError, ValueError):
+        date = 0
+
+    link_raw = item.get('link') or item.get('url') or ''
+    return PostItem(
+        message_id=message_id,
+        type=media_type,
+        caption=text,
+        content=content,
+        file_id=file_id,
+        link=str(link_raw) if link_raw else None,
+        channel=sys.intern(str(item.get('channel') or '')),
+        date=date,
+    )
+
+
+def _removed_key(entry: Any) -> tuple[str, int]:
+    """Ключ удалённого поста из дельты: {"channel", "message_id"} или голый message_id (старый фид)."""
+    if isinstance(entry, dict):
+        return (str(entry.get('channel') or ''), int(entry['message_id']))
+    return ('', int(entry))
+
+
+def _post_order(post: PostItem) -> tuple[int, int, str]:
+    """Порядок постов фида в кэше: от новых к старым, как в кэше парсера."""
+    return (-post.date, -post.message_id, post.channel)
+
+
+async def _set_remote_posts(loaded: Dict[tuple[str, int], PostItem]) -> None:
+    """Заменяет посты фида загруженными и пересобирает кэш (от новых к старым, как в кэше парсера)."""
+    global remote_posts_by_id
+    async with cache_update_lock:
+        remote_posts_by_id = loaded
+        await _rebuild_posts_cache(list(loaded.values()))
+
+
+def _remote_rank(index: int) -> Optional[float]:
+    """Место поста remote_posts[index] в порядке кэша индекса (None — такого поста нет)."""
+    if not 0 <= index < len(remote_posts):
+        return None
+    position = search_index.position(remote_posts[index].key)
+    return search_index.rank(position) if position is not None else None
+
+
+def _remove_remote_post(key: tuple[str, int]) -> None:
+    """Убирает пост фида из кэша, индекса и движка выборки, не трогая остальные посты."""
+    post = remote_posts_by_id.pop(key, None)
+    if post is None:
         return
+    index = bisect_left(remote_posts, _post_order(post), key=_post_order)
+    # posts_cache начинается с remote_posts, поэтому у поста фида там тот же индекс
+    del remote_posts[index]  # type: ignore[attr-defined]
+    del posts_cache[index]  # type: ignore[attr-defined]
+    position = search_index.position(key)
+    if position is not None:
+        search_index.remove(position)
+        selection_engine.remove(position)
+
+
+def _insert_remote_posts(posts: Sequence[PostItem]) -> None:
+    """Ставит посты фида на их места в кэше (двоичным поиском) и добавляет в индекс и движок выборки.
+
+    Место в порядке кэша (rank) у нового поста — между соседями; посты,
+    попавшие между одними и теми же соседями, делят этот промежуток поровну.
+    Так вес свежести и порядок в поиске почти такие же, как после пересборки.
+    """
+    placed = sorted(posts, key=_post_order)
+    gaps = [bisect_left(remote_posts, _post_order(post), key=_post_order) for post in placed]
+    ranks: List[float] = []
+    start = 0
+    for end in range(1, len(placed) + 1):
+        if end < len(placed) and gaps[end] == gaps[start]:
+            continue
+        newer, older = _remote_rank(gaps[start] - 1), _remote_rank(gaps[start])
+        count = end - start
+        for offset in range(count):
+            if newer is None:
+                ranks.append(older - count + offset if older is not None else float(offset))
+            elif older is None:
+                # Ниже самого старого поста фида — в пределах одного места: следом идут ручные посты
+                ranks.append(newer + (offset + 1) / (count + 1))
+            else:
+                ranks.append(newer + (older - newer) * (offset + 1) / (count + 1))
+        start = end
+
+    for post, rank in zip(placed, ranks):
+        remote_posts_by_id[post.key] = post
+        index = bisect_left(remote_posts, _post_order(post), key=_post_order)
+        remote_posts.insert(index, post)  # type: ignore[attr-defined]
+        posts_cache.insert(index, post)  # type: ignore[attr-defined]
+        search_index.add(post, rank)
+        selection_engine.add(post.type, rank)
+        if media_pipeline is not None and post.type != 'text' and post.channel in MEDIA_CHANNELS:
+            media_pipeline.enqueue(post.message_id)
+
+
+async def _apply_remote_changes(changed: List[PostItem], removed_keys: List[tuple[str, int]]) -> None:
+    """Применяет дельту фида на месте: меняются только затронутые посты, индекс и веса выборки.
+
+    Когда изменённых ячеек индекса набирается больше четверти, кэш
+    пересобирается целиком: пустые ячейки уходят, веса считаются заново.
+    """
+    # Изменённый пост убирается и ставится заново: его место в кэше могло сдвинуться
+    changed_by_key = {post.key: post for post in changed}
+    async with cache_update_lock:
+        for key in [*removed_keys, *changed_by_key]:
+            _remove_remote_post(key)
+        _insert_remote_posts(list(changed_by_key.values()))
+        if search_index.changes > len(search_index) // 4:
+            await _rebuild_posts_cache()
+
+
+def _snapshot_is_current(file_key: Any) -> bool:
+    """Кэш бота уже построен по снимку с этим ключом файла."""
+    return (
+        mapped_snapshot is not None
+        and isinstance(remote_posts, MappedPosts)
+        and mapped_snapshot.file_key == file_key
+    )
+
 
+async def load_mapped_snapshot() -> bool:
+    """Подхватывает снимок парсера из FEED_SNAPSHOT_PATH, если файл подменён новой версией.
+
+    Файл отображается через mmap, а индекс по нему строится в пуле потоков.
+    Возвращает True, если кэш бота соответствует снимку на диске.
+    """
+    global mapped_snapshot, snapshot_checked_at, remote_posts_by_id
+    global feed_version, feed_store_id, cache_timestamp, feed_etag, feed_last_modified, feed_last_error
+
+    if not FEED_SNAPSHOT_PATH:
+        return False
     now = time.time()
-    if not force and remote_posts and (now - cache_timestamp) < CACHE_TTL_SECONDS:
-        return
+    snapshot_checked_at = now
+    file_key = snapshot_file_key(FEED_SNAPSHOT_PATH)
+    if file_key is None:
+        return False
+    if _snapshot_is_current(file_key):
+        cache_timestamp = now
+        return True
 
     try:
-        response = requests.get(POSTS_FEED_URL, timeout=10)
+        snapshot = MappedSnapshot(FEED_SNAPSHOT_PATH)
+    except (OSError, ValueError, SnapshotFormatError) as error:
+        logger.warning("Не удалось открыть снимок кэша %s: %s", FEED_SNAPSHOT_PATH, error)
+        return False
+
+    # Прежнее отображение закроется само, когда на него не останется ссылок
+    await rebuild_posts_cache(MappedPosts(snapshot))
+    mapped_snapshot = snapshot
+    remote_posts_by_id = {}
+    # Дельты HTTP-фида применяются к remote_posts_by_id: после снимка — только полная загрузка
+    feed_version = None
+    feed_store_id = None
+    feed_etag = None
+    feed_last_modified = None
+    cache_timestamp = now
+    feed_last_error = None
+    logger.info("Снимок кэша версии %d отображён из %s: %d постов", snapshot.version, FEED_SNAPSHOT_PATH, len(snapshot))
+    return True
+
+
+async def fetch_feed_changes() -> bool:
+    """Применяет к кэшу дельту из /feed/changes с версии feed_version.
+
+    Возвращает False, если дельту получить нельзя и нужна полная загрузка.
+    """
+    global feed_version, feed_store_id, cache_timestamp
+
+    if feed_version is None:
+        return False
+
+    now = time.time()
+    params: Dict[str, Any] = {'since': feed_version, 'schema': FEED_SCHEMA}
+    if feed_store_id:
+        params['store_id'] = feed_store_id
+    try:
+        response = await get_feed_http().get(
+            _feed_changes_url(),
+            params=params,
+            headers={'Accept-Encoding': FEED_ACCEPT_ENCODING},
+            timeout=10,
+        )
+        if response.status_code in (404, 410):
+            # 404 — фид без поддержки дельт, 410 — журнал уже не покрывает нашу версию или хранилище сброшено
+            logger.info("Дельта с версии %d недоступна (%d), загружаем фид целиком", feed_version, response.status_code)
+            return False
         response.raise_for_status()
         payload = response.json()
-    except requests.RequestException as error:
-        logger.warning("Не удалось загрузить посты с %s: %s", POSTS_FEED_URL, error)
-        # Не очищаем кэш при ошибке, просто возвращаемся
-        return
-    except ValueError as error:
-        logger.warning("Неверный формат ответа от %s: %s", POSTS_FEED_URL, error)
-        return
+        version = int(payload['version'])
+        store_id = payload.get('store_id')
+        changed_items = [*payload.get('added', []), *payload.get('edited', [])]
+        removed_keys = [_removed_key(entry) for entry in payload.get('removed', [])]
+    except httpx.HTTPError as error:
+        logger.warning("Не удалось загрузить изменения с %s: %s", _feed_changes_url(), error)
+        return False
+    except (ValueError, KeyError, TypeError) as error:
+        logger.warning("Неверный формат дельты от %s: %s", _feed_changes_url(), error)
+        return False
+
+    changed_posts: List[PostItem] = []
+    for idx, item in enumerate(changed_items):
+        text = _feed_item_text(item)
+        post = _build_post_item(item, text, idx, now)
+        if text and _has_feed_hashtag(text):
+            changed_posts.append(post)
+        else:
+            removed_keys.append(post.key)
+
+    if changed_items or removed_keys:
+        await _apply_remote_changes(changed_posts, removed_keys)
+        logger.info(
+            "Применена дельта фида %d -> %d: изменено %d, удалено %d",
+            feed_version, version, len(changed_items), len(removed_keys)
+        )
+    feed_version = version
+    feed_store_id = store_id or feed_store_id
+    cache_timestamp = now
+    return True
+
 
+def _feed_params() -> Dict[str, Any]:
+    """Параметры запроса полного фида."""
+    params: Dict[str, Any] = {'schema': FEED_SCHEMA}
+    if FEED_STREAM:
+        params['stream'] = 1
+    return params
+
+
+def _extract_feed_items(payload: Any) -> tuple[Optional[int], List[Dict[str, Any]]]:
+    """Версия и элементы из целиком разобранного ответа фида (поддерживает прежние форматы)."""
     items: List[Dict[str, Any]] = []
+    version: Optional[int] = None
     if isinstance(payload, dict):
         # Пробуем разные ключи
         items = payload.get('posts', [])
@@ -376,92 +1385,317 @@ def fetch_posts_from_feed(force: bool = False) -> None:
             first_value = list(payload.values())[0]
             if isinstance(first_value, list):
                 items = first_value
+        if isinstance(payload.get('version'), int):
+            version = payload['version']
     elif isinstance(payload, list):
         items = payload
-    
-    logger.info("Извлечено %d элементов из ответа фида", len(items))
+    return version, items
 
-    if not items:
-        logger.info("Сервис %s вернул пустой список", POSTS_FEED_URL)
+
+async def _iter_feed_items(response: httpx.Response, meta: Dict[str, Any]) -> AsyncIterator[Dict[str, Any]]:
+    """Элементы фида по мере чтения ответа; версия фида попадает в meta['version'].
+
+    Потоковый ответ (X-Feed-Stream: 1) разбирается построчно: первая строка —
+    заголовок с версией, дальше по посту на строке. Остальные ответы читаются
+    и разбираются целиком, как раньше.
+    """
+    if response.headers.get('X-Feed-Stream') != '1':
+        version, items = _extract_feed_items(json.loads(await response.aread()))
+        meta['version'] = version
+        for item in items:
+            yield item
+        return
+
+    async for line in response.aiter_lines():
+        line = line.strip()
+        if not line or line == ']}':
+            continue
+        if line.endswith('['):
+            header = json.loads(line + ']}')
+            meta['version'] = header.get('version') if isinstance(header.get('version'), int) else None
+            continue
+        item = json.loads(line.rstrip(','))
+        if isinstance(item, dict):
+            yield item
+
+
+async def fetch_posts_from_feed(force: bool = False) -> None:
+    """Загружает посты из внешнего сервиса и обновляет кэш.
+
+    Если версия фида уже известна, забирает только изменения с неё;
+    иначе (или если дельта недоступна) загружает фид целиком.
+    """
+    global feed_version, feed_store_id, cache_timestamp, feed_etag, feed_last_modified, feed_last_error
+
+    if await load_mapped_snapshot():
         return
 
-    logger.info("Получено %d элементов из фида, начинаем фильтрацию", len(items))
-    loaded_posts: List[PostItem] = []
+    if not POSTS_FEED_URL:
+        return
+
+    now = time.time()
+    if not force and remote_posts and (now - cache_timestamp) < CACHE_TTL_SECONDS:
+        return
+
+    if remote_posts and await fetch_feed_changes():
+        feed_last_error = None
+        return
+
+    # Отправляем валидаторы: если фид не менялся, сервер ответит 304 без тела
+    headers: Dict[str, str] = {'Accept-Encoding': FEED_ACCEPT_ENCODING}
+    if remote_posts:
+        if feed_etag:
+            headers['If-None-Match'] = feed_etag
+        if feed_last_modified:
+            headers['If-Modified-Since'] = feed_last_modified
+
+    loaded_posts: Dict[tuple[str, int], PostItem] = {}
+    meta: Dict[str, Any] = {}
+    total_count = 0
     skipped_count = 0
     empty_text_count = 0
     no_hashtag_count = 0
-    
-    for idx, item in enumerate(items):
-        try:
-            text = str(item.get('caption') or item.get('text') or '').strip()
-        except AttributeError:
-            text = ''
-        
-        if not text:
-            empty_text_count += 1
-            skipped_count += 1
-            continue
-            
-        if '#showtitrvibe' not in text.lower():
-            no_hashtag_count += 1
-            skipped_count += 1
-            if idx < 3:  # Логируем первые 3 для отладки
-                logger.debug("Пропущен пост без #showtitrvibe: %s", text[:50])
-            continue
+    try:
+        async with get_feed_http().stream('GET', FEED_HTTP_URL, params=_feed_params(), headers=headers) as response:
+            if response.status_code == 304:
+                cache_timestamp = now
+                feed_last_error = None
+                logger.info("Фид не изменился (304), кэш актуален: %d постов", len(remote_posts))
+                return
+            response.raise_for_status()
+
+            # Элементы разбираются по мере чтения ответа: весь фид в памяти не нужен
+            async for item in _iter_feed_items(response, meta):
+                idx = total_count
+                total_count += 1
+                text = _feed_item_text(item)
+
+                if not text:
+                    empty_text_count += 1
+                    skipped_count += 1
+                    continue
+
+                if not _has_feed_hashtag(text):
+                    no_hashtag_count += 1
+                    skipped_count += 1
+                    if idx < 3:  # Логируем первые 3 для отладки
+                        logger.debug("Пропущен пост без хештегов фида: %s", text[:50])
+                    continue
+
+                post = _build_post_item(item, text, idx, now)
+                loaded_posts[post.key] = post
+    except httpx.HTTPError as error:
+        logger.warning("Не удалось загрузить посты с %s: %s", POSTS_FEED_URL, error)
+        feed_last_error = f"фид недоступен: {error}"
+        # Не очищаем кэш при ошибке, просто возвращаемся
+        return
+    except ValueError as error:
+        logger.warning("Неверный формат ответа от %s: %s", POSTS_FEED_URL, error)
+        feed_last_error = f"неверный формат ответа: {error}"
+        return
 
-        message_id_raw = item.get('message_id') or item.get('id') or f"{int(now)}{idx}"
-        try:
-            message_id = int(message_id_raw)
-        except (TypeError, ValueError):
-            message_id = int(now) * 1000 + idx
-
-        media_type: Literal['photo', 'document', 'video', 'sticker', 'text'] = 'text'
-        media_type_raw = item.get('type') or item.get('media_type')
-        if isinstance(media_type_raw, str):
-            candidate = media_type_raw.lower()
-            if candidate in ('photo', 'document', 'video', 'sticker', 'text'):
-                media_type = candidate  # type: ignore
-
-        file_id_raw = item.get('file_id') or item.get('media_file_id')
-        file_id = str(file_id_raw) if file_id_raw else None
-
-        content_raw = item.get('content') or item.get('text') or text
-        content = str(content_raw or '')
-
-        link_raw = item.get('link') or item.get('url') or ''
-        post = PostItem(
-            message_id=message_id,
-            type=media_type,
-            caption=text,
-            content=content,
-            file_id=file_id,
-            link=str(link_raw) if link_raw else None,
-        )
-        loaded_posts.append(post)
+    logger.info("Получено %d элементов из фида", total_count)
+
+    if not total_count:
+        logger.info("Сервис %s вернул пустой список", POSTS_FEED_URL)
+        feed_last_error = "фид вернул пустой список"
+        return
 
     if not loaded_posts:
         logger.warning(
-            "После фильтрации по #showtitrvibe постов не найдено. "
+            "После фильтрации по хештегам %s постов не найдено. "
             "Пропущено %d элементов: %d без текста, %d без хештега",
-            skipped_count, empty_text_count, no_hashtag_count
+            ", ".join(FEED_HASHTAGS), skipped_count, empty_text_count, no_hashtag_count
         )
+        feed_last_error = "в фиде нет постов с нужными хештегами"
         return
 
-    remote_posts = loaded_posts
+    await _set_remote_posts(loaded_posts)
+    feed_version = meta.get('version')
+    feed_store_id = response.headers.get('X-Feed-Store')
     cache_timestamp = now
-    rebuild_posts_cache()
+    feed_last_error = None
+    feed_etag = response.headers.get('ETag')
+    feed_last_modified = response.headers.get('Last-Modified')
     logger.info(
-        "Загружено %d постов из внешнего сервиса (пропущено %d без #showtitrvibe)",
+        "Загружено %d постов из внешнего сервиса (пропущено %d без хештегов фида)",
         len(remote_posts), skipped_count
     )
 
 
+async def _refresh_posts(force: bool) -> None:
+    """Одно фоновое обновление кэша из фида."""
+    global feed_last_attempt, feed_last_error, feed_failures
+    feed_last_attempt = time.time()
+    started = time.perf_counter()
+    try:
+        await fetch_posts_from_feed(force)
+    except Exception as error:
+        logger.error("Ошибка при фоновом обновлении постов: %s", error, exc_info=True)
+        feed_last_error = str(error)
+    FEED_FETCH_SECONDS.observe(time.perf_counter() - started)
+    feed_failures = feed_failures + 1 if feed_last_error else 0
+
+
+def refresh_posts_in_background(force: bool = False) -> "asyncio.Task[None]":
+    """Запускает фоновое обновление кэша; если оно уже идёт — возвращает текущее (single-flight)."""
+    global feed_refresh_task
+    if feed_refresh_task is None or feed_refresh_task.done():
+        feed_refresh_task = asyncio.get_running_loop().create_task(_refresh_posts(force))
+    return feed_refresh_task
+
+
 async def ensure_posts_loaded(force: bool = False) -> None:
-    """Асинхронно актуализирует кэш."""
+    """Не ждёт загрузки: если кэш устарел, запускает фоновое обновление.
+
+    Обработчики сразу работают с текущим снимком posts_cache (stale-while-revalidate).
+    Файл FEED_SNAPSHOT_PATH здесь только проверяется через stat (не чаще раза
+    в SNAPSHOT_CHECK_SECONDS); отображает и индексирует новый снимок фоновое обновление.
+    """
+    global snapshot_checked_at, cache_timestamp
+    now = time.time()
+    snapshot_mode = mapped_snapshot is not None and isinstance(remote_posts, MappedPosts)
+    if FEED_SNAPSHOT_PATH and (force or not snapshot_mode or now - snapshot_checked_at >= SNAPSHOT_CHECK_SECONDS):
+        snapshot_checked_at = now
+        file_key = snapshot_file_key(FEED_SNAPSHOT_PATH)
+        if file_key is not None:
+            if _snapshot_is_current(file_key):
+                cache_timestamp = now
+            else:
+                refresh_posts_in_background(force)
+            return
+    elif snapshot_mode:
+        return
     if not POSTS_FEED_URL:
         return
-    loop = asyncio.get_running_loop()
-    await loop.run_in_executor(None, fetch_posts_from_feed, force)
+    if feed_failures and now - feed_last_attempt < FEED_RETRY_SECONDS:
+        # Фид недавно не ответил — не долбим его на каждый inline-запрос
+        return
+    if force or not remote_posts or now - cache_timestamp >= CACHE_TTL_SECONDS:
+        refresh_posts_in_background(force)
+
+
+async def feed_refresher() -> None:
+    """Фоновая задача: обновляет кэш раз в CACHE_TTL_SECONDS, даже если запросов нет."""
+    while True:
+        await asyncio.sleep(CACHE_TTL_SECONDS)
+        try:
+            await refresh_posts_in_background(force=True)
+        except asyncio.CancelledError:
+            raise
+        except Exception as error:
+            logger.error("Ошибка в фоновом обновлении кэша: %s", error)
+
+
+def feed_refresh_status() -> Dict[str, Any]:
+    """Состояние обновления кэша для диагностики."""
+    return {
+        'cache_age': time.time() - cache_timestamp if cache_timestamp else None,
+        'refreshing': feed_refresh_task is not None and not feed_refresh_task.done(),
+        'last_error': feed_last_error,
+        'failures': feed_failures,
+    }
+
+
+def _post_to_result(post: PostItem) -> InlineQueryResult:
+    """Inline-результат для поста."""
+    caption = post.caption or ''
+    content = post.content or caption
+    title_source = caption or content or DEFAULT_TITLE
+    title = title_source[:64]
+    description = caption[:96] if caption else None
+
+    link = getattr(post, 'link', None) or ''
+
+    # Медиа отправляем как есть, если знаем его file_id: из ручного поста
+    # или из кэша медиа (Telethon сам file_id для Bot API не даёт)
+    media: Optional[tuple[str, str]] = (post.type, post.file_id) if post.file_id else None
+    if media is None and post.type != 'text' and media_store is not None and post.channel in MEDIA_CHANNELS:
+        media = media_store.get(post.message_id)
+    if media is not None:
+        media_caption = f"{content}\n\n🔗 {link}".strip() if link else content
+        return _cached_media_result(post, media, title, description, media_caption[:1024])
+
+    # Иначе отправляем текст с ссылкой на оригинал и типом поста
+    emoji = POST_TYPE_EMOJI.get(post.type, '📝')
+    
+    final_content = content or DEFAULT_TITLE
+    if link:
+        final_content = f"{emoji} {final_content}\n\n🔗 {link}".strip()
+    else:
+        final_content = f"{emoji} {final_content}".strip()
+    
+    return InlineQueryResultArticle(
+        id=_result_id(post),
+        title=title,
+        description=description or f"Нажмите, чтобы увидеть полный пост{(' с ' + post.type) if post.type != 'text' else ''}",
+        input_message_content=InputTextMessageContent(
+            final_content,
+            parse_mode='HTML'
+        )
+    )
+
+
+def _result_id(post: PostItem) -> str:
+    """id inline-результата: message_id разных каналов могут совпадать."""
+    if post.channel:
+        return f"post_{post.channel}_{post.message_id}"
+    return f"post_{post.message_id}"
+
+
+def _cached_media_result(
+    post: PostItem, media: tuple[str, str], title: str, description: Optional[str], caption: str
+) -> InlineQueryResult:
+    """Inline-результат с медиа по file_id, без передачи файла."""
+    media_type, file_id = media
+    result_id = _result_id(post)
+    if media_type == 'photo':
+        return InlineQueryResultCachedPhoto(
+            id=result_id, photo_file_id=file_id, title=title, description=description, caption=caption
+        )
+    if media_type == 'video':
+        return InlineQueryResultCachedVideo(
+            id=result_id, video_file_id=file_id, title=title, description=description, caption=caption
+        )
+    if media_type == 'sticker':
+        return InlineQueryResultCachedSticker(id=result_id, sticker_file_id=file_id)
+    return InlineQueryResultCachedDocument(
+        id=result_id, document_file_id=file_id, title=title, description=description, caption=caption
+    )
+
+
+def _parse_offset(offset: str) -> int:
+    """Позиция начала страницы inline-ответа из offset (пустой или чужой offset — первая страница)."""
+    try:
+        return max(int(offset), 0)
+    except ValueError:
+        return 0
+
+
+def _ranked_page(query: str, offset: str, user_id: int = 0) -> tuple[List[PostItem], str, bool]:
+    """Страница результатов для режима ranked, offset следующей страницы ('' — страниц больше нет)
+    и признак того, что страница собрана из мешка пользователя и не годится для других.
+    """
+    start = _parse_offset(offset)
+    # Работаем с позициями в кэше: PostItem собираются только для постов страницы
+    positions: List[int] = []
+    if query:
+        positions = search_index.rank_positions(query)
+        if positions:
+            logger.info("После фильтрации по запросу '%s': %d постов", query, len(positions))
+    if positions:
+        page_positions = positions[start:start + INLINE_PAGE_SIZE]
+        total = len(positions)
+    else:
+        # Пустой запрос или нет совпадений: случайные посты с учётом весов,
+        # следующие страницы продолжают мешок пользователя — без повторов
+        total = len(search_index)
+        page_positions = [selection_engine.draw(user_id) for _ in range(max(0, min(INLINE_PAGE_SIZE, total - start)))]
+
+    page = [search_index.posts[position] for position in page_positions]
+    next_start = start + INLINE_PAGE_SIZE
+    next_offset = str(next_start) if next_start < total else ''
+    return page, next_offset, not positions
 
 
 async def inline_query(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -472,29 +1706,26 @@ async def inline_query(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     query = (inline.query or '').strip().lower()
+    user_id = inline.from_user.id if inline.from_user else 0
     logger.info("Получен inline-запрос: '%s'", query)
 
+    # Не ждём загрузки: отвечаем по текущему снимку, а устаревший кэш обновится в фоне
+    stage_started = time.perf_counter()
     try:
         await ensure_posts_loaded()
     except Exception as error:
         logger.error("Ошибка при загрузке постов: %s", error)
+    INLINE_ENSURE_SECONDS.observe(time.perf_counter() - stage_started)
 
-    # Фильтруем посты по запросу (если есть)
-    posts: List[PostItem] = list(posts_cache)
-    logger.info("Inline запрос: кэш содержит %d постов", len(posts))
-    
-    if query:
-        filtered = [
-            p for p in posts
-            if query in (p.caption or p.content or '').lower()
-        ]
-        if filtered:
-            posts = filtered
-            logger.info("После фильтрации по запросу '%s': %d постов", query, len(posts))
+    logger.info("Inline запрос: кэш содержит %d постов", len(posts_cache))
+    stage_started = time.perf_counter()
 
     results: List[InlineQueryResult]
+    next_offset = ''
+    cache_time = 1
+    is_personal = True
 
-    if not posts:
+    if not posts_cache:
         logger.warning("Кэш пуст или нет подходящих постов. Всего в кэше: %d", len(posts_cache))
         # Если кэш пуст или нет подходящих постов
         results = [
@@ -507,55 +1738,101 @@ async def inline_query(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 )
             )
         ]
-    else:
-        # Выбираем случайный пост
-        random_post = random.choice(posts)
-        caption = random_post.caption or ''
-        content = random_post.content or caption
-        title_source = caption or content or DEFAULT_TITLE
-        title = title_source[:64]
-        description = caption[:96] if caption else None
-
-        results = []
-
-        # Формируем результат - всегда отправляем текст с ссылкой на оригинал
-        # (Telethon не даёт file_id для Bot API, поэтому медиа не пересылаем напрямую)
-        link = getattr(random_post, 'link', None) or ''
-        
-        # Формируем текст с информацией о типе поста
-        type_emoji = {
-            'photo': '📷',
-            'document': '📄',
-            'video': '🎥',
-            'sticker': '😊',
-            'text': '📝'
-        }
-        emoji = type_emoji.get(random_post.type, '📝')
-        
-        final_content = content or DEFAULT_TITLE
-        if link:
-            final_content = f"{emoji} {final_content}\n\n🔗 {link}".strip()
-        else:
-            final_content = f"{emoji} {final_content}".strip()
-        
-        results = [
-            InlineQueryResultArticle(
-                id=f"post_{random_post.message_id}",
-                title=title,
-                description=description or f"Нажмите, чтобы увидеть полный пост{(' с ' + random_post.type) if random_post.type != 'text' else ''}",
-                input_message_content=InputTextMessageContent(
-                    final_content,
-                    parse_mode='HTML'
-                )
-            )
-        ]
+    elif INLINE_MODE == 'random':
+        # Фильтруем посты по запросу (если есть) и выбираем случайный, который пользователь ещё не видел
+        position: Optional[int] = None
+        if query:
+            filtered = search_index.search_positions(query)
+            if filtered:
+                logger.info("После фильтрации по запросу '%s': %d постов", query, len(filtered))
+                position = selection_engine.draw_from(user_id, filtered)
+        if position is None:
+            position = selection_engine.draw(user_id)
+        results = [_post_to_result(search_index.posts[position])]
         logger.info("Сформирован результат для inline-запроса: %d элементов", len(results))
-
+    else:
+        page, next_offset, drawn = _ranked_page(query, inline.offset or '', user_id)
+        # id результатов в одном ответе должны быть уникальны (ручной пост может совпасть с постом фида)
+        unique: Dict[tuple[str, int], PostItem] = {}
+        for post in page:
+            unique.setdefault(post.key, post)
+        results = [_post_to_result(post) for post in unique.values()]
+        cache_time = INLINE_CACHE_TIME
+        # Страницы из мешка свои у каждого пользователя: общий кэш Telegram отдал бы
+        # всем одну первую страницу, а вторая из своего мешка повторяла бы её посты
+        is_personal = INLINE_PERSONAL or drawn
+        logger.info("Сформирована страница inline-ответа: %d элементов, next_offset='%s'", len(results), next_offset)
+
+    INLINE_FILTER_SECONDS.observe(time.perf_counter() - stage_started)
+    INLINE_QUERIES.inc(mode=INLINE_MODE if posts_cache else 'empty')
+
+    stage_started = time.perf_counter()
     try:
-        await inline.answer(results, cache_time=1, is_personal=True)
+        await inline.answer(results, cache_time=cache_time, is_personal=is_personal, next_offset=next_offset)
         logger.info("Ответ на inline-запрос отправлен успешно")
     except Exception as error:
         logger.error("Ошибка при отправке ответа на inline-запрос: %s", error)
+    INLINE_ANSWER_SECONDS.observe(time.perf_counter() - stage_started)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    """Отдаёт метрики бота на GET /metrics."""
+
+    def do_GET(self) -> None:
+        if self.path.split('?', 1)[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = metrics_registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', METRICS_CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        # Опросы Prometheus не засоряют лог бота
+        pass
+
+
+def start_metrics_server(host: str, port: int) -> ThreadingHTTPServer:
+    """Поднимает HTTP-сервер /metrics в фоновом потоке."""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    logger.info("Метрики бота доступны на http://%s:%d/metrics", host, port)
+    return server
+
+
+async def on_startup(application: Application) -> None:
+    """Поднимает фид, загружает посты и запускает фоновые задачи после инициализации приложения."""
+    if MEDIA_STORAGE_CHAT_ID and MEDIA_SOURCE_CHAT:
+        start_media_pipeline(application)
+
+    if not POSTS_FEED_URL:
+        return
+
+    # Запускаем парсер, если нужно
+    await start_feed_process_if_needed()
+
+    logger.info("Попытка загрузить посты из %s", POSTS_FEED_URL)
+    await refresh_posts_in_background(force=True)
+    logger.info("Текущий размер кэша: %d постов", len(posts_cache))
+    if len(posts_cache) == 0:
+        logger.warning("⚠️ Кэш пуст! Проверьте, что парсер запущен и доступен на %s", POSTS_FEED_URL)
+        logger.warning("Попробуйте команду /test_feed в боте для диагностики")
+
+    application.bot_data['feed_refresher'] = asyncio.create_task(feed_refresher())
+    logger.info("Фоновое обновление кэша запущено (раз в %d сек)", CACHE_TTL_SECONDS)
+
+
+async def on_shutdown(application: Application) -> None:
+    """Останавливает фоновые задачи и закрывает соединения с фидом."""
+    for name in ('feed_refresher', 'media_pipeline'):
+        task = application.bot_data.pop(name, None)
+        if task is not None:
+            task.cancel()
+    await close_feed_http()
+    if media_store is not None:
+        media_store.close()
 
 
 def main():
@@ -572,8 +1849,17 @@ def main():
     
     # Создаем приложение
     try:
-        application = Application.builder().token(BOT_TOKEN).build()
-        logger.info("Приложение создано успешно")
+        builder = (
+            Application.builder()
+            .token(BOT_TOKEN)
+            .concurrent_updates(BOT_CONCURRENT_UPDATES)
+            .post_init(on_startup)
+            .post_shutdown(on_shutdown)
+        )
+        if BOT_API_BASE_URL:
+            builder = builder.base_url(BOT_API_BASE_URL)
+        application = builder.build()
+        logger.info("Приложение создано успешно (одновременно обрабатывается до %d обновлений)", BOT_CONCURRENT_UPDATES)
     except Exception as e:
         logger.error("Ошибка при создании приложения: %s", e)
         return
@@ -594,26 +1880,25 @@ def main():
     logger.info("  - inline_query зарегистрирован")
     logger.info("Все обработчики зарегистрированы")
     
-    # Запускаем парсер, если нужно
-    start_feed_process_if_needed()
-    
-    # Запускаем бота
+    # Запускаем бота (парсер и первая загрузка постов — в on_startup, уже на event loop)
     logger.info("=" * 50)
     logger.info("Бот запущен и готов к работе!")
     logger.info("=" * 50)
-    if POSTS_FEED_URL:
-        logger.info("Попытка загрузить посты из %s", POSTS_FEED_URL)
-        # Ждём немного, чтобы парсер успел запуститься
-        import time
-        time.sleep(3)
-        fetch_posts_from_feed(force=True)
-        logger.info("Текущий размер кэша: %d постов", len(posts_cache))
-        if len(posts_cache) == 0:
-            logger.warning("⚠️ Кэш пуст! Проверьте, что парсер запущен и доступен на %s", POSTS_FEED_URL)
-            logger.warning("Попробуйте команду /test_feed в боте для диагностики")
-    else:
+    if not POSTS_FEED_URL:
         logger.warning("POSTS_FEED_URL не указан, бот будет работать только с ручными постами")
     
+    if BOT_METRICS_PORT:
+        try:
+            start_metrics_server(BOT_METRICS_HOST, int(BOT_METRICS_PORT))
+        except (OSError, ValueError) as e:
+            logger.error("Не удалось поднять сервер метрик на порту %s: %s", BOT_METRICS_PORT, e)
+
+    if BOT_MODE == 'webhook':
+        run_webhook(application)
+        return
+    if BOT_MODE != 'polling':
+        logger.warning("Неизвестный BOT_MODE=%s, используем polling", BOT_MODE)
+
     try:
         logger.info("Запуск polling...")
         application.run_polling()
@@ -622,6 +1907,38 @@ def main():
         raise
 
 
+def run_webhook(application: Application) -> None:
+    """Принимает обновления через webhook на WEBHOOK_LISTEN:WEBHOOK_PORT/WEBHOOK_PATH.
+
+    Запросы без правильного X-Telegram-Bot-Api-Secret-Token отклоняются (403).
+    """
+    secret = WEBHOOK_SECRET or secrets.token_urlsafe(32)
+    if not WEBHOOK_SECRET:
+        logger.info("WEBHOOK_SECRET не задан, для этого запуска сгенерирован случайный секрет")
+    if not WEBHOOK_URL:
+        logger.warning(
+            "WEBHOOK_URL не указан: Telegram получит адрес слушателя http://%s:%d/%s "
+            "(для api.telegram.org нужен публичный https-адрес)",
+            WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH
+        )
+    try:
+        logger.info("Запуск webhook на %s:%d/%s...", WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH)
+        application.run_webhook(
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            url_path=WEBHOOK_PATH,
+            webhook_url=WEBHOOK_URL or None,
+            secret_token=secret,
+        )
+    except RuntimeError as e:
+        # PTB без extras [webhooks] (tornado) не умеет поднимать слушатель
+        logger.error("Не удалось запустить webhook: %s. Установите python-telegram-bot[webhooks]", e)
+        raise
+    except Exception as e:
+        logger.error("КРИТИЧЕСКАЯ ОШИБКА при запуске webhook: %s", e, exc_info=True)
+        raise
+
+
 if __name__ == '__main__':
     main()
 
@@ -0,0 +1,145 @@
+"""
+Двоичный снимок кэша постов для обмена парсера и бота на одной машине.
+
+Парсер (app.py) пишет каждую версию кэша в файл и атомарно подменяет его
+(os.replace), бот (bot.py) отображает файл в память только для чтения и
+достаёт посты по индексу — без HTTP, разбора JSON и второй копии кэша в куче.
+
+Формат (little-endian):
+    заголовок  — магия KTSN, версия формата, версия кэша, время обновления, число постов,
+                 размер таблицы каналов;
+    каналы     — имена каналов-источников в UTF-8 через перевод строки;
+    таблица    — по записи на пост: message_id, код типа, номер канала, дата,
+                 смещение и длины текста и ссылки;
+    данные     — тексты и ссылки в UTF-8 подряд.
+"""
+
+import mmap
+import os
+import struct
+import sys
+from typing import Dict, Iterable, List, Optional, Tuple
+
+MAGIC = b"KTSN"
+FORMAT_VERSION = 2
+# magic, формат, резерв, версия кэша, время обновления (unix), число постов, размер таблицы каналов
+_HEADER = struct.Struct("<4sHHQdII")
+# message_id, код типа, номер канала, дата (unix), смещение текста от начала данных, длина текста, длина ссылки
+_RECORD = struct.Struct("<qBBxxIQII")
+MAX_CHANNELS = 256
+# Код типа поста — его индекс в этом кортеже
+POST_TYPES = ("text", "photo", "video", "document", "sticker")
+_TYPE_CODES = {post_type: code for code, post_type in enumerate(POST_TYPES)}
+
+# Пост в снимке: message_id, тип, текст, ссылка, канал, дата
+SnapshotRecord = Tuple[int, str, str, Optional[str], str, int]
+
+
+class SnapshotFormatError(ValueError):
+    """Файл не является снимком поддерживаемого формата или обрезан."""
+
+
+def write_snapshot(path: str, posts: Iterable[SnapshotRecord], version: int, updated_at: float) -> None:
+    """Пишет снимок во временный файл рядом с path и атомарно ставит его на место.
+
+    Читатели, которые уже отобразили прежний файл, продолжают видеть его целиком.
+    """
+    records: List[bytes] = []
+    chunks: List[bytes] = []
+    channels: Dict[str, int] = {}
+    offset = 0
+    for message_id, post_type, text, link, channel, date in posts:
+        channel_code = channels.setdefault(channel, len(channels))
+        if channel_code >= MAX_CHANNELS:
+            raise ValueError(f"В снимке не больше {MAX_CHANNELS} каналов")
+        text_bytes = text.encode("utf-8")
+        link_bytes = (link or "").encode("utf-8")
+        records.append(
+            _RECORD.pack(
+                message_id,
+                _TYPE_CODES.get(post_type, 0),
+                channel_code,
+                date,
+                offset,
+                len(text_bytes),
+                len(link_bytes),
+            )
+        )
+        chunks.append(text_bytes)
+        chunks.append(link_bytes)
+        offset += len(text_bytes) + len(link_bytes)
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "wb") as file:
+            channel_table = "\n".join(channels).encode("utf-8")
+            file.write(
+                _HEADER.pack(MAGIC, FORMAT_VERSION, 0, version, updated_at, len(records), len(channel_table))
+            )
+            file.write(channel_table)
+            file.writelines(records)
+            file.writelines(chunks)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+class MappedSnapshot:
+    """Снимок, отображённый в память только для чтения.
+
+    Записи декодируются по одной при обращении; отображение закрывается,
+    когда на объект больше никто не ссылается.
+    """
+
+    def __init__(self, path: str) -> None:
+        with open(path, "rb") as file:
+            stat = os.fstat(file.fileno())
+            if stat.st_size < _HEADER.size:
+                raise SnapshotFormatError(f"{path}: файл короче заголовка")
+            self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        # По (inode, mtime, размер) видно, что файл подменили новой версией
+        self.file_key: Tuple[int, int, int] = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        magic, format_version, _, self.version, self.updated_at, self.count, channels_size = _HEADER.unpack_from(
+            self._map, 0
+        )
+        if magic != MAGIC or format_version != FORMAT_VERSION:
+            raise SnapshotFormatError(f"{path}: неизвестный формат снимка")
+        self._records_offset = _HEADER.size + channels_size
+        if self._records_offset > stat.st_size:
+            raise SnapshotFormatError(f"{path}: таблица каналов обрезана")
+        channel_table = str(self._map[_HEADER.size:self._records_offset], "utf-8")
+        # Имена интернированы: в постах бота — ссылки на одни и те же строки
+        self.channels: Tuple[str, ...] = tuple(sys.intern(name) for name in channel_table.split("\n"))
+        self._data_offset = self._records_offset + self.count * _RECORD.size
+        if self._data_offset > stat.st_size:
+            raise SnapshotFormatError(f"{path}: таблица постов обрезана")
+
+    def __len__(self) -> int:
+        return self.count
+
+    def record(self, index: int) -> SnapshotRecord:
+        """Пост под номером index (в порядке кэша парсера — от новых к старым)."""
+        if not 0 <= index < self.count:
+            raise IndexError(index)
+        message_id, type_code, channel_code, date, offset, text_len, link_len = _RECORD.unpack_from(
+            self._map, self._records_offset + index * _RECORD.size
+        )
+        start = self._data_offset + offset
+        text = str(self._map[start:start + text_len], "utf-8")
+        link = str(self._map[start + text_len:start + text_len + link_len], "utf-8") if link_len else None
+        post_type = POST_TYPES[type_code] if type_code < len(POST_TYPES) else POST_TYPES[0]
+        channel = self.channels[channel_code] if channel_code < len(self.channels) else ""
+        return message_id, post_type, text, link, channel, date
+
+
+def snapshot_file_key(path: str) -> Optional[Tuple[int, int, int]]:
+    """(inode, mtime, размер) файла снимка или None, если файла нет."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
@@ -0,0 +1,20 @@
+"""
+Разбор POSTS_FEED_URL — общий для бота (куда ходить за фидом) и парсера (где слушать).
+
+Адрес один на оба процесса, поэтому и разбирается он в одном месте: иначе
+запущенный отдельно парсер может слушать не там, где его ищет бот.
+"""
+
+from typing import Optional, Tuple
+
+
+def split_unix_feed_url(url: str) -> Tuple[Optional[str], Optional[str]]:
+    """Разбирает POSTS_FEED_URL на путь Unix-сокета и HTTP-адрес запросов.
+
+    unix:///run/kinotip/feed.sock или unix:///run/kinotip/feed.sock:/feed —
+    запросы идут через сокет, путь HTTP по умолчанию /feed. Для http:// сокета нет.
+    """
+    if not url or not url.startswith("unix://"):
+        return None, url
+    socket_path, _, http_path = url[len("unix://"):].partition(":")
+    return socket_path, "http://localhost" + (http_path or "/feed")
@@ -0,0 +1,222 @@
+"""
+Кэш file_id медиа из канала, чтобы inline-ответы отправляли настоящие фото и видео.
+
+У постов, собранных Telethon, нет file_id для Bot API. Поэтому каждый пост с
+медиа один раз пересылается ботом в служебный чат: из пересланного сообщения
+берётся file_id, и он сохраняется в SQLite. Дальше inline-ответы используют
+InlineQueryResultCached* без передачи файла на каждый запрос.
+
+Обращение к Bot API вынесено в BotApiClient, поэтому конвейер можно
+гонять против локальной подделки.
+"""
+
+import asyncio
+import logging
+import sqlite3
+import time
+from typing import Any, Dict, Optional, Protocol, Set, Tuple
+
+try:
+    from telegram.error import BadRequest, NetworkError
+except ImportError:  # конвейер можно гонять против подделки и без python-telegram-bot
+    BadRequest = NetworkError = None  # type: ignore[assignment,misc]
+
+logger = logging.getLogger(__name__)
+
+# Тип медиа и file_id
+MediaRef = Tuple[str, str]
+# Потолок паузы перед повтором пересылки после сетевого сбоя, сек
+MAX_RETRY_DELAY = 600.0
+
+
+def is_transient_error(error: Exception) -> bool:
+    """Временный сбой (таймаут, обрыв сети): пересылку стоит повторить, а не записывать в ошибки.
+
+    BadRequest в python-telegram-bot — тоже NetworkError, но он постоянный:
+    сообщения нет или его нельзя переслать.
+    """
+    if isinstance(error, (ConnectionError, TimeoutError, asyncio.TimeoutError)):
+        return True
+    if NetworkError is None:
+        return False
+    return isinstance(error, NetworkError) and not isinstance(error, BadRequest)
+
+
+def message_media(message: Any) -> Optional[MediaRef]:
+    """Тип и file_id медиа из сообщения Bot API (telegram.Message); None — медиа нет."""
+    if getattr(message, "photo", None):
+        return "photo", message.photo[-1].file_id
+    if getattr(message, "document", None):
+        return "document", message.document.file_id
+    if getattr(message, "video", None):
+        return "video", message.video.file_id
+    if getattr(message, "sticker", None):
+        return "sticker", message.sticker.file_id
+    return None
+
+
+class BotApiClient(Protocol):
+    """То, что конвейеру нужно от Bot API."""
+
+    async def forward_message(self, chat_id: Any, from_chat_id: Any, message_id: int) -> Optional[MediaRef]:
+        """Пересылает сообщение и возвращает медиа пересланной копии (None — медиа нет)."""
+        ...
+
+
+class PTBBotApiClient:
+    """BotApiClient поверх telegram.Bot из python-telegram-bot."""
+
+    def __init__(self, bot: Any) -> None:
+        self.bot = bot
+
+    async def forward_message(self, chat_id: Any, from_chat_id: Any, message_id: int) -> Optional[MediaRef]:
+        message = await self.bot.forward_message(
+            chat_id=chat_id,
+            from_chat_id=from_chat_id,
+            message_id=message_id,
+            disable_notification=True,
+        )
+        return message_media(message)
+
+
+class MediaFileStore:
+    """file_id медиа по message_id поста канала, в SQLite.
+
+    Неудачные попытки тоже запоминаются (file_id пустой), чтобы не
+    пересылать заведомо недоступные сообщения снова и снова.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS media_files ("
+            "message_id INTEGER PRIMARY KEY, type TEXT, file_id TEXT, error TEXT, updated_at REAL)"
+        )
+        self._conn.commit()
+        self.files: Dict[int, MediaRef] = {}
+        self.failed: Set[int] = set()
+        for message_id, media_type, file_id in self._conn.execute("SELECT message_id, type, file_id FROM media_files"):
+            if file_id:
+                self.files[message_id] = (media_type, file_id)
+            else:
+                self.failed.add(message_id)
+
+    def __contains__(self, message_id: int) -> bool:
+        """Для поста уже есть результат: file_id или зафиксированная ошибка."""
+        return message_id in self.files or message_id in self.failed
+
+    def get(self, message_id: int) -> Optional[MediaRef]:
+        return self.files.get(message_id)
+
+    def put(self, message_id: int, media: MediaRef) -> None:
+        self.files[message_id] = media
+        self.failed.discard(message_id)
+        self._save(message_id, media[0], media[1], None)
+
+    def put_failure(self, message_id: int, error: str) -> None:
+        self.failed.add(message_id)
+        self._save(message_id, None, None, error)
+
+    def _save(self, message_id: int, media_type: Optional[str], file_id: Optional[str], error: Optional[str]) -> None:
+        self._conn.execute(
+            "INSERT OR REPLACE INTO media_files (message_id, type, file_id, error, updated_at) VALUES (?, ?, ?, ?, ?)",
+            (message_id, media_type, file_id, error, time.time()),
+        )
+        self._conn.commit()
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+class MediaPipeline:
+    """Фоновая очередь: пересылает посты с медиа в служебный чат и сохраняет их file_id.
+
+    Пересылки идут не чаще одной в interval секунд (лимиты Bot API на
+    сообщения в чат); на RetryAfter конвейер ждёт, сколько попросил Telegram.
+    После временного сбоя сети пост возвращается в очередь с растущей
+    паузой и в хранилище ничего не пишется: в ошибки попадают только
+    постоянные отказы (BadRequest, Forbidden).
+    """
+
+    def __init__(
+        self,
+        client: BotApiClient,
+        store: MediaFileStore,
+        storage_chat_id: Any,
+        source_chat_id: Any,
+        interval: float = 3.0,
+    ) -> None:
+        self.client = client
+        self.store = store
+        self.storage_chat_id = storage_chat_id
+        self.source_chat_id = source_chat_id
+        self.interval = interval
+        self._queue: "asyncio.Queue[int]" = asyncio.Queue()
+        self._pending: Set[int] = set()
+        # Сколько раз подряд пересылка поста срывалась из-за сети
+        self._retries: Dict[int, int] = {}
+
+    def enqueue(self, message_id: int) -> bool:
+        """Ставит пост в очередь, если для него ещё нет результата."""
+        if message_id in self.store or message_id in self._pending:
+            return False
+        self._pending.add(message_id)
+        self._queue.put_nowait(message_id)
+        return True
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    async def process(self, message_id: int) -> Optional[MediaRef]:
+        """Одна пересылка: сохраняет file_id или ошибку."""
+        while True:
+            try:
+                media = await self.client.forward_message(self.storage_chat_id, self.source_chat_id, message_id)
+            except Exception as error:
+                retry_after = getattr(error, "retry_after", None)
+                if retry_after is not None:
+                    delay = retry_after.total_seconds() if hasattr(retry_after, "total_seconds") else float(retry_after)
+                    logger.warning("Bot API просит подождать %.0f сек перед пересылкой медиа", delay)
+                    await asyncio.sleep(delay)
+                    continue
+                if is_transient_error(error):
+                    self._retry_later(message_id, error)
+                    return None
+                logger.warning("Не удалось переслать пост %d в служебный чат: %s", message_id, error)
+                self._retries.pop(message_id, None)
+                self.store.put_failure(message_id, str(error))
+                return None
+            break
+        self._retries.pop(message_id, None)
+        if media is None:
+            self.store.put_failure(message_id, "нет медиа")
+            return None
+        self.store.put(message_id, media)
+        return media
+
+    def _retry_later(self, message_id: int, error: Exception) -> None:
+        """Возвращает пост в очередь через паузу, удваивающуюся с каждым сбоем подряд."""
+        attempt = self._retries.get(message_id, 0) + 1
+        self._retries[message_id] = attempt
+        delay = min(self.interval * 2**attempt, MAX_RETRY_DELAY)
+        logger.warning(
+            "Сбой сети при пересылке поста %d (%s), повтор через %.0f сек", message_id, error, delay
+        )
+        asyncio.get_running_loop().call_later(delay, self._queue.put_nowait, message_id)
+
+    async def run(self) -> None:
+        """Разбирает очередь, пока задачу не отменят."""
+        while True:
+            message_id = await self._queue.get()
+            try:
+                media = await self.process(message_id)
+                if media is not None:
+                    logger.info("file_id для поста %d (%s) сохранён", message_id, media[0])
+            finally:
+                # Пост, ждущий повтора, остаётся в _pending: повторно его не поставят
+                if message_id not in self._retries:
+                    self._pending.discard(message_id)
+            await asyncio.sleep(self.interval)
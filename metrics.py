@@ -0,0 +1,171 @@
+"""
+Метрики в текстовом формате Prometheus для парсера (app.py) и бота (bot.py).
+
+Без сторонних зависимостей: счётчики, значения и гистограммы с метками.
+Запись метрики — пара операций со словарём под коротким локом, поэтому
+её можно ставить прямо в горячий путь.
+"""
+
+import threading
+from bisect import bisect_left
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+# Границы гистограмм по умолчанию, в секундах
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _format_labels(names: Sequence[str], values: LabelValues, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(zip(names, values))
+    if extra is not None:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    escaped = (
+        (name, value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')) for name, value in pairs
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Metric:
+    """Общая часть метрик: имя, описание, метки, реестр."""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), *, registry: "Registry"):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self) -> Iterator[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    """Монотонно растущий счётчик."""
+
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[LabelValues, float] = {} if self.labelnames else {(): 0.0}
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def samples(self) -> Iterator[str]:
+        for key, value in sorted(self._values.items()):
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class Gauge(Metric):
+    """Значение, которое вычисляется в момент выдачи метрик (set_function)."""
+
+    kind = "gauge"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._function: Optional[Callable[[], Optional[float]]] = None
+
+    def set_function(self, function: Callable[[], Optional[float]]) -> None:
+        """Значение берётся из function в момент выдачи метрик (None — метрика пропускается)."""
+        self._function = function
+
+    def samples(self) -> Iterator[str]:
+        value = self._function() if self._function is not None else None
+        if value is not None:
+            yield f"{self.name} {_format_value(value)}"
+
+
+class Histogram(Metric):
+    """Распределение значений по корзинам (обычно длительностей в секундах)."""
+
+    kind = "histogram"
+
+    def __init__(self, *args, buckets: Sequence[float] = DEFAULT_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(sorted(buckets))
+        # Для каждого набора меток: счётчики по корзинам (+ последняя — +Inf), сумма
+        self._series: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+
+    def _get_series(self, key: LabelValues) -> Tuple[List[int], List[float]]:
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = ([0] * (len(self.buckets) + 1), [0.0])
+            return series
+
+    def observe(self, value: float, **labels: str) -> None:
+        counts, total = self._get_series(self._key(labels))
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            counts[index] += 1
+            total[0] += value
+
+    def labels(self, **labels: str) -> "BoundHistogram":
+        """Серия с заранее выбранными метками — для горячего пути."""
+        return BoundHistogram(self, self._get_series(self._key(labels)))
+
+    def samples(self) -> Iterator[str]:
+        for key, (counts, total) in sorted(self._series.items()):
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float("inf")), counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, ("le", _format_value(bound)))
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _format_labels(self.labelnames, key)
+            yield f"{self.name}_sum{labels} {_format_value(total[0])}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+class BoundHistogram:
+    """Гистограмма с зафиксированными метками: observe без разбора меток."""
+
+    __slots__ = ("_buckets", "_lock", "_counts", "_total")
+
+    def __init__(self, histogram: Histogram, series: Tuple[List[int], List[float]]):
+        self._buckets = histogram.buckets
+        self._lock = histogram._lock
+        self._counts, self._total = series
+
+    def observe(self, value: float) -> None:
+        index = bisect_left(self._buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._total[0] += value
+
+
+class Registry:
+    """Набор метрик процесса."""
+
+    def __init__(self) -> None:
+        self._metrics: List[Metric] = []
+
+    def register(self, metric: Metric) -> None:
+        self._metrics.append(metric)
+
+    def render(self) -> str:
+        """Все метрики в текстовом формате Prometheus (version 0.0.4)."""
+        return "\n".join(metric.render() for metric in self._metrics) + "\n"
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"